@@ -1,3 +1,10 @@
 from django.contrib import admin
+from .models import Field
 
 # Register your models here.
+
+
+@admin.register(Field)
+class FieldAdmin(admin.ModelAdmin):
+    list_display = ('name', 'crop', 'sowing_date')
+    search_fields = ('name',)
@@ -0,0 +1,263 @@
+import contextvars
+import logging
+import math
+import random
+import time
+from functools import wraps
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from . import metrics_service
+from .async_service import run_blocking
+from .metrics_service import metrics, span
+
+# The one bucket every Earth Engine round trip draws from
+BUCKET = 'earth-engine'
+
+DEFAULTS = {
+    'ENABLED': True,
+    'STORE': 'database',
+    'ALIAS': 'default',
+    'RATE': 10.0,
+    'BURST': 100.0,
+    'RESERVES': {'interactive': 0.0, 'bulk': 0.25, 'background': 0.5},
+    'MAX_WAIT': 30.0,
+}
+
+_current_priority = contextvars.ContextVar('admission_priority', default=None)
+
+
+class QuotaExceeded(Exception):
+    """The shared Earth Engine request budget cannot cover a call at this priority"""
+
+    def __init__(self, priority, retry_after):
+        self.priority = priority
+        self.retry_after = retry_after
+        super().__init__(f"Earth Engine request budget exhausted for {priority} requests, "
+                         f"retry in {retry_after} s")
+
+
+def refill(tokens, updated_at, now, rate, burst):
+    return min(burst, tokens + max(0.0, now - updated_at) * rate)
+
+
+def grant(tokens, cost, floor):
+    """
+    True if cost tokens can be taken with at least floor left; cost 0 (the
+    admission check) asks for one spare token without taking it
+    """
+    return tokens - max(cost, 1) >= floor
+
+
+class DatabaseBucketStore:
+    """
+    Keeps the bucket in the QuotaBucket table. A take is a compare-and-swap
+    on the row's version, retried when another worker wrote first.
+    """
+
+    def __init__(self, retries=20):
+        self.retries = retries
+
+    def take(self, name, cost, floor, rate, burst):
+        """(granted, tokens left) after trying to take cost tokens"""
+        from .models import QuotaBucket
+
+        tokens = 0.0
+        for _ in range(self.retries):
+            now = time.time()
+            bucket = QuotaBucket.objects.filter(name=name).first()
+            if bucket is None:
+                try:
+                    with transaction.atomic():
+                        bucket = QuotaBucket.objects.create(name=name, tokens=burst, updated_at=now)
+                except IntegrityError:
+                    # Another worker created it first
+                    continue
+            tokens = refill(bucket.tokens, bucket.updated_at, now, rate, burst)
+            if not grant(tokens, cost, floor):
+                return False, tokens
+            if cost == 0:
+                return True, tokens
+            if QuotaBucket.objects.filter(pk=bucket.pk, version=bucket.version).update(
+                    tokens=tokens - cost, updated_at=now, version=bucket.version + 1):
+                return True, tokens - cost
+        return False, tokens
+
+
+class DjangoCacheBucketStore:
+    """
+    Keeps the bucket in one of the Django CACHES aliases, updated under a
+    short lock. The cache must be shared by the workers (Redis, Memcached,
+    database), not LocMemCache.
+    """
+
+    def __init__(self, alias='default', lock_timeout=1.0):
+        self.alias = alias
+        self.lock_timeout = lock_timeout
+
+    def take(self, name, cost, floor, rate, burst):
+        cache = caches[self.alias]
+        key = f'quota:{name}'
+        lock = f'{key}:lock'
+        deadline = time.monotonic() + self.lock_timeout
+        while not cache.add(lock, 1, timeout=5):
+            if time.monotonic() > deadline:
+                return False, 0.0
+            time.sleep(0.002)
+        try:
+            now = time.time()
+            tokens, updated_at = cache.get(key) or (burst, now)
+            tokens = refill(tokens, updated_at, now, rate, burst)
+            if not grant(tokens, cost, floor):
+                return False, tokens
+            if cost:
+                cache.set(key, (tokens - cost, now), None)
+            return True, tokens - cost
+        finally:
+            cache.delete(lock)
+
+
+class AdmissionController:
+    """
+    Token bucket of Earth Engine round trips shared by every worker. Each
+    call takes a token; the bucket refills at RATE per second up to BURST.
+    A priority may only draw the bucket down to its reserve
+    (RESERVES[priority] x BURST), so bulk time series stop before they use
+    up the tokens interactive /predict/ calls need.
+    """
+
+    def config(self):
+        return {**DEFAULTS, **getattr(settings, 'EE_ADMISSION', {})}
+
+    @staticmethod
+    def store(config):
+        if config['STORE'] == 'django':
+            return DjangoCacheBucketStore(config['ALIAS'])
+        return DatabaseBucketStore()
+
+    @staticmethod
+    def floor(config, priority):
+        reserves = config['RESERVES']
+        return config['BURST'] * reserves.get(priority, reserves.get('background', 0.0))
+
+    def _take(self, config, priority, cost):
+        """(granted, seconds until the bucket could grant it)"""
+        floor = self.floor(config, priority)
+        try:
+            granted, tokens = self.store(config).take(BUCKET, cost, floor, config['RATE'], config['BURST'])
+        except Exception as e:
+            # Like the extraction cache, a broken store must never fail the request
+            logging.error(f"Admission bucket unavailable: {str(e)}")
+            return True, 0.0
+        return granted, max(0.0, (floor + max(cost, 1) - tokens) / config['RATE'])
+
+    def admit(self, priority):
+        """Called as a request starts: QuotaExceeded unless its priority has a spare token"""
+        config = self.config()
+        if not config['ENABLED']:
+            return
+        granted, wait = self._take(config, priority, 0)
+        metrics.inc('wheathealth_admission_total', {'priority': priority,
+                                                     'outcome': 'admitted' if granted else 'rejected'})
+        if not granted:
+            raise QuotaExceeded(priority, max(1, math.ceil(wait)))
+
+    def acquire(self, cost=1):
+        """
+        Take cost tokens for an Earth Engine call. Inside an admitted request
+        a shortfall raises QuotaExceeded at once. Calls made elsewhere (job
+        workers, management commands, streamed responses) draw at background
+        priority and wait for tokens, for up to MAX_WAIT seconds.
+        """
+        config = self.config()
+        if not config['ENABLED']:
+            return
+        priority = _current_priority.get()
+        can_wait = priority is None
+        priority = priority or 'background'
+        deadline = time.monotonic() + config['MAX_WAIT']
+        while True:
+            granted, wait = self._take(config, priority, cost)
+            if granted:
+                metrics.inc('wheathealth_ee_tokens_total', {'priority': priority, 'outcome': 'granted'}, cost)
+                return
+            if not can_wait or time.monotonic() + wait > deadline:
+                metrics.inc('wheathealth_ee_tokens_total', {'priority': priority, 'outcome': 'rejected'}, cost)
+                raise QuotaExceeded(priority, max(1, math.ceil(wait)))
+            # Jittered, so waiting workers do not all retry at once
+            with span('quota_wait'):
+                time.sleep(wait + random.uniform(0, 0.1))
+
+    def status(self):
+        """The bucket as every worker sees it, with the reserve of each priority"""
+        config = self.config()
+        tokens, error = None, None
+        try:
+            # No floor: a cost-0 take then always succeeds and just reports the level
+            _, tokens = self.store(config).take(BUCKET, 0, -math.inf, config['RATE'], config['BURST'])
+            tokens = round(tokens, 2)
+        except Exception as e:
+            # Calls are let through meanwhile (see _take)
+            logging.error(f"Admission bucket unavailable: {str(e)}")
+            error = str(e)
+        return {
+            'enabled': config['ENABLED'],
+            'store': config['STORE'],
+            'tokens': tokens,
+            'error': error,
+            'rate': config['RATE'],
+            'burst': config['BURST'],
+            'reserves': {priority: self.floor(config, priority) for priority in config['RESERVES']},
+        }
+
+
+admission = AdmissionController()
+
+
+def ee_call(kind, func, *args, **kwargs):
+    """metrics_service.ee_call, once the call has a token from the shared budget"""
+    admission.acquire()
+    return metrics_service.ee_call(kind, func, *args, **kwargs)
+
+
+def quota_response(error):
+    response = JsonResponse({"status": "error", "message": str(error)}, status=429)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def admission_control(priority):
+    """
+    View decorator: admit the request at priority ('interactive', 'bulk'),
+    run its Earth Engine calls at that priority, and answer 429 with
+    Retry-After when the budget runs out instead of degraded results
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                token = _current_priority.set(priority)
+                try:
+                    # The database store must not run on the event loop
+                    await run_blocking(admission.admit, priority)
+                    return await view(request, *args, **kwargs)
+                except QuotaExceeded as e:
+                    return quota_response(e)
+                finally:
+                    _current_priority.reset(token)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            token = _current_priority.set(priority)
+            try:
+                admission.admit(priority)
+                return view(request, *args, **kwargs)
+            except QuotaExceeded as e:
+                return quota_response(e)
+            finally:
+                _current_priority.reset(token)
+        return wrapper
+    return decorator
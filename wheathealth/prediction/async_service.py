@@ -0,0 +1,40 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def blocking_pool():
+    """
+    Thread pool that async views hand blocking work to (ee getInfo()
+    round trips, model inference). ASYNC_BLOCKING_WORKERS bounds how many
+    such calls one ASGI worker has in flight; the event loop itself never
+    blocks, so requests beyond that queue instead of stalling the worker.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=getattr(settings, 'ASYNC_BLOCKING_WORKERS', 64),
+                                       thread_name_prefix='blocking')
+        return _pool
+
+
+def _call(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # The extraction cache may have opened a connection in this thread
+        close_old_connections()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Await func(*args, **kwargs) on the blocking pool"""
+    loop = asyncio.get_running_loop()
+    # Like asyncio.to_thread, carry the context (the request trace) along
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(blocking_pool(), context.run, _call, func, args, kwargs)
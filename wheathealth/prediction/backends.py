@@ -0,0 +1,54 @@
+from django.conf import settings
+from .gee_service import GEEDataExtractor
+
+
+class EarthEngineBackend:
+    """Extraction backend that runs everything on Google Earth Engine"""
+    name = 'earthengine'
+
+    def extract_bands_and_indices(self, geometry, start_date, end_date, cache_geometry=None):
+        return GEEDataExtractor.extract_bands_and_indices(geometry, start_date, end_date, cache_geometry)
+
+    def extract_fields(self, geometries, start_date, end_date, reducer='first', max_features=None,
+                       max_vertices=None):
+        return GEEDataExtractor.extract_fields(geometries, start_date, end_date, reducer, max_features,
+                                               max_vertices)
+
+    def indices_with_fallback(self, geometry, start_date, end_date):
+        return GEEDataExtractor.indices_with_fallback(geometry, start_date, end_date)
+
+    def extract_index_time_series(self, geometry, windows, use_cache=True):
+        return GEEDataExtractor.extract_index_time_series(geometry, windows, use_cache)
+
+    def extract_feature_time_series(self, geometry, windows, use_cache=True):
+        return GEEDataExtractor.extract_feature_time_series(geometry, windows, use_cache)
+
+    def window_fingerprints(self, geometry, windows):
+        return GEEDataExtractor.window_fingerprints(geometry, windows)
+
+    def pixel_grid(self, geometry):
+        return GEEDataExtractor.pixel_grid(geometry)
+
+    def pixel_tiles(self, geometry, start_date, end_date, tile_size=256):
+        return GEEDataExtractor.pixel_tiles(geometry, start_date, end_date, tile_size)
+
+
+_backends = {}
+
+
+def get_backend(name=None):
+    """
+    The extraction backend named by EXTRACTION_BACKEND ('earthengine' or
+    'local'). Both return the same dict shapes.
+    """
+    name = name or getattr(settings, 'EXTRACTION_BACKEND', 'earthengine')
+    if name not in _backends:
+        if name == 'earthengine':
+            _backends[name] = EarthEngineBackend()
+        elif name == 'local':
+            from .local_backend import LocalRasterBackend
+            _backends[name] = LocalRasterBackend(getattr(settings, 'LOCAL_BACKEND_DATA_DIR'),
+                                                getattr(settings, 'LOCAL_BACKEND_LATENCY', 0.0))
+        else:
+            raise ValueError(f"Unknown extraction backend '{name}'")
+    return _backends[name]
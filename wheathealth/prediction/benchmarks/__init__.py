@@ -0,0 +1,7 @@
+"""
+Reproducible benchmarks of the prediction and time-series paths, run by
+`manage.py run_benchmarks`. Requests go through the Django test client
+against the local backend and synthetic scenes, so runs on different
+machines and commits can be compared without Earth Engine access.
+"""
+from .suite import BENCHMARKS, compare, run
@@ -0,0 +1,413 @@
+import gc
+import gzip
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+import django
+import numpy as np
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from .. import backends
+from ..field_service import time_series_windows
+from ..local_backend import write_synthetic_scenes
+from ..model_service import (FEATURE_ORDER, ModelRegistry, WheatHealthPredictor, _resident_bytes,
+                             model_registry)
+from ..middleware import BROTLI_QUALITY, GZIP_LEVEL, brotli
+from ..models import TimeSeriesWindow
+from ..response_service import dumps
+from ..views import FIELD_GEOMETRY
+
+SCENE_START = '2024-01-01'
+BATCH_SIZES = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+
+DEFAULTS = {
+    'repeat': 20,
+    'load_repeat': 5,
+    'batch_sizes': BATCH_SIZES,
+    # predict_batch builds one dict per row; above this size only the
+    # model call (predict_matrix) is measured
+    'record_limit': 10_000,
+    'engines': None,
+    # Seconds per simulated Earth Engine round trip; 0 measures our own overhead
+    'latency': 0.0,
+    # Smallest batches are called repeatedly for at least this long
+    'min_seconds': 0.2,
+}
+
+PREDICT_BODY = {'geometry': FIELD_GEOMETRY, 'start_date': '2024-01-01', 'end_date': '2024-03-01'}
+INDICES_QUERY = {
+    'lat': FIELD_GEOMETRY['coordinates'][0][0][1],
+    'lon': FIELD_GEOMETRY['coordinates'][0][0][0],
+    'start_date': SCENE_START,
+}
+
+# Leaf names compare() checks: (suffix, True if higher is better)
+COMPARED = (('p50_ms', False), ('dumps_ms', False), ('rows_per_second', True), ('_bytes', False))
+
+
+def _latency(seconds):
+    milliseconds = np.asarray(seconds) * 1000
+    return {
+        'runs': len(milliseconds),
+        'mean_ms': round(float(milliseconds.mean()), 3),
+        'p50_ms': round(float(np.percentile(milliseconds, 50)), 3),
+        'p95_ms': round(float(np.percentile(milliseconds, 95)), 3),
+        'min_ms': round(float(milliseconds.min()), 3),
+    }
+
+
+def _server_timing(response):
+    """{stage: milliseconds} from the Server-Timing header"""
+    stages = {}
+    for entry in filter(None, (item.strip() for item in response.get('Server-Timing', '').split(','))):
+        name, *params = entry.split(';')
+        for param in params:
+            if param.startswith('dur='):
+                stages[name] = float(param[len('dur='):])
+    return stages
+
+
+def _mean_stages(traces):
+    names = {name for trace in traces for name in trace}
+    return {name: round(sum(trace.get(name, 0.0) for trace in traces) / len(traces), 3)
+            for name in sorted(names)}
+
+
+def _check(response, path):
+    if response.status_code != 200:
+        raise RuntimeError(f"{path} answered {response.status_code}")
+    if response.get('Content-Type', '').startswith('application/json'):
+        payload = json.loads(response.content)
+        if isinstance(payload, dict) and payload.get('status') == 'error':
+            raise RuntimeError(f"{path} failed: {payload.get('message')}")
+
+
+def _body(response):
+    if response.streaming:
+        return b''.join(response.streaming_content)
+    return response.content
+
+
+def _timed_requests(request, path, repeat, before=None):
+    """Run request() repeat times; latency summary, mean stages and body size"""
+    seconds, traces = [], []
+    size = None
+    for _ in range(repeat):
+        if before:
+            before()
+        started = time.perf_counter()
+        response = request()
+        body = _body(response)
+        seconds.append(time.perf_counter() - started)
+        _check(response, path)
+        traces.append(_server_timing(response))
+        size = len(body)
+    return {**_latency(seconds), 'stages_ms': _mean_stages(traces), 'response_bytes': size}
+
+
+def _time_calls(func, min_seconds, max_calls=10_000):
+    """Call func until min_seconds have passed (at least once); per-call seconds"""
+    seconds = []
+    deadline = time.perf_counter() + min_seconds
+    while not seconds or (time.perf_counter() < deadline and len(seconds) < max_calls):
+        started = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - started)
+    return seconds
+
+
+def synthetic_features(rows, seed=0):
+    """
+    An (rows, 15) feature matrix resampled from the synthetic scenes'
+    windows with a little noise, so the trees see realistic values
+    """
+    windows = time_series_windows(date.fromisoformat(SCENE_START))
+    samples = [window['area_values'] for window in
+               backends.get_backend().extract_feature_time_series(FIELD_GEOMETRY, windows, use_cache=False)]
+    base = np.array([[sample[band] for band in FEATURE_ORDER] for sample in samples
+                     if all(sample.get(band) is not None for band in FEATURE_ORDER)])
+    if not len(base):
+        raise RuntimeError("The synthetic scenes produced no complete feature rows")
+    rng = np.random.default_rng(seed)
+    features = base[rng.integers(0, len(base), rows)]
+    features += rng.normal(0, 0.05, features.shape) * (base.std(axis=0) + 1e-6)
+    return features
+
+
+def bench_memory(options):
+    """
+    Resident memory of this process before and after warming it like a
+    worker: every model loaded and each endpoint served once. Run first,
+    before the large batches inflate the peak.
+    """
+    gc.collect()
+    before = _resident_bytes()
+    client = Client()
+    for model in model_registry.available():
+        WheatHealthPredictor(model)
+        client.post('/predict/', json.dumps({**PREDICT_BODY, 'model': model}), content_type='application/json')
+    _body(client.get('/api/indices/', INDICES_QUERY))
+    gc.collect()
+    after = _resident_bytes()
+    return {
+        'baseline_bytes': before,
+        'warm_worker_bytes': after,
+        'warm_increase_bytes': after - before if before is not None and after is not None else None,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_resident_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def bench_model_load(options):
+    """Unpickling time of every shipped model, and the flat engine's compile time"""
+    results = {}
+    for model in model_registry.available():
+        seconds, resident = [], []
+        registry = None
+        for _ in range(options['load_repeat']):
+            gc.collect()
+            registry = ModelRegistry(model_registry.models_dir, mmap_mode=model_registry.mmap_mode)
+            registry.get(model)
+            stats = registry.stats()[model]
+            seconds.append(stats['load_seconds'])
+            resident.append(stats['resident_bytes'] or 0)
+        registry.get(model, engine='flat')
+        results[model] = {
+            **_latency(seconds),
+            'file_bytes': registry.stats()[model]['file_bytes'],
+            # Later loads reuse memory freed by earlier ones; the first is the honest one
+            'resident_bytes': resident[0],
+            'flat_compile_ms': round(registry.stats()[model]['compile_seconds']['flat'] * 1000, 3),
+        }
+    return results
+
+
+def bench_predict_latency(options):
+    """
+    /predict/ end to end through the middleware, per model, with a warm
+    worker; '<model>:prediction_only' asks for fields=['prediction']
+    """
+    client = Client()
+    results = {}
+    for model in model_registry.available():
+        variants = {model: {}, f'{model}:prediction_only': {'fields': ['prediction']}}
+        for name, extra in variants.items():
+            body = json.dumps({**PREDICT_BODY, 'model': model, **extra})
+            request = lambda: client.post('/predict/', body, content_type='application/json')
+            request()
+            results[name] = _timed_requests(request, '/predict/', options['repeat'])
+    return results
+
+
+def bench_indices(options):
+    """/api/indices/ end to end in each mode; 'cold' has no stored windows to reuse"""
+    client = Client()
+    variants = {
+        'composite_cold': ({}, lambda: TimeSeriesWindow.objects.all().delete()),
+        'composite_warm': ({}, None),
+        'per_window': ({'mode': 'per_window'}, None),
+        'ndjson_stream': ({'format': 'ndjson'}, None),
+        'columns': ({'format': 'columns'}, None),
+    }
+    results = {}
+    for name, (params, before) in variants.items():
+        request = lambda: client.get('/api/indices/', {**INDICES_QUERY, **params})
+        if before is None:
+            _body(request())
+        results[name] = _timed_requests(request, '/api/indices/', options['repeat'], before)
+    return results
+
+
+def bench_throughput(options):
+    """
+    Rows per second of every model at each batch size: the model call
+    alone (predict_matrix) and the full predict_batch API, which also
+    assembles the features and builds a result dict per row
+    """
+    sizes = sorted(options['batch_sizes'])
+    features = synthetic_features(max(sizes))
+    records = [dict(zip(FEATURE_ORDER, row)) for row in features[:min(max(sizes), options['record_limit'])]]
+
+    results = {}
+    for model in model_registry.available():
+        engines = options['engines'] or [model_registry.engines.get(model, 'native')]
+        results[model] = {}
+        for engine in engines:
+            predictor = WheatHealthPredictor(model, engine)
+            by_size = {}
+            for size in sizes:
+                matrix = features[:size]
+                predictor.predict_matrix(matrix)
+                seconds = float(np.median(_time_calls(lambda: predictor.predict_matrix(matrix),
+                                                      options['min_seconds'])))
+                entry = {'matrix_ms': round(seconds * 1000, 4), 'rows_per_second': round(size / seconds, 1)}
+                if size <= len(records):
+                    batch = records[:size]
+                    batch_seconds = float(np.median(_time_calls(lambda: predictor.predict_batch(batch),
+                                                                options['min_seconds'])))
+                    entry['batch_ms'] = round(batch_seconds * 1000, 4)
+                    entry['batch_rows_per_second'] = round(size / batch_seconds, 1)
+                by_size[str(size)] = entry
+            results[model][engine] = by_size
+    return results
+
+
+def _payloads(client):
+    """A /predict/ result, a 1,000 feature batch result and a time series, decoded"""
+    features = synthetic_features(1_000)
+    collection = {
+        'type': 'FeatureCollection',
+        'features': [{'type': 'Feature', 'id': index, 'geometry': FIELD_GEOMETRY,
+                      'properties': dict(zip(FEATURE_ORDER, map(float, row)))}
+                     for index, row in enumerate(features)],
+    }
+    responses = {
+        'predict': client.post('/predict/', json.dumps(PREDICT_BODY), content_type='application/json'),
+        'batch': client.post('/api/predict/batch/', json.dumps(collection), content_type='application/json'),
+        'time_series': client.get('/api/indices/', INDICES_QUERY),
+    }
+    payloads = {}
+    for name, response in responses.items():
+        _check(response, name)
+        payloads[name] = json.loads(_body(response))
+    return payloads
+
+
+def bench_serialization(options):
+    """
+    Encoding time of typical payloads with the json module and with
+    dumps() (orjson when installed), and their size raw, gzipped and, when
+    brotli is installed, brotli-compressed
+    """
+    payloads = _payloads(Client())
+    results = {}
+    for name, payload in payloads.items():
+        stdlib = _time_calls(lambda: json.dumps(payload, cls=DjangoJSONEncoder).encode(), options['min_seconds'])
+        fast = _time_calls(lambda: dumps(payload), options['min_seconds'])
+        body = dumps(payload)
+        results[name] = {
+            'json_ms': round(float(np.median(stdlib)) * 1000, 4),
+            'dumps_ms': round(float(np.median(fast)) * 1000, 4),
+            'raw_bytes': len(body),
+            'gzip_bytes': len(gzip.compress(body, GZIP_LEVEL)),
+            'brotli_bytes': len(brotli.compress(body, quality=BROTLI_QUALITY)) if brotli else None,
+        }
+    return results
+
+
+BENCHMARKS = {
+    # Memory first, while the process still looks like a fresh worker
+    'memory': bench_memory,
+    'model_load': bench_model_load,
+    'predict_latency': bench_predict_latency,
+    'indices': bench_indices,
+    'throughput': bench_throughput,
+    'serialization': bench_serialization,
+}
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment():
+    import sklearn
+    try:
+        import xgboost
+        xgboost_version = xgboost.__version__
+    except ImportError:
+        xgboost_version = None
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'django': django.get_version(),
+        'numpy': np.__version__,
+        'sklearn': sklearn.__version__,
+        'xgboost': xgboost_version,
+        'model_engines': dict(model_registry.engines),
+    }
+
+
+@contextmanager
+def _isolated():
+    """A throwaway test database and synthetic scenes behind the local backend"""
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    data_dir = tempfile.mkdtemp(prefix='wheathealth-bench-')
+    try:
+        write_synthetic_scenes(data_dir, FIELD_GEOMETRY, SCENE_START, days=200)
+        yield data_dir
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def run(names=None, **options):
+    """
+    Run the named benchmarks (default: all, in BENCHMARKS order) and
+    return the results as a JSON-serializable dict
+    """
+    options = {**DEFAULTS, **{key: value for key, value in options.items() if value is not None}}
+    names = names or list(BENCHMARKS)
+    results = {
+        'environment': environment(),
+        'options': {key: list(value) if isinstance(value, tuple) else value for key, value in options.items()},
+        'benchmarks': {},
+    }
+    with _isolated() as data_dir, override_settings(EXTRACTION_BACKEND='local', LOCAL_BACKEND_DATA_DIR=data_dir,
+                                                    LOCAL_BACKEND_LATENCY=options['latency']):
+        backends._backends.pop('local', None)
+        try:
+            for name in names:
+                started = time.perf_counter()
+                results['benchmarks'][name] = BENCHMARKS[name](options)
+                results['benchmarks'][name]['seconds'] = round(time.perf_counter() - started, 2)
+        finally:
+            backends._backends.pop('local', None)
+    return results
+
+
+def _leaves(tree, path=()):
+    for key, value in tree.items():
+        if isinstance(value, dict):
+            yield from _leaves(value, path + (key,))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path + (key,), value
+
+
+def compare(baseline, current, tolerance=0.25):
+    """
+    Metrics of current that are worse than in baseline by more than
+    tolerance (a fraction): [(path, baseline value, current value)].
+    Latencies are compared on the median, plus throughputs and sizes.
+    """
+    before = dict(_leaves(baseline.get('benchmarks', {})))
+    regressions = []
+    for path, value in _leaves(current.get('benchmarks', {})):
+        rule = next((higher for suffix, higher in COMPARED if path[-1].endswith(suffix)), None)
+        old = before.get(path)
+        if rule is None or not old:
+            continue
+        change = (old - value) / old if rule else (value - old) / old
+        if change > tolerance:
+            regressions.append(('.'.join(path), old, value))
+    return regressions
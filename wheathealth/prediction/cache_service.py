@@ -0,0 +1,198 @@
+import hashlib
+import json
+import logging
+import threading
+from datetime import date, datetime, timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from .geometry import canonicalize
+
+# Days after a window ends before late Sentinel-2 ingestions stop arriving
+INGESTION_LAG_DAYS = 5
+
+
+def canonical_geometry(geometry):
+    """
+    Canonical GeoJSON dict for a GeoJSON dict or a client-side ee.Geometry,
+    so equivalent copies of a field share cache keys
+    """
+    if hasattr(geometry, 'toGeoJSON'):
+        geometry = geometry.toGeoJSON()
+    if geometry.get('type') in ('Point', 'Polygon', 'MultiPolygon'):
+        return canonicalize(geometry, getattr(settings, 'GEOMETRY_TOLERANCE_M', 10))
+
+    def _round(value):
+        if isinstance(value, float):
+            return round(value, 7)
+        if isinstance(value, (list, tuple)):
+            return [_round(item) for item in value]
+        if isinstance(value, dict):
+            return {key: _round(item) for key, item in value.items()}
+        return value
+
+    return _round(geometry)
+
+
+def geometry_key(geometry):
+    """Stable hash of a geometry alone"""
+    payload = json.dumps(canonical_geometry(geometry), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def extraction_key(geometry, start_date, end_date, collection, cloud_threshold):
+    """Stable hash of everything that determines an extraction result"""
+    payload = json.dumps({
+        'geometry': canonical_geometry(geometry),
+        'start_date': str(start_date),
+        'end_date': str(end_date),
+        'collection': collection,
+        'cloud_threshold': cloud_threshold,
+    }, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class DjangoCacheStore:
+    """Stores entries in one of the Django CACHES aliases"""
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    def get(self, key):
+        return caches[self.alias].get(f'ee:{key}')
+
+    def set(self, key, value, timeout):
+        caches[self.alias].set(f'ee:{key}', value, timeout)
+
+
+class DatabaseStore:
+    """
+    Stores entries in the ExtractionCacheEntry table, evicting the least
+    recently used entries once max_entries is exceeded.
+    """
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+
+    def get(self, key):
+        from .models import ExtractionCacheEntry
+
+        now = timezone.now()
+        entry = ExtractionCacheEntry.objects.filter(key=key).first()
+        if entry is None:
+            return None
+        if entry.expires_at is not None and entry.expires_at <= now:
+            entry.delete()
+            return None
+        ExtractionCacheEntry.objects.filter(pk=entry.pk).update(last_used_at=now)
+        return entry.value
+
+    def set(self, key, value, timeout):
+        from .models import ExtractionCacheEntry
+
+        now = timezone.now()
+        ExtractionCacheEntry.objects.update_or_create(key=key, defaults={
+            'value': value,
+            'expires_at': now + timedelta(seconds=timeout) if timeout is not None else None,
+            'last_used_at': now,
+        })
+
+        excess = ExtractionCacheEntry.objects.count() - self.max_entries
+        if excess > 0:
+            stale = ExtractionCacheEntry.objects.order_by('last_used_at').values_list('pk', flat=True)[:excess]
+            ExtractionCacheEntry.objects.filter(pk__in=list(stale)).delete()
+
+
+class ExtractionCache:
+    """
+    Cache for Earth Engine extraction results. Windows that ended more
+    than INGESTION_LAG_DAYS ago no longer change and are kept
+    indefinitely. Recent windows, and results without data, expire after
+    RECENT_TTL seconds so late acquisitions still show up.
+    """
+
+    def __init__(self, store=None, recent_ttl=None):
+        config = getattr(settings, 'EE_CACHE', {})
+        self.enabled = config.get('ENABLED', True)
+        self.recent_ttl = recent_ttl if recent_ttl is not None else config.get('RECENT_TTL', 3600)
+        self._store = store
+        self._counts = {'hits': 0, 'misses': 0, 'errors': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def store(self):
+        if self._store is None:
+            config = getattr(settings, 'EE_CACHE', {})
+            if config.get('STORE', 'database') == 'django':
+                self._store = DjangoCacheStore(config.get('ALIAS', 'default'))
+            else:
+                self._store = DatabaseStore(config.get('MAX_ENTRIES', 5000))
+        return self._store
+
+    @staticmethod
+    def has_data(value):
+        """False for an error or a window without images, which a later call may not repeat"""
+        if not isinstance(value, dict):
+            return True
+        return 'error' not in value and value.get('data_available') is not False and value.get('image_count') != 0
+
+    def timeout_for(self, end_date, value=None):
+        if end_date is None or not self.has_data(value):
+            return self.recent_ttl
+        if isinstance(end_date, str):
+            end_date = datetime.strptime(end_date[:10], '%Y-%m-%d').date()
+        elif isinstance(end_date, datetime):
+            end_date = end_date.date()
+        return None if end_date < date.today() - timedelta(days=INGESTION_LAG_DAYS) else self.recent_ttl
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        try:
+            value = self.store.get(key)
+        except Exception as e:
+            # A broken cache must never fail the request
+            logging.error(f"Extraction cache read failed: {str(e)}")
+            self._count('errors')
+            return None
+        self._count('hits' if value is not None else 'misses')
+        return value
+
+    def set(self, key, value, end_date):
+        if not self.enabled:
+            return
+        try:
+            self.store.set(key, value, self.timeout_for(end_date, value))
+        except Exception as e:
+            logging.error(f"Extraction cache write failed: {str(e)}")
+            self._count('errors')
+
+    def get_or_compute(self, compute, geometry, start_date, end_date, collection, cloud_threshold,
+                       cacheable=None):
+        """
+        Return the cached result for this extraction, or call compute() and
+        cache what it returns unless cacheable(result) is false
+        """
+        key = extraction_key(geometry, start_date, end_date, collection, cloud_threshold)
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        value = compute()
+        if cacheable is None or cacheable(value):
+            self.set(key, value, end_date)
+        return value
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        lookups = counts['hits'] + counts['misses']
+        counts['hit_rate'] = round(counts['hits'] / lookups, 4) if lookups else None
+        return counts
+
+
+extraction_cache = ExtractionCache()
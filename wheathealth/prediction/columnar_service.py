@@ -0,0 +1,261 @@
+import base64
+import io
+import os
+import shutil
+import tempfile
+import threading
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+import numpy as np
+from django.conf import settings
+from .gee_service import TIME_SERIES_INDICES
+from .model_service import FEATURE_ORDER
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet is optional, .npy directories always work
+    pyarrow = None
+
+# Column names of the 15 model features, kept apart from the index columns
+FEATURE_COLUMNS = [f'feature.{band}' for band in FEATURE_ORDER]
+SERIES_COLUMNS = list(TIME_SERIES_INDICES) + FEATURE_COLUMNS
+
+
+def _save_npy_dir(path, arrays):
+    """
+    Write each array to <path>/<name>.npy. The directory is built beside
+    path and swapped in whole, so readers never see half of a store.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = Path(tempfile.mkdtemp(prefix=f'{path.name}.', dir=path.parent))
+    for name, values in arrays.items():
+        np.save(temporary / f'{name}.npy', values)
+    previous = None
+    if path.exists():
+        previous = temporary.with_name(f'{temporary.name}.old')
+        os.rename(path, previous)
+    os.rename(temporary, path)
+    if previous is not None:
+        # Tables already mapped from the old files keep them until they reload
+        shutil.rmtree(previous, ignore_errors=True)
+
+
+def _load_npy_dir(path, mmap=True):
+    """The arrays of a _save_npy_dir directory, memory-mapped unless mmap is false"""
+    return {file.stem: np.load(file, mmap_mode='r' if mmap else None) for file in Path(path).glob('*.npy')}
+
+
+class SeriesTable:
+    """
+    Index time series of one or many fields, column-oriented. Row i is the
+    window starting day_offsets[i] days after epoch, of field field_ids[i].
+    Every column is float32 with NaN for missing values; valid marks the
+    windows that had imagery and is stored as a packed bitmask.
+    """
+
+    def __init__(self, epoch, field_ids, day_offsets, columns, valid, field_names=None):
+        self.epoch = epoch
+        self.field_ids = np.asarray(field_ids, dtype=np.int32)
+        self.day_offsets = np.asarray(day_offsets, dtype=np.int32)
+        self.columns = {name: np.asarray(values, dtype=np.float32) for name, values in columns.items()}
+        self.valid = np.asarray(valid, dtype=bool)
+        self.field_names = field_names or {}
+
+    def __len__(self):
+        return len(self.day_offsets)
+
+    @classmethod
+    def from_rows(cls, rows, field_names=None):
+        """rows: (field_id, start_date, data_available, {column: value or None})"""
+        starts = [date.fromisoformat(str(start_date)[:10]) for _, start_date, _, _ in rows]
+        epoch = min(starts, default=date(1970, 1, 1))
+        columns = {
+            name: np.array([np.nan if values.get(name) is None else values[name]
+                            for _, _, _, values in rows], dtype=np.float32)
+            for name in SERIES_COLUMNS
+        }
+        # Feature columns no row has are left out entirely
+        columns = {name: values for name, values in columns.items()
+                   if name in TIME_SERIES_INDICES or not np.isnan(values).all()}
+        return cls(epoch,
+                   [field_id for field_id, _, _, _ in rows],
+                   [(start - epoch).days for start in starts],
+                   columns,
+                   [bool(available) for _, _, available, _ in rows],
+                   field_names)
+
+    @classmethod
+    def from_records(cls, records):
+        """The /api/indices/ window records of one geometry"""
+        return cls.from_rows([(0, record['date'], record.get('data_available'), record)
+                              for record in records if '_meta' not in record])
+
+    @classmethod
+    def from_field_windows(cls, windows):
+        """Stored FieldWindows, any number of fields"""
+        rows = []
+        field_names = {}
+        for window in windows:
+            values = {index: getattr(window, index.lower()) for index in TIME_SERIES_INDICES}
+            values.update({f'feature.{band}': value for band, value in (window.features or {}).items()})
+            rows.append((window.field_id, window.start_date, window.data_available, values))
+            field_names[window.field_id] = window.field.name
+        return cls.from_rows(rows, field_names)
+
+    def select(self, field_ids):
+        """The rows of the given fields; a cheap mask over the (mapped) columns"""
+        rows = np.isin(self.field_ids, list(field_ids))
+        return SeriesTable(self.epoch, self.field_ids[rows], self.day_offsets[rows],
+                           {name: values[rows] for name, values in self.columns.items()},
+                           self.valid[rows],
+                           {field_id: name for field_id, name in self.field_names.items()
+                            if field_id in set(field_ids)})
+
+    def dates(self):
+        return [(self.epoch + timedelta(days=int(offset))).isoformat() for offset in self.day_offsets]
+
+    def to_json(self, decimals=6):
+        """Column-oriented JSON: one list per column, null for missing values"""
+        def column(values):
+            rounded = np.round(values.astype(np.float64), decimals)
+            return [None if np.isnan(value) else value for value in rounded.tolist()]
+
+        return {
+            "encoding": "columns",
+            "rows": len(self),
+            "epoch": self.epoch.isoformat(),
+            "day_offsets": self.day_offsets.tolist(),
+            "field_ids": self.field_ids.tolist(),
+            "fields": {str(field_id): name for field_id, name in self.field_names.items()},
+            "valid": base64.b64encode(np.packbits(self.valid)).decode('ascii'),
+            "valid_encoding": "packbits-base64",
+            "columns": {name: column(values) for name, values in self.columns.items()},
+        }
+
+    def _arrays(self):
+        arrays = {
+            'epoch': np.array([self.epoch.toordinal()], dtype=np.int32),
+            'field_ids': self.field_ids,
+            'day_offsets': self.day_offsets,
+            'valid': np.packbits(self.valid),
+            'field_name_ids': np.array(list(self.field_names), dtype=np.int32),
+            'field_name_values': np.array(list(self.field_names.values()), dtype='U100'),
+        }
+        arrays.update({f'column.{name}': values for name, values in self.columns.items()})
+        return arrays
+
+    @classmethod
+    def _from_arrays(cls, arrays):
+        rows = len(arrays['day_offsets'])
+        return cls(date.fromordinal(int(arrays['epoch'][0])),
+                   arrays['field_ids'],
+                   arrays['day_offsets'],
+                   {name[len('column.'):]: values for name, values in arrays.items()
+                    if name.startswith('column.')},
+                   np.unpackbits(np.asarray(arrays['valid']), count=rows).astype(bool),
+                   dict(zip(np.asarray(arrays['field_name_ids']).tolist(),
+                            np.asarray(arrays['field_name_values']).tolist())))
+
+    def to_npz_bytes(self):
+        """The binary response format: an uncompressed .npz, np.load() reads it"""
+        buffer = io.BytesIO()
+        np.savez(buffer, **self._arrays())
+        return buffer.getvalue()
+
+    def save(self, path):
+        """
+        Write a directory of .npy files, one per array, which load() maps;
+        .npz or .parquet (if pyarrow is installed) by the path's extension
+        """
+        path = str(path)
+        if path.endswith('.parquet'):
+            if pyarrow is None:
+                raise ImportError("Writing Parquet needs pyarrow")
+            table = pyarrow.table({
+                'field_id': self.field_ids,
+                'day_offset': self.day_offsets,
+                'valid': self.valid,
+                **self.columns,
+            })
+            table = table.replace_schema_metadata({
+                'epoch': self.epoch.isoformat(),
+                'fields': ','.join(f'{field_id}:{name}' for field_id, name in self.field_names.items()),
+            })
+            pyarrow.parquet.write_table(table, path)
+            return
+        if path.endswith('.npz'):
+            temporary = f'{path}.tmp.npz'
+            np.savez(temporary, **self._arrays())
+            os.replace(temporary, path)
+            return
+        _save_npy_dir(path, self._arrays())
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        path = str(path)
+        if path.endswith('.parquet'):
+            if pyarrow is None:
+                raise ImportError("Reading Parquet needs pyarrow")
+            table = pyarrow.parquet.read_table(path, memory_map=mmap)
+            metadata = {key.decode(): value.decode() for key, value in (table.schema.metadata or {}).items()}
+            field_names = dict((int(item.split(':', 1)[0]), item.split(':', 1)[1])
+                               for item in metadata.get('fields', '').split(',') if item)
+            columns = {name: table.column(name).to_numpy() for name in table.column_names
+                       if name not in ('field_id', 'day_offset', 'valid')}
+            return cls(date.fromisoformat(metadata['epoch']), table.column('field_id').to_numpy(),
+                       table.column('day_offset').to_numpy(), columns,
+                       table.column('valid').to_numpy(zero_copy_only=False), field_names)
+        if path.endswith('.npz'):
+            # Zip members cannot be mapped, so an .npz is read whole
+            with np.load(path) as arrays:
+                return cls._from_arrays(dict(arrays))
+        return cls._from_arrays(_load_npy_dir(path, mmap))
+
+
+class SeriesStore:
+    """
+    The precomputed series of every registered field, written by
+    precompute_indices to SERIES_STORE_PATH and memory-mapped by each
+    worker; reloaded when the store is rewritten.
+    """
+
+    def __init__(self, path=None):
+        self._path = path
+        self._table = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return str(self._path or getattr(settings, 'SERIES_STORE_PATH'))
+
+    def write(self, windows):
+        table = SeriesTable.from_field_windows(windows)
+        table.save(self.path)
+        return table
+
+    def written_at(self):
+        """When the store was last written (aware datetime), or None"""
+        try:
+            return datetime.fromtimestamp(os.stat(self.path).st_mtime, tz=timezone.utc)
+        except FileNotFoundError:
+            return None
+
+    def table(self):
+        """The stored SeriesTable, or None before the first precompute"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        # A rewritten store directory is a new inode
+        version = (stat.st_ino, stat.st_mtime_ns)
+        with self._lock:
+            if self._table is None or version != self._version:
+                self._table = SeriesTable.load(self.path)
+                self._version = version
+            return self._table
+
+
+series_store = SeriesStore()
@@ -0,0 +1,113 @@
+import ee
+
+# Cloud thresholds tried in order before falling back to no cloud filter
+CLOUD_THRESHOLDS = (10, 30)
+
+# QA60 bits of opaque clouds (10) and cirrus (11)
+QA60_CLOUD_BITS = (1 << 10) | (1 << 11)
+
+# Scene Classification (SCL) classes kept: vegetation, bare soil, water,
+# unclassified. Dropped: no data, saturated, dark area, cloud shadow,
+# medium and high probability cloud, thin cirrus and snow.
+SCL_CLEAR = (4, 5, 6, 7)
+
+
+def mask_scene(image):
+    """Mask the cloudy, shadowed and invalid pixels of one Sentinel-2 SR scene"""
+    qa_clear = image.select('QA60').toInt().bitwiseAnd(QA60_CLOUD_BITS).eq(0)
+    scl_clear = image.select('SCL').remap(list(SCL_CLEAR), [1] * len(SCL_CLEAR), 0)
+    return image.updateMask(qa_clear.And(scl_clear))
+
+
+def select_threshold(base, thresholds):
+    """
+    The base collection filtered with the strictest CLOUDY_PIXEL_PERCENTAGE
+    threshold that still has images, or unfiltered: (collection, threshold).
+    Both are server-side values, so the choice costs no round trip.
+    """
+    collection = base
+    threshold = None
+    for limit in reversed(thresholds):
+        filtered = base.filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', limit))
+        has_images = filtered.size().gt(0)
+        collection = ee.ImageCollection(ee.Algorithms.If(has_images, filtered, collection))
+        threshold = ee.Algorithms.If(has_images, limit, threshold)
+    return collection, threshold
+
+
+class Composite:
+    """
+    Median of the cloud-masked scenes of one window. Every scene is masked
+    with QA60 and SCL before the median, so a partly cloudy scene still
+    contributes its clear pixels. properties() describes the composite
+    (threshold used, scene counts) and is meant to be reduced together with
+    the image values, in the same getInfo().
+    """
+
+    def __init__(self, collection_id, geometry, start_date, end_date, thresholds=CLOUD_THRESHOLDS,
+                 bands=None):
+        self.base = (ee.ImageCollection(collection_id)
+            .filterBounds(geometry)
+            .filterDate(start_date, end_date))
+        self.collection, self.threshold = select_threshold(self.base, thresholds)
+        self.image_count = self.collection.size()
+
+        masked = self.collection.map(mask_scene)
+        if bands:
+            masked = masked.select(bands)
+        self.image = masked.median()
+
+    def properties(self):
+        return {
+            'image_count': self.image_count,
+            'cloud_threshold': self.threshold,
+            'latest_image_time': self.base.aggregate_max('system:time_start'),
+            'source_image_count': self.base.size(),
+        }
+
+    def reduce(self, image, geometry, reducer=None):
+        """
+        reduceRegion of image (derived from self.image) merged with
+        properties(); an empty window reduces to the properties alone
+        """
+        values = ee.Dictionary(ee.Algorithms.If(
+            self.image_count.gt(0),
+            image.reduceRegion(
+                reducer=reducer or ee.Reducer.mean(),
+                geometry=geometry,
+                scale=10,
+                bestEffort=True
+            ),
+            ee.Dictionary()
+        ))
+        return values.combine(self.properties())
+
+
+def index_image(image):
+    """The point-analysis indices (TIME_SERIES_INDICES) of a raw DN composite"""
+    return ee.Image.cat([
+        image.normalizedDifference(['B8', 'B4']).rename('NDVI'),
+        image.normalizedDifference(['B8', 'B3']).rename('GNDVI'),
+        image.normalizedDifference(['B8', 'B11']).rename('DWSI'),
+        image.select('B4').divide(image.select('B2')).rename('RSV1'),
+    ])
+
+
+def feature_image(image):
+    """The 10 bands (scaled to reflectance) and 5 indices the models use"""
+    # Scale by 10,000
+    image = image.divide(10000)
+
+    ndvi = image.normalizedDifference(['B8', 'B4']).rename('NDVI')
+    gndvi = image.normalizedDifference(['B8', 'B3']).rename('GNDVI')
+    npc_i = image.normalizedDifference(['B4', 'B2']).rename('NPCI')
+    dwsi = image.expression('(B8A - B11) / (B8A + B11)', {
+        'B8A': image.select('B8A'),
+        'B11': image.select('B11')
+    }).rename('DWSI')
+    rvsi = image.expression('(B3 - B2) / (B3 + B2)', {
+        'B2': image.select('B2'),
+        'B3': image.select('B3')
+    }).rename('RVSI')
+
+    return image.addBands([ndvi, gndvi, npc_i, dwsi, rvsi])
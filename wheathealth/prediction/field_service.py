@@ -0,0 +1,138 @@
+from datetime import date, timedelta
+from django.db import transaction
+from django.utils import timezone
+from .backends import get_backend
+from .model_service import FEATURE_ORDER, WheatHealthPredictor
+from .models import FieldWindow
+from .timeseries_service import changed_windows
+
+# FieldWindow column of each time-series index
+INDEX_COLUMNS = {'NDVI': 'ndvi', 'GNDVI': 'gndvi', 'DWSI': 'dwsi', 'RSV1': 'rsv1'}
+
+
+def time_series_windows(start_date):
+    """(start, end) date strings of the time-series windows from start_date"""
+    # Time windows - biweekly then weekly
+    time_windows = (
+        [(start_date + timedelta(days=i), 7) for i in range(0, 126, 7)] +
+        [(start_date + timedelta(days=i), 14) for i in range(127, 178, 14)]
+    )
+
+    return [
+        (begin.strftime('%Y-%m-%d'), (begin + timedelta(days=days)).strftime('%Y-%m-%d'))
+        for begin, days in time_windows
+    ]
+
+
+def field_windows(field, today=None):
+    """The season's windows of a field, leaving out those that have not started"""
+    today = (today or date.today()).isoformat()
+    return [window for window in time_series_windows(field.sowing_date) if window[0] <= today]
+
+
+def compute_windows(fields_windows, backend=None, predictor=None):
+    """
+    Extract and store the indices and health prediction of the given
+    windows: {field: [(start_date, end_date), ...]}. Every field costs one
+    time-series and one feature extraction call, and all windows of all
+    fields are scored with one model call. Returns the stored FieldWindows.
+
+    The extractions are per field, not batched through extract_fields:
+    that picks one cloud threshold over the union of the parcels, so a
+    field's stored profile would depend on which fields were computed with
+    it, and the index series has no multi-field counterpart.
+    """
+    backend = backend or get_backend()
+
+    rows = []
+    for field, windows in fields_windows.items():
+        if not windows:
+            continue
+        # FieldWindow is the cache here; a recomputed window has new images
+        indices = backend.extract_index_time_series(field.geometry, windows, use_cache=False)
+        features = backend.extract_feature_time_series(field.geometry, windows, use_cache=False)
+        rows += [(field, window, window_indices, window_features['area_values'])
+                 for window, window_indices, window_features in zip(windows, indices, features)]
+    if not rows:
+        return []
+
+    # Windows without a cloud-free composite have no features to score
+    scorable = [position for position, row in enumerate(rows)
+                if all(row[3].get(band) is not None for band in FEATURE_ORDER)]
+    predictor = predictor or WheatHealthPredictor()
+    predictions = dict(zip(scorable, predictor.predict_batch([rows[position][3] for position in scorable])))
+
+    now = timezone.now()
+    stored = []
+    for position, (field, (start_date, end_date), window_indices, area_values) in enumerate(rows):
+        prediction = predictions.get(position, {})
+        stored.append(FieldWindow(
+            field=field,
+            start_date=date.fromisoformat(start_date),
+            end_date=date.fromisoformat(end_date),
+            data_available=window_indices.get('data_available', False),
+            image_count=window_indices.get('image_count') or 0,
+            cloud_threshold=window_indices.get('cloud_threshold'),
+            model=prediction.get('model', ''),
+            prediction=prediction.get('prediction'),
+            confidence=prediction.get('confidence'),
+            healthy_probability=prediction.get('probabilities', {}).get('healthy'),
+            features=area_values or None,
+            latest_image_time=window_indices.get('latest_image_time'),
+            source_image_count=window_indices.get('source_image_count'),
+            computed_at=now,
+            checked_at=now,
+            **{column: window_indices.get(index) for index, column in INDEX_COLUMNS.items()}
+        ))
+
+    with transaction.atomic():
+        FieldWindow.objects.bulk_create(
+            stored, update_conflicts=True, unique_fields=['field', 'start_date'],
+            update_fields=['end_date', 'data_available', 'image_count', 'cloud_threshold', 'model',
+                           'prediction', 'confidence', 'healthy_probability', 'features', 'latest_image_time',
+                           'source_image_count', 'computed_at', 'checked_at', *INDEX_COLUMNS.values()])
+    return stored
+
+
+def _stored_windows(field):
+    return {(window.start_date.isoformat(), window.end_date.isoformat()): window
+            for window in field.windows.all()}
+
+
+def _stale_windows(field, windows, stored, backend):
+    """Windows of a field to compute again; marks the unchanged ones as checked"""
+    stale, unchanged = changed_windows(backend, field.geometry, windows, stored)
+    FieldWindow.objects.filter(pk__in=[stored[window].pk for window in unchanged]).update(
+        checked_at=timezone.now())
+    return stale
+
+
+def precompute_fields(fields, backend=None, predictor=None, refresh=False, today=None):
+    """
+    Bring the stored profile of every field up to date. Stored windows
+    are recomputed only when their source collection changed, or when
+    refresh is set. Returns {field: number of windows computed}.
+    """
+    backend = backend or get_backend()
+    todo = {}
+    for field in fields:
+        windows = field_windows(field, today)
+        todo[field] = windows if refresh else _stale_windows(field, windows, _stored_windows(field), backend)
+    compute_windows(todo, backend, predictor)
+    return {field: len(windows) for field, windows in todo.items()}
+
+
+def field_series(field, backend=None, predictor=None, today=None):
+    """
+    (stored FieldWindow, fetched) for the field's whole season. Only the
+    windows missing from storage or whose source collection changed are
+    extracted now.
+    """
+    backend = backend or get_backend()
+    stored = _stored_windows(field)
+    windows = field_windows(field, today)
+    stale = _stale_windows(field, windows, stored, backend)
+    fetched = {(window.start_date.isoformat(), window.end_date.isoformat()): window
+               for window in compute_windows({field: stale}, backend, predictor)}
+    stored.update(fetched)
+    return [(stored[window], window in fetched) for window in windows]
@@ -1,83 +1,544 @@
+import contextvars
 import ee
-import json
+import logging
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 from django.conf import settings
+from . import compositing, metrics_service
+from .admission_service import QuotaExceeded, ee_call
+from .cache_service import extraction_cache, extraction_key
+from .compositing import CLOUD_THRESHOLDS, Composite
+from .geometry import (box_polygon, centroid, chunk_geometries, contains, pixel_centres, pixel_grid,
+                       union_bounds)
+from .metrics_service import count_cloud_threshold
+from .model_service import FEATURE_ORDER
+
+S2_SR = 'COPERNICUS/S2_SR'
+S2_HARMONIZED = 'COPERNICUS/S2_SR_HARMONIZED'
+
+# Cache keys name the compositing rules, so entries from older rules are not reused
+FALLBACK_THRESHOLD_KEY = 'masked:fallback:' + ','.join(str(limit) for limit in CLOUD_THRESHOLDS)
+
+# Cloud threshold of the model features; windows without such scenes use every scene
+FEATURE_THRESHOLDS = (20,)
+FEATURE_THRESHOLD_KEY = 'masked:fallback:' + ','.join(str(limit) for limit in FEATURE_THRESHOLDS)
+SPECTRAL_BANDS = ['B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8', 'B8A', 'B11', 'B12']
+INDEX_BANDS = ['B2', 'B3', 'B4', 'B8', 'B11']
+
+# Bands and indices returned by extract_bands_and_indices, served by /api/bands/
+BAND_INFO = {
+    # Spectral bands with exact wavelengths from your requirements
+    'B2': {'name': 'Blue', 'wavelength': 496.6, 'type': 'spectral'},
+    'B3': {'name': 'Green', 'wavelength': 560, 'type': 'spectral'},
+    'B4': {'name': 'Red', 'wavelength': 664.5, 'type': 'spectral'},
+    'B5': {'name': 'Red Edge 1', 'wavelength': 703.9, 'type': 'spectral'},
+    'B6': {'name': 'Red Edge 2', 'wavelength': 740.2, 'type': 'spectral'},
+    'B7': {'name': 'Red Edge 3', 'wavelength': 782.5, 'type': 'spectral'},
+    'B8': {'name': 'NIR', 'wavelength': 835.1, 'type': 'spectral'},
+    'B8A': {'name': 'Red Edge 4', 'wavelength': 864.8, 'type': 'spectral'},
+    'B11': {'name': 'SWIR 1', 'wavelength': 1613.7, 'type': 'spectral'},
+    'B12': {'name': 'SWIR 2', 'wavelength': 2202.4, 'type': 'spectral'},
+
+    # Vegetation indices (no wavelength)
+    'NDVI': {'name': 'NDVI', 'type': 'index'},
+    'GNDVI': {'name': 'Green NDVI', 'type': 'index'},
+    'NPCI': {'name': 'NPCI', 'type': 'index'},
+    'DWSI': {'name': 'DWSI', 'type': 'index'},
+    'RVSI': {'name': 'RVSI', 'type': 'index'}
+}
+
+# Indices reported by the point-analysis time series
+TIME_SERIES_INDICES = ('NDVI', 'GNDVI', 'DWSI', 'RSV1')
+
+
+def field_reducer(name):
+    """
+    How extract_fields reduces each parcel: 'first' samples its centroid
+    like extract_bands_and_indices, 'mean' averages it, 'median' or 'pNN'
+    take a percentile. Returns (kind, percentile).
+    """
+    if name in ('first', 'mean'):
+        return name, None
+    if name == 'median':
+        return 'percentile', 50
+    match = re.fullmatch(r'p(\d{1,3})', str(name))
+    if match and int(match.group(1)) <= 100:
+        return 'percentile', int(match.group(1))
+    raise ValueError(f"Unknown reducer '{name}'")
+
+
+def field_chunks(geometries, max_features=None, max_vertices=None):
+    """(start, end) ranges of geometries that fit one reduceRegions request"""
+    return chunk_geometries(
+        geometries,
+        max_features or getattr(settings, 'EE_REDUCE_REGIONS_MAX_FEATURES', 1000),
+        max_vertices or getattr(settings, 'EE_REDUCE_REGIONS_MAX_VERTICES', 100000))
+
+
+class EESession:
+    """
+    Initializes Earth Engine once per process, on first use, with the
+    credentials and project from settings. Safe to call from any thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._initialized = False
+        self._initialized_at = None
+        self._last_error = None
+
+    @property
+    def project(self):
+        return getattr(settings, 'EE_PROJECT', None)
+
+    def _credentials(self):
+        service_account = getattr(settings, 'EE_SERVICE_ACCOUNT', None)
+        key_file = getattr(settings, 'EE_PRIVATE_KEY_FILE', None)
+        if service_account and key_file:
+            return ee.ServiceAccountCredentials(service_account, key_file)
+        # Fall back to the credentials stored by `earthengine authenticate`
+        return None
+
+    def ensure(self):
+        if self._initialized:
+            return
+        with self._lock:
+            if self._initialized:
+                return
+            try:
+                # Not admission-controlled: it is once per worker, and readiness
+                # probes must not wait on or fail with the request budget
+                metrics_service.ee_call('ee_initialize', ee.Initialize, credentials=self._credentials(),
+                                        project=self.project)
+            except Exception as e:
+                # Not cached: the next call tries again
+                self._last_error = str(e)
+                raise
+            self._initialized = True
+            self._initialized_at = time.time()
+            self._last_error = None
+
+    def is_ready(self):
+        try:
+            self.ensure()
+        except Exception:
+            return False
+        return True
+
+    def status(self):
+        return {
+            'ready': self._initialized,
+            'project': self.project,
+            'initialized_at': self._initialized_at,
+            'error': self._last_error,
+        }
+
+
+ee_session = EESession()
+
 
 # Initialize GEE (make sure to set up authentication)
 class GEEDataExtractor:
     @staticmethod
     def initialize():
         try:
-            ee.Initialize(project='certain-catcher-430110-v2')
+            ee_session.ensure()
+        except QuotaExceeded:
+            raise
         except Exception as e:
-            print("Please authenticate Earth Engine first")
-            print(e)
+            logging.error(f"Earth Engine initialization failed, authenticate first: {str(e)}")
             raise
     @staticmethod
-    def extract_bands_and_indices(geometry, start_date, end_date):
+    def extract_bands_and_indices(geometry, start_date, end_date, cache_geometry=None):
+        """
+        Features at the geometry's centroid. cache_geometry, a near-identical
+        known geometry, lends its extraction cache entry; on a miss the
+        geometry itself is extracted and stored under that entry.
+        """
+        return extraction_cache.get_or_compute(
+            lambda: GEEDataExtractor._extract_bands_and_indices(geometry, start_date, end_date),
+            cache_geometry or geometry, start_date, end_date, S2_SR, FEATURE_THRESHOLD_KEY)
+
+    @staticmethod
+    def _extract_bands_and_indices(geometry, start_date, end_date):
         GEEDataExtractor.initialize()
 
         # Convert to EE geometry
         ee_geometry = ee.Geometry(geometry)
         point = ee_geometry.centroid()
 
-        # Load Sentinel-2 data
-        collection = (ee.ImageCollection('COPERNICUS/S2_SR')
-            .filterBounds(ee_geometry)
-            .filterDate(start_date, end_date)
-            .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20))
-            .select(['B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8', 'B8A', 'B11', 'B12']))
-
-        image = collection.median()
-
-        # Scale by 10,000
-        image = image.divide(10000)
-
-        # Calculate vegetation indices
-        ndvi = image.normalizedDifference(['B8', 'B4']).rename('NDVI')
-        gndvi = image.normalizedDifference(['B8', 'B3']).rename('GNDVI')
-        npc_i = image.normalizedDifference(['B4', 'B2']).rename('NPCI')
-        dwsi = image.expression('(B8A - B11) / (B8A + B11)', {
-            'B8A': image.select('B8A'),
-            'B11': image.select('B11')
-        }).rename('DWSI')
-        rvsi = image.expression('(B3 - B2) / (B3 + B2)', {
-            'B2': image.select('B2'),
-            'B3': image.select('B3')
-        }).rename('RVSI')
-
-        # Combine all bands and indices into one image
-        combined = image.addBands([ndvi, gndvi, npc_i, dwsi, rvsi])
-
-        # Extract values at point
-        values = combined.reduceRegion(
-            reducer=ee.Reducer.first(),
-            geometry=point,
-            scale=10,
-            maxPixels=1e9
-        ).getInfo()
-
-        # Return values with a fallback
+        # Extract values at point, with the composite's threshold and scene count
+        composite = GEEDataExtractor.feature_composite(ee_geometry, start_date, end_date)
+        values = ee_call('ee_getinfo', composite.reduce(
+            compositing.feature_image(composite.image), point, ee.Reducer.first()).getInfo)
+        return GEEDataExtractor._feature_result(values)
+
+    @staticmethod
+    def _feature_result(properties):
+        """An extract_bands_and_indices result from a reduced feature composite"""
+        properties = properties or {}
         return {
-    'area_values': values or {},  # Fallback if empty
-    'band_info': {
-        # Spectral bands with exact wavelengths from your requirements
-        'B2': {'name': 'Blue', 'wavelength': 496.6, 'type': 'spectral'},
-        'B3': {'name': 'Green', 'wavelength': 560, 'type': 'spectral'},
-        'B4': {'name': 'Red', 'wavelength': 664.5, 'type': 'spectral'},
-        'B5': {'name': 'Red Edge 1', 'wavelength': 703.9, 'type': 'spectral'},
-        'B6': {'name': 'Red Edge 2', 'wavelength': 740.2, 'type': 'spectral'},
-        'B7': {'name': 'Red Edge 3', 'wavelength': 782.5, 'type': 'spectral'},
-        'B8': {'name': 'NIR', 'wavelength': 835.1, 'type': 'spectral'},
-        'B8A': {'name': 'Red Edge 4', 'wavelength': 864.8, 'type': 'spectral'},
-        'B11': {'name': 'SWIR 1', 'wavelength': 1613.7, 'type': 'spectral'},
-        'B12': {'name': 'SWIR 2', 'wavelength': 2202.4, 'type': 'spectral'},
-        
-        # Vegetation indices (no wavelength)
-        'NDVI': {'name': 'NDVI', 'type': 'index'},
-        'GNDVI': {'name': 'Green NDVI', 'type': 'index'},
-        'NPCI': {'name': 'NPCI', 'type': 'index'},
-        'DWSI': {'name': 'DWSI', 'type': 'index'},
-        'RVSI': {'name': 'RVSI', 'type': 'index'}
-    }
+            'area_values': {band: properties[band] for band in FEATURE_ORDER if band in properties},
+            'image_count': properties.get('image_count', 0),
+            'cloud_threshold': properties.get('cloud_threshold'),
+        }
 
-}
+    @staticmethod
+    def extract_feature_time_series(geometry, windows, use_cache=True):
+        """
+        extract_bands_and_indices for every (start_date, end_date) window in
+        a single round trip. Shares its cache entries with
+        extract_bands_and_indices.
+        """
+        keys = [extraction_key(geometry, start_date, end_date, S2_SR, FEATURE_THRESHOLD_KEY)
+                for start_date, end_date in windows]
+        results = [extraction_cache.get(key) if use_cache else None for key in keys]
+        missing = [position for position, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+
+        GEEDataExtractor.initialize()
+        ee_geometry = ee.Geometry(geometry)
+        point = ee_geometry.centroid()
+
+        def window_feature(window):
+            window = ee.List(window)
+            composite = GEEDataExtractor.feature_composite(
+                ee_geometry, ee.Date(window.get(0)), ee.Date(window.get(1)))
+            return ee.Feature(None, composite.reduce(
+                compositing.feature_image(composite.image), point, ee.Reducer.first()))
+
+        windows_list = ee.List([list(windows[position]) for position in missing])
+        features = ee_call('ee_getinfo', ee.FeatureCollection(windows_list.map(window_feature)).getInfo)['features']
+
+        for position, feature in zip(missing, features):
+            results[position] = GEEDataExtractor._feature_result(feature.get('properties'))
+            extraction_cache.set(keys[position], results[position], windows[position][1])
+        return results
+
+    @staticmethod
+    def extract_fields(geometries, start_date, end_date, reducer='first', max_features=None, max_vertices=None):
+        """
+        extract_bands_and_indices for many parcels at once. The composite and
+        index stack are built once over the parcels' union bounds and every
+        parcel is reduced by one reduceRegions (see field_reducer). Parcel
+        sets too large for one request are split into chunks of
+        EE_REDUCE_REGIONS_MAX_FEATURES parcels and
+        EE_REDUCE_REGIONS_MAX_VERTICES vertices, run concurrently. Results
+        are in the order of geometries.
+
+        The cloud threshold is picked once for the union bounds, so a
+        parcel can fall back differently, and get different features, than
+        it would through extract_bands_and_indices (/predict/). For the same
+        reason results are not cached: they depend on the whole parcel set.
+        """
+        kind, percentile = field_reducer(reducer)
+        if not geometries:
+            return []
+
+        GEEDataExtractor.initialize()
+        if kind == 'first':
+            ee_reducer = ee.Reducer.first()
+        elif kind == 'mean':
+            ee_reducer = ee.Reducer.mean()
+        else:
+            ee_reducer = ee.Reducer.percentile([percentile])
+        region = ee.Geometry(box_polygon(union_bounds(geometries)))
+        composite = GEEDataExtractor.feature_composite(region, start_date, end_date)
+        image = compositing.feature_image(composite.image)
+
+        def reduce_chunk(first, last):
+            parcels = ee.FeatureCollection([
+                ee.Feature(ee.Geometry.Point(list(centroid(geometry))) if kind == 'first' else ee.Geometry(geometry),
+                           {'position': position})
+                for position, geometry in enumerate(geometries[first:last], first)
+            ])
+            reduced = ee.FeatureCollection(ee.Algorithms.If(
+                composite.image_count.gt(0),
+                image.reduceRegions(collection=parcels, reducer=ee_reducer, scale=10),
+                parcels))
+            return ee_call('ee_getinfo', ee.Dictionary({
+                'parcels': reduced,
+                'composite': composite.properties(),
+            }).getInfo)
+
+        outcomes, _ = WindowExecutor().map(reduce_chunk, field_chunks(geometries, max_features, max_vertices))
+
+        results = [None] * len(geometries)
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                raise outcome
+            for feature in outcome['parcels']['features']:
+                properties = feature.get('properties') or {}
+                # Percentile outputs may carry a _pNN suffix
+                values = {band: properties.get(band, properties.get(f'{band}_p{percentile}'))
+                          for band in FEATURE_ORDER}
+                results[properties['position']] = GEEDataExtractor._feature_result({
+                    **{band: value for band, value in values.items() if value is not None},
+                    **outcome['composite'],
+                })
+        return results
+
+    @staticmethod
+    def feature_composite(ee_geometry, start_date, end_date):
+        """Cloud-masked median of the spectral bands the models use"""
+        return Composite(S2_SR, ee_geometry, start_date, end_date, FEATURE_THRESHOLDS, SPECTRAL_BANDS)
+
+    @staticmethod
+    def feature_image(ee_geometry, start_date, end_date):
+        """Median composite with the 10 bands and 5 indices the models use"""
+        return compositing.feature_image(
+            GEEDataExtractor.feature_composite(ee_geometry, start_date, end_date).image)
+
+    @staticmethod
+    def pixel_grid(geometry):
+        """10 m lon/lat grid covering the geometry: (transform, height, width)"""
+        return pixel_grid(geometry, scale=10)
+
+    @staticmethod
+    def pixel_tiles(geometry, start_date, end_date, tile_size=256):
+        """
+        Yield (row0, col0, features, mask) for tile_size square tiles of
+        pixel_grid(geometry). Each tile is one computePixels call, so large
+        fields stay under the per-request pixel limit; features is a
+        (15, h, w) array in FEATURE_ORDER and mask marks the pixels inside
+        the geometry.
+        """
+        GEEDataExtractor.initialize()
+        combined = GEEDataExtractor.feature_image(ee.Geometry(geometry), start_date, end_date)
+        combined = combined.select(FEATURE_ORDER).toFloat()
+        transform, height, width = pixel_grid(geometry, scale=10)
+        x0, dx, y0, dy = transform
+
+        for row0 in range(0, height, tile_size):
+            for col0 in range(0, width, tile_size):
+                tile_height = min(tile_size, height - row0)
+                tile_width = min(tile_size, width - col0)
+                pixels = ee_call('ee_compute_pixels', ee.data.computePixels, {
+                    'expression': combined,
+                    'fileFormat': 'NUMPY_NDARRAY',
+                    'grid': {
+                        'dimensions': {'width': tile_width, 'height': tile_height},
+                        'affineTransform': {
+                            'scaleX': dx, 'shearX': 0, 'translateX': x0 + col0 * dx,
+                            'shearY': 0, 'scaleY': dy, 'translateY': y0 + row0 * dy,
+                        },
+                        'crsCode': 'EPSG:4326',
+                    },
+                })
+                features = np.stack([pixels[band].astype(np.float64) for band in FEATURE_ORDER])
+                xs, ys = pixel_centres(transform, row0, col0, tile_height, tile_width)
+                yield row0, col0, features, contains(geometry, xs, ys)
+
+
+    @staticmethod
+    def extract_index_time_series(geometry, windows, use_cache=True):
+        """
+        Compute the point-analysis indices for every (start_date, end_date)
+        window in a single round trip. The cloud-threshold fallback, the
+        median composite and the reduction all run on the server; each
+        window comes back as one feature of an ee.FeatureCollection.
+        Windows already in the extraction cache are not requested again
+        unless use_cache is false. Every result carries the fingerprint of
+        window_fingerprints.
+        """
+        GEEDataExtractor.initialize()
+        ee_geometry = geometry if isinstance(geometry, ee.Geometry) else ee.Geometry(geometry)
+
+        def window_feature(window):
+            window = ee.List(window)
+            composite = Composite(S2_HARMONIZED, ee_geometry, ee.Date(window.get(0)), ee.Date(window.get(1)),
+                                  CLOUD_THRESHOLDS, INDEX_BANDS)
+            return ee.Feature(None, composite.reduce(compositing.index_image(composite.image), ee_geometry))
+
+        # Only windows missing from the cache go to Earth Engine
+        keys = [extraction_key(geometry, start_date, end_date, S2_HARMONIZED, FALLBACK_THRESHOLD_KEY)
+                for start_date, end_date in windows]
+        results = [extraction_cache.get(key) if use_cache else None for key in keys]
+        missing = [position for position, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+
+        windows_list = ee.List([list(windows[position]) for position in missing])
+        features = ee_call('ee_getinfo', ee.FeatureCollection(windows_list.map(window_feature)).getInfo)['features']
+
+        for position, feature in zip(missing, features):
+            properties = feature.get('properties') or {}
+            result = GEEDataExtractor._index_result(properties)
+            result['latest_image_time'] = properties.get('latest_image_time')
+            result['source_image_count'] = properties.get('source_image_count', 0)
+            results[position] = result
+            extraction_cache.set(keys[position], result, windows[position][1])
+        return results
+
+
+    @staticmethod
+    def window_fingerprints(geometry, windows):
+        """
+        Newest acquisition time (system:time_start, ms) and image count of
+        the source collection in every window, in one cheap round trip. A
+        window whose fingerprint is unchanged has nothing new to extract.
+        """
+        GEEDataExtractor.initialize()
+        ee_geometry = geometry if isinstance(geometry, ee.Geometry) else ee.Geometry(geometry)
+
+        def window_feature(window):
+            window = ee.List(window)
+            collection = (ee.ImageCollection(S2_HARMONIZED)
+                .filterBounds(ee_geometry)
+                .filterDate(ee.Date(window.get(0)), ee.Date(window.get(1))))
+            return ee.Feature(None, {
+                'latest_image_time': collection.aggregate_max('system:time_start'),
+                'source_image_count': collection.size(),
+            })
+
+        features = ee_call('ee_getinfo', ee.FeatureCollection(ee.List([list(window) for window in windows])
+                                                              .map(window_feature)).getInfo)['features']
+        return [{
+            'latest_image_time': (feature.get('properties') or {}).get('latest_image_time'),
+            'source_image_count': (feature.get('properties') or {}).get('source_image_count', 0),
+        } for feature in features]
+
+    @staticmethod
+    def indices_with_fallback(geometry, start_date, end_date):
+        """
+        Point-analysis indices for one window, from the strictest of a 10%
+        and a 30% cloud filter that has images, else every image. The
+        threshold is chosen on the server, so this is one round trip;
+        served from the extraction cache when this window was fetched before.
+        """
+        return extraction_cache.get_or_compute(
+            lambda: GEEDataExtractor._indices_with_fallback(geometry, start_date, end_date),
+            geometry, start_date, end_date, S2_HARMONIZED, FALLBACK_THRESHOLD_KEY,
+            cacheable=lambda indices: 'error' not in indices)
+
+    @staticmethod
+    def _index_result(properties):
+        """Indices of a reduced index composite, with its threshold and scene count"""
+        properties = properties or {}
+        result = {index: properties.get(index) for index in TIME_SERIES_INDICES}
+        result['data_available'] = properties.get('image_count', 0) > 0
+        result['image_count'] = properties.get('image_count', 0)
+        result['cloud_threshold'] = properties.get('cloud_threshold')
+        count_cloud_threshold(result['cloud_threshold'] if result['data_available'] else 'no_data')
+        return result
+
+    @staticmethod
+    def _indices_with_fallback(geometry, start_date, end_date):
+        GEEDataExtractor.initialize()
+        point = geometry if isinstance(geometry, ee.Geometry) else ee.Geometry(geometry)
+
+        try:
+            # Threshold choice, masking, median and reduction in one round trip
+            composite = Composite(S2_HARMONIZED, point, start_date, end_date, CLOUD_THRESHOLDS, INDEX_BANDS)
+            return GEEDataExtractor._index_result(ee_call('ee_getinfo', composite.reduce(
+                compositing.index_image(composite.image), point).getInfo))
+
+        except Exception as e:
+            # A window without data must not stand in for a throttled one
+            if is_rate_limited(e) or isinstance(e, QuotaExceeded):
+                raise
+            logging.error(f"Error in get_indices_with_fallback: {str(e)}")
+            return {
+                'NDVI': None,
+                'GNDVI': None,
+                'DWSI': None,
+                'RSV1': None,
+                'data_available': False,
+                'error': str(e)
+            }
+
+def is_rate_limited(error):
+    """True if an Earth Engine error is a quota / HTTP 429 rejection"""
+    if isinstance(error, QuotaExceeded):
+        # Our own budget: retrying right away cannot succeed
+        return False
+    message = str(error).lower()
+    return '429' in message or 'too many requests' in message or 'quota' in message
+
+
+class WindowExecutor:
+    """
+    Runs blocking per-window Earth Engine calls on a thread pool shared by
+    the whole process, so EE_MAX_CONCURRENCY caps the requests one worker
+    has in flight. Rate-limited calls are retried with exponential backoff.
+    Executors asking for another max_workers share a pool of that size.
+    """
+
+    # max_workers -> ThreadPoolExecutor
+    _pools = {}
+    _pool_lock = threading.Lock()
+
+    def __init__(self, max_workers=None, max_retries=None, base_delay=None):
+        self.max_workers = max_workers or getattr(settings, 'EE_MAX_CONCURRENCY', 8)
+        self.max_retries = max_retries if max_retries is not None else getattr(settings, 'EE_MAX_RETRIES', 4)
+        self.base_delay = base_delay if base_delay is not None else getattr(settings, 'EE_RETRY_BASE_DELAY', 1.0)
+
+    @classmethod
+    def shared_pool(cls, max_workers):
+        with cls._pool_lock:
+            if max_workers not in cls._pools:
+                cls._pools[max_workers] = ThreadPoolExecutor(
+                    max_workers=max_workers, thread_name_prefix=f'ee-window-{max_workers}')
+            return cls._pools[max_workers]
+
+    def call_with_backoff(self, func, *args):
+        """Call func, retrying on rate-limit errors; returns (result, attempts)"""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return func(*args), attempt
+            except Exception as e:
+                if not is_rate_limited(e) or attempt > self.max_retries:
+                    raise
+                delay = self.base_delay * 2 ** (attempt - 1)
+                time.sleep(delay + random.uniform(0, delay / 2))
+
+    def _timed(self, func, start_date, end_date):
+        started = time.perf_counter()
+        attempts = 1
+        try:
+            result, attempts = self.call_with_backoff(func, start_date, end_date)
+        except Exception as e:
+            result = e
+        return result, {
+            'date': start_date,
+            'seconds': round(time.perf_counter() - started, 3),
+            'attempts': attempts,
+        }
+
+    def submit(self, func, start_date, end_date):
+        """
+        Schedule one window on the shared pool; the future resolves to
+        (result_or_exception, timing). Async views await it with
+        asyncio.wrap_future.
+        """
+        # Run in a copy of the caller's context so the request trace sees the calls
+        context = contextvars.copy_context()
+        return self.shared_pool(self.max_workers).submit(context.run, self._timed, func, start_date, end_date)
+
+    def map(self, func, date_ranges):
+        """
+        Run func(start_date, end_date) for every window concurrently.
+        Returns (results, timings) in the order of date_ranges; a window that
+        failed has its exception in place of the result.
+        """
+        futures = [self.submit(func, start_date, end_date) for start_date, end_date in date_ranges]
+        outcomes = [future.result() for future in futures]
+        return [result for result, _ in outcomes], [timing for _, timing in outcomes]
+
+    def iter_completed(self, func, date_ranges):
+        """
+        Like map, but yields (position, result, timing) as soon as each
+        window finishes, in completion order
+        """
+        futures = {self.submit(func, start_date, end_date): position
+                   for position, (start_date, end_date) in enumerate(date_ranges)}
+        for future in as_completed(futures):
+            result, timing = future.result()
+            yield futures[future], result, timing
@@ -0,0 +1,312 @@
+import hashlib
+import json
+import math
+import threading
+from collections import OrderedDict, defaultdict
+import numpy as np
+
+# Metres per degree of latitude
+METERS_PER_DEGREE = 111320.0
+
+
+def polygon_rings(geometry):
+    """Polygons of a GeoJSON geometry as lists of (N, 2) ring arrays"""
+    if geometry['type'] == 'Polygon':
+        return [[np.asarray(ring, dtype=np.float64) for ring in geometry['coordinates']]]
+    if geometry['type'] == 'MultiPolygon':
+        return [[np.asarray(ring, dtype=np.float64) for ring in polygon]
+                for polygon in geometry['coordinates']]
+    return []
+
+
+def _ring_contains(ring, xs, ys):
+    inside = np.zeros(xs.shape, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for (x1, y1), (x2, y2) in zip(ring[:-1], ring[1:]):
+            crosses = (y1 > ys) != (y2 > ys)
+            inside ^= crosses & (xs < (x2 - x1) * (ys - y1) / (y2 - y1) + x1)
+    return inside
+
+
+def contains(geometry, xs, ys):
+    """Boolean mask of the (xs, ys) lon/lat points inside a (Multi)Polygon"""
+    mask = np.zeros(np.shape(xs), dtype=bool)
+    for polygon in polygon_rings(geometry):
+        inside = _ring_contains(polygon[0], xs, ys)
+        for hole in polygon[1:]:
+            inside &= ~_ring_contains(hole, xs, ys)
+        mask |= inside
+    return mask
+
+
+def bounds(geometry):
+    """(west, south, east, north) of a Point or (Multi)Polygon"""
+    if geometry['type'] == 'Point':
+        lon, lat = geometry['coordinates'][:2]
+        return lon, lat, lon, lat
+    points = np.concatenate([polygon[0] for polygon in polygon_rings(geometry)])
+    (west, south), (east, north) = points.min(axis=0), points.max(axis=0)
+    return float(west), float(south), float(east), float(north)
+
+
+def union_bounds(geometries):
+    """(west, south, east, north) covering every geometry"""
+    boxes = np.array([bounds(geometry) for geometry in geometries])
+    return (float(boxes[:, 0].min()), float(boxes[:, 1].min()),
+            float(boxes[:, 2].max()), float(boxes[:, 3].max()))
+
+
+def box_polygon(box):
+    """GeoJSON Polygon of a (west, south, east, north) box"""
+    west, south, east, north = box
+    return {'type': 'Polygon', 'coordinates': [[[west, south], [east, south], [east, north],
+                                                [west, north], [west, south]]]}
+
+
+def vertex_count(geometry):
+    """Coordinate pairs of a Point or (Multi)Polygon, a proxy for its request size"""
+    if geometry['type'] == 'Point':
+        return 1
+    return sum(len(ring) for polygon in polygon_rings(geometry) for ring in polygon)
+
+
+def chunk_geometries(geometries, max_features, max_vertices):
+    """
+    Split geometries into consecutive (start, end) ranges of at most
+    max_features geometries and max_vertices vertices; a geometry larger
+    than max_vertices gets a range of its own
+    """
+    chunks = []
+    start = vertices = 0
+    for position, geometry in enumerate(geometries):
+        size = vertex_count(geometry)
+        if position > start and (position - start >= max_features or vertices + size > max_vertices):
+            chunks.append((start, position))
+            start, vertices = position, 0
+        vertices += size
+    if geometries:
+        chunks.append((start, len(geometries)))
+    return chunks
+
+
+def centroid(geometry):
+    """(lon, lat) centroid of a Point or of the first polygon's outer ring"""
+    if geometry['type'] == 'Point':
+        return tuple(geometry['coordinates'][:2])
+    ring = polygon_rings(geometry)[0][0]
+    x, y = ring[:, 0], ring[:, 1]
+    cross = x[:-1] * y[1:] - x[1:] * y[:-1]
+    area = cross.sum() / 2
+    if area == 0:
+        return float(x.mean()), float(y.mean())
+    return (float(((x[:-1] + x[1:]) * cross).sum() / (6 * area)),
+            float(((y[:-1] + y[1:]) * cross).sum() / (6 * area)))
+
+
+def pixel_grid(geometry, scale=10):
+    """
+    North-up lon/lat grid of roughly `scale` metre pixels covering the
+    geometry: ((x0, dx, y0, dy), height, width)
+    """
+    west, south, east, north = bounds(geometry)
+    dy = scale / METERS_PER_DEGREE
+    dx = scale / (METERS_PER_DEGREE * math.cos(math.radians((south + north) / 2)))
+    width = max(1, math.ceil((east - west) / dx))
+    height = max(1, math.ceil((north - south) / dy))
+    return (west, dx, north, -dy), height, width
+
+
+def pixel_area_m2(transform):
+    """Ground area of one pixel of a lon/lat grid, in square metres"""
+    x0, dx, y0, dy = transform
+    return abs(dx * math.cos(math.radians(y0)) * METERS_PER_DEGREE) * abs(dy * METERS_PER_DEGREE)
+
+
+def pixel_centres(transform, row0, col0, height, width):
+    """lon and lat arrays of the pixel centres of a tile"""
+    x0, dx, y0, dy = transform
+    xs = x0 + (col0 + np.arange(width) + 0.5) * dx
+    ys = y0 + (row0 + np.arange(height) + 0.5) * dy
+    return np.meshgrid(xs, ys)
+
+
+def _signed_area(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return (x[:-1] * y[1:] - x[1:] * y[:-1]).sum() / 2
+
+
+def _douglas_peucker(points, tolerance):
+    """Mask of the vertices of an open polyline kept at this tolerance"""
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last <= first + 1:
+            continue
+        segment = points[last] - points[first]
+        offsets = points[first + 1:last] - points[first]
+        length = math.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        farthest = int(distances.argmax())
+        if distances[farthest] > tolerance:
+            middle = first + 1 + farthest
+            keep[middle] = True
+            stack += [(first, middle), (middle, last)]
+    return keep
+
+
+def _canonical_ring(ring, exterior, tolerance_m, decimals):
+    ring = np.asarray(ring, dtype=np.float64)[:, :2]
+    # Open ring without repeated vertices
+    if len(ring) > 1 and (ring[0] == ring[-1]).all():
+        ring = ring[:-1]
+    ring = ring[np.r_[True, (np.diff(ring, axis=0) != 0).any(axis=1)]]
+    if len(ring) < 3:
+        return None
+
+    # RFC 7946 winding: exterior rings counter-clockwise, holes clockwise
+    if (_signed_area(np.vstack([ring, ring[:1]])) > 0) != exterior:
+        ring = ring[::-1]
+    # Start at the south-west-most vertex so vertex rotation does not matter
+    rounded = np.round(ring, decimals)
+    start = min(range(len(ring)), key=lambda index: (rounded[index, 0], rounded[index, 1]))
+    ring = np.roll(ring, -start, axis=0)
+
+    # Simplify in metres, anchored at the start and the vertex farthest from it
+    scale = np.array([METERS_PER_DEGREE * math.cos(math.radians(ring[:, 1].mean())), METERS_PER_DEGREE])
+    metres = (ring - ring[0]) * scale
+    far = int(np.hypot(metres[:, 0], metres[:, 1]).argmax())
+    closed = np.vstack([metres, metres[:1]])
+    keep = np.zeros(len(closed), dtype=bool)
+    keep[:far + 1] |= _douglas_peucker(closed[:far + 1], tolerance_m)
+    keep[far:] |= _douglas_peucker(closed[far:], tolerance_m)
+    simplified = ring[keep[:-1]]
+    if len(simplified) < 3:
+        simplified = ring
+
+    simplified = np.round(simplified, decimals)
+    simplified = simplified[np.r_[True, (np.diff(simplified, axis=0) != 0).any(axis=1)]]
+    return np.vstack([simplified, simplified[:1]]).tolist()
+
+
+def canonicalize(geometry, tolerance_m=10, decimals=5):
+    """
+    Canonical form of a Point or (Multi)Polygon: rings oriented and started
+    at a fixed vertex, simplified within tolerance_m (one Sentinel-2 pixel)
+    and rounded to `decimals` degrees (1e-5 is about a metre). Copies of a
+    field that differ only in precision, vertex order or redundant vertices
+    come out identical.
+    """
+    if geometry['type'] == 'Point':
+        return {'type': 'Point', 'coordinates': [round(value, decimals) for value in geometry['coordinates'][:2]]}
+    if geometry['type'] not in ('Polygon', 'MultiPolygon'):
+        return geometry
+
+    polygons = []
+    for polygon in polygon_rings(geometry):
+        exterior = _canonical_ring(polygon[0], True, tolerance_m, decimals)
+        if exterior is None:
+            continue
+        holes = [_canonical_ring(hole, False, tolerance_m, decimals) for hole in polygon[1:]]
+        polygons.append([exterior] + sorted(hole for hole in holes if hole is not None))
+    polygons.sort()
+    if len(polygons) == 1:
+        return {'type': 'Polygon', 'coordinates': polygons[0]}
+    return {'type': 'MultiPolygon', 'coordinates': polygons}
+
+
+def geometry_hash(geometry, tolerance_m=10):
+    """sha256 of the canonical form of a geometry"""
+    payload = json.dumps(canonicalize(geometry, tolerance_m), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _boxes_intersect(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def overlap(a, b, scale=10, max_pixels=1_000_000):
+    """Intersection over union of two (Multi)Polygons, measured on a pixel grid"""
+    box_a, box_b = bounds(a), bounds(b)
+    if not _boxes_intersect(box_a, box_b):
+        return 0.0
+    west, south = min(box_a[0], box_b[0]), min(box_a[1], box_b[1])
+    east, north = max(box_a[2], box_b[2]), max(box_a[3], box_b[3])
+    union_box = {'type': 'Polygon', 'coordinates': [[[west, south], [east, south], [east, north],
+                                                     [west, north], [west, south]]]}
+    transform, height, width = pixel_grid(union_box, scale)
+    if height * width > max_pixels:
+        # Coarser grid for very large geometries
+        transform, height, width = pixel_grid(union_box, scale * math.sqrt(height * width / max_pixels))
+    xs, ys = pixel_centres(transform, 0, 0, height, width)
+    inside_a, inside_b = contains(a, xs, ys), contains(b, xs, ys)
+    union = np.count_nonzero(inside_a | inside_b)
+    return float(np.count_nonzero(inside_a & inside_b) / union) if union else 0.0
+
+
+class SpatialIndex:
+    """
+    Uniform lon/lat grid over the bounding boxes of known geometries. Once
+    max_entries is exceeded the least recently matched unpinned entries
+    are dropped.
+    """
+
+    def __init__(self, cell_degrees=0.01, max_entries=10000):
+        self.cell_degrees = cell_degrees
+        self.max_entries = max_entries
+        self._cells = defaultdict(set)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _cells_of(self, box):
+        west, south, east, north = (math.floor(value / self.cell_degrees) for value in box)
+        return [(x, y) for x in range(west, east + 1) for y in range(south, north + 1)]
+
+    def insert(self, key, geometry, value=None, pinned=False):
+        box = bounds(geometry)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (box, geometry, value, pinned)
+            for cell in self._cells_of(box):
+                self._cells[cell].add(key)
+            if len(self._entries) > self.max_entries:
+                evictable = next((old for old, entry in self._entries.items() if not entry[3]), None)
+                if evictable is not None:
+                    self._remove(evictable)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            for cell in self._cells_of(entry[0]):
+                self._cells[cell].discard(key)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def candidates(self, box):
+        """Keys, geometries and values of the entries whose bounding box meets box"""
+        with self._lock:
+            keys = set().union(*(self._cells.get(cell, ()) for cell in self._cells_of(box)))
+            return [(key, self._entries[key][1], self._entries[key][2]) for key in keys
+                    if _boxes_intersect(self._entries[key][0], box)]
+
+    def best_match(self, geometry, min_overlap=0.9):
+        """(key, geometry, value, overlap) of the known geometry overlapping this one most, or None"""
+        best = None
+        for key, known, value in self.candidates(bounds(geometry)):
+            ratio = overlap(geometry, known)
+            if ratio >= min_overlap and (best is None or ratio > best[3]):
+                best = (key, known, value, ratio)
+        if best is not None:
+            with self._lock:
+                if best[0] in self._entries:
+                    self._entries.move_to_end(best[0])
+        return best
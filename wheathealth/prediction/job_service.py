@@ -0,0 +1,173 @@
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .admission_service import QuotaExceeded
+from .cache_service import canonical_geometry
+from .gee_service import is_rate_limited
+from .model_service import DEFAULT_MODEL, model_registry
+from .models import AnalysisJob
+
+JOB_KINDS = ('predict', 'indices')
+
+
+def job_settings():
+    config = {'RESULT_TTL': 86400, 'STALE_AFTER': 900, 'MAX_ATTEMPTS': 3, 'POLL_INTERVAL': 1.0}
+    config.update(getattr(settings, 'JOBS', {}))
+    return config
+
+
+def normalize_params(kind, params):
+    """
+    Validated copy of a job's parameters with the defaults filled in, so
+    that equivalent submissions hash to the same key. Raises ValueError.
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind '{kind}'")
+    params = dict(params or {})
+
+    if kind == 'predict':
+        params['model'] = params.get('model', DEFAULT_MODEL)
+        if params['model'] not in model_registry.selectable():
+            raise ValueError(f"Unknown model '{params['model']}'")
+        if not params.get('geometry'):
+            raise ValueError("'geometry' is required")
+        params['geometry'] = canonical_geometry(params['geometry'])
+        return params
+
+    params['lat'] = float(params.get('lat'))
+    params['lon'] = float(params.get('lon'))
+    datetime.strptime(params.get('start_date') or '', '%Y-%m-%d')
+    params['mode'] = params.get('mode', 'composite')
+    if params['mode'] not in ('composite', 'per_window'):
+        raise ValueError(f"unknown mode '{params['mode']}'")
+    return params
+
+
+def job_key(kind, params):
+    payload = json.dumps({'kind': kind, 'params': params}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def submit(kind, params):
+    """
+    Queue a job, or return the identical job that is already queued,
+    running or finished within RESULT_TTL: (job, created)
+    """
+    params = normalize_params(kind, params)
+    key = job_key(kind, params)
+
+    for attempt in range(3):
+        existing = reusable_job(key)
+        if existing is not None:
+            return existing, False
+        try:
+            with transaction.atomic():
+                return AnalysisJob.objects.create(kind=kind, params=params, key=key), True
+        except IntegrityError:
+            # Another request queued the same job in the meantime; it may
+            # also have finished (or failed) before the lookup above runs
+            if attempt == 2:
+                raise
+
+
+def reusable_job(key):
+    """The queued, running or recently finished job with this key, if any"""
+    finished = Q(status=AnalysisJob.DONE)
+    result_ttl = job_settings()['RESULT_TTL']
+    if result_ttl is not None:
+        finished &= Q(finished_at__gte=timezone.now() - timedelta(seconds=result_ttl))
+    return AnalysisJob.objects.filter(
+        Q(status__in=AnalysisJob.ACTIVE) | finished, key=key).order_by('-created_at').first()
+
+
+def requeue_stale():
+    """Return jobs whose worker died mid-run to the queue, or fail them"""
+    config = job_settings()
+    cutoff = timezone.now() - timedelta(seconds=config['STALE_AFTER'])
+    stale = AnalysisJob.objects.filter(status=AnalysisJob.RUNNING, started_at__lt=cutoff)
+    stale.filter(attempts__gte=config['MAX_ATTEMPTS']).update(
+        status=AnalysisJob.FAILED, error='Worker stopped responding', finished_at=timezone.now())
+    return stale.update(status=AnalysisJob.PENDING, worker='')
+
+
+def claim(worker):
+    """
+    Mark the oldest pending job as running for this worker and return it,
+    or None when the queue is empty. Jobs requeued with a retry delay are
+    skipped until it has passed. Safe across worker processes.
+    """
+    requeue_stale()
+    due = Q(not_before__isnull=True) | Q(not_before__lte=timezone.now())
+    candidates = AnalysisJob.objects.filter(due, status=AnalysisJob.PENDING).order_by('created_at')
+    for pk in candidates.values_list('pk', flat=True)[:10]:
+        # Only one worker still finds the row pending
+        claimed = AnalysisJob.objects.filter(pk=pk, status=AnalysisJob.PENDING).update(
+            status=AnalysisJob.RUNNING, worker=worker, started_at=timezone.now(),
+            attempts=F('attempts') + 1)
+        if claimed:
+            return AnalysisJob.objects.get(pk=pk)
+    return None
+
+
+def _handlers():
+    from .field_service import time_series_windows
+    from .views import index_time_series, prediction_payload
+
+    def indices(params):
+        start_date = datetime.strptime(params['start_date'], '%Y-%m-%d')
+        records = index_time_series(params['lat'], params['lon'], time_series_windows(start_date),
+                                    params['mode'])
+        # index_time_series turns errors into error windows; a run with any
+        # must not be stored as DONE and reused for RESULT_TTL. Windows
+        # without images carry no error and are a valid result.
+        windows = [record for record in records if '_meta' not in record]
+        errors = [record['error'] for record in windows if record.get('error')]
+        if errors:
+            # A throttled window first, so run() requeues the job
+            error = next((error for error in errors if is_rate_limited(error)), errors[0])
+            raise RuntimeError(f"{len(errors)} of {len(windows)} windows failed: {error}")
+        return records
+
+    return {'predict': prediction_payload, 'indices': indices}
+
+
+def run(job):
+    """Run a claimed job and store its result or error"""
+    try:
+        result = _handlers()[job.kind](job.params)
+    except Exception as e:
+        throttled = is_rate_limited(e) or isinstance(e, QuotaExceeded)
+        if throttled and job.attempts < job_settings()['MAX_ATTEMPTS']:
+            # Earth Engine, or our own request budget, is throttling us: let
+            # a later claim retry it, no sooner than the budget refills
+            logging.error(f"Job {job.pk} rate limited, requeueing: {str(e)}")
+            retry_after = getattr(e, 'retry_after', None)
+            not_before = timezone.now() + timedelta(seconds=retry_after) if retry_after else None
+            AnalysisJob.objects.filter(pk=job.pk).update(
+                status=AnalysisJob.PENDING, worker='', not_before=not_before)
+            return
+        logging.error(f"Job {job.pk} failed: {str(e)}")
+        AnalysisJob.objects.filter(pk=job.pk).update(
+            status=AnalysisJob.FAILED, error=str(e), finished_at=timezone.now())
+        return
+
+    AnalysisJob.objects.filter(pk=job.pk).update(
+        status=AnalysisJob.DONE, result=result, error='', finished_at=timezone.now())
+
+
+def job_info(job):
+    return {
+        "id": job.pk,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "error": job.error or None,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
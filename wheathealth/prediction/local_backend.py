@@ -0,0 +1,345 @@
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import numpy as np
+from .compositing import CLOUD_THRESHOLDS, QA60_CLOUD_BITS, SCL_CLEAR
+from .gee_service import FEATURE_THRESHOLDS, SPECTRAL_BANDS, TIME_SERIES_INDICES, field_chunks, field_reducer
+from .geometry import bounds, box_polygon, centroid, contains, pixel_centres, pixel_grid, union_bounds
+from .metrics_service import count_cloud_threshold, ee_call
+from .model_service import FEATURE_ORDER
+
+try:
+    import rasterio
+except ImportError:  # GeoTIFF scenes are optional, .npz always works
+    rasterio = None
+
+QUALITY_BANDS = ['QA60', 'SCL']
+
+
+class Scene:
+    """One Sentinel-2 acquisition: raw DN band arrays on a lon/lat grid"""
+
+    def __init__(self, bands, date, cloudy_pixel_percentage, transform):
+        self.bands = bands
+        self.date = date
+        self.cloudy_pixel_percentage = cloudy_pixel_percentage
+        # (x0, dx, y0, dy): lon/lat of the top-left corner and pixel size
+        self.transform = tuple(float(value) for value in transform)
+
+    @classmethod
+    def from_npz(cls, path):
+        """
+        Arrays named after the bands (B2 ... B12, QA60, SCL) plus 'date',
+        'cloudy_pixel_percentage' and 'transform'
+        """
+        with np.load(path) as data:
+            bands = {name: data[name].astype(np.float64) for name in data.files
+                     if name in SPECTRAL_BANDS or name in QUALITY_BANDS}
+            return cls(bands, str(data['date']), float(data['cloudy_pixel_percentage']), data['transform'])
+
+    @classmethod
+    def from_geotiff(cls, path):
+        """Band descriptions name the bands; DATE and CLOUDY_PIXEL_PERCENTAGE tags"""
+        with rasterio.open(path) as dataset:
+            tags = dataset.tags()
+            bands = {name: dataset.read(index + 1).astype(np.float64)
+                     for index, name in enumerate(dataset.descriptions) if name}
+            affine = dataset.transform
+            return cls(bands, tags['DATE'], float(tags.get('CLOUDY_PIXEL_PERCENTAGE', 0)),
+                       (affine.c, affine.a, affine.f, affine.e))
+
+
+def _normalized_difference(a, b):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (a - b) / (a + b)
+
+
+def _ratio(a, b):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return a / b
+
+
+def _median(stack):
+    """np.nanmedian over the first axis, without its slow path for inputs with NaNs"""
+    valid = np.isfinite(stack).sum(axis=0)
+    # NaNs sort last, so the valid values of each pixel come first
+    ordered = np.sort(stack, axis=0)
+    low = np.take_along_axis(ordered, ((valid - 1) // 2).clip(0)[None], axis=0)[0]
+    high = np.take_along_axis(ordered, (valid // 2).clip(0)[None], axis=0)[0]
+    return np.where(valid > 0, (low + high) / 2, np.nan)
+
+
+def _value(value):
+    value = float(value)
+    return None if np.isnan(value) or np.isinf(value) else value
+
+
+class LocalRasterBackend:
+    """
+    Extraction backend that reads Sentinel-2 scenes from disk instead of
+    calling Earth Engine, for offline benchmarks and tests. Every scene in
+    data_dir must share one grid. The median composites, indices and
+    reductions follow GEEDataExtractor so both backends return the same
+    dict shapes. latency adds a sleep per simulated Earth Engine round trip
+    so load tests see realistic request durations.
+    """
+    name = 'local'
+
+    def __init__(self, data_dir, latency=0.0):
+        self.data_dir = Path(data_dir)
+        self.latency = latency
+        self._scenes = None
+
+    def _round_trip(self):
+        # Counted like an Earth Engine call, so /metrics looks the same in tests,
+        # but not admission-controlled: simulated calls never spend real quota
+        ee_call('local_round_trip', time.sleep, self.latency)
+
+    @property
+    def scenes(self):
+        if self._scenes is None:
+            scenes = [Scene.from_npz(path) for path in sorted(self.data_dir.glob('*.npz'))]
+            tifs = sorted(self.data_dir.glob('*.tif'))
+            if tifs and rasterio is None:
+                logging.warning("rasterio is not installed, skipping GeoTIFF scenes")
+            elif tifs:
+                scenes += [Scene.from_geotiff(path) for path in tifs]
+            self._scenes = sorted(scenes, key=lambda scene: scene.date)
+        return self._scenes
+
+    def _select(self, start_date, end_date, max_cloud=None):
+        start_date, end_date = str(start_date)[:10], str(end_date)[:10]
+        return [scene for scene in self.scenes
+                if start_date <= scene.date < end_date
+                and (max_cloud is None or scene.cloudy_pixel_percentage < max_cloud)]
+
+    def _select_threshold(self, start_date, end_date, thresholds):
+        """Scenes under the strictest threshold that has any, else all: (scenes, threshold)"""
+        for limit in tuple(thresholds) + (None,):
+            scenes = self._select(start_date, end_date, max_cloud=limit)
+            if scenes:
+                return scenes, limit
+        return [], None
+
+    @staticmethod
+    def _clear(scene, window):
+        """compositing.mask_scene: pixels without cloud, shadow or invalid data"""
+        shape = next(iter(scene.bands.values()))[window].shape
+        clear = np.ones(shape, dtype=bool)
+        if 'QA60' in scene.bands:
+            clear &= (np.nan_to_num(scene.bands['QA60'][window]).astype(np.int64) & QA60_CLOUD_BITS) == 0
+        if 'SCL' in scene.bands:
+            clear &= np.isin(scene.bands['SCL'][window], SCL_CLEAR)
+        return clear
+
+    @classmethod
+    def _composite(cls, scenes, bands, window=(slice(None), slice(None))):
+        """Per-band median of the scenes, each masked before compositing"""
+        clear = np.stack([cls._clear(scene, window) for scene in scenes])
+        # Pixels masked in every scene stay NaN
+        return {band: _median(np.where(clear, np.stack([scene.bands[band][window] for scene in scenes]), np.nan))
+                for band in bands}
+
+    def _pixel(self, lon, lat):
+        x0, dx, y0, dy = self.scenes[0].transform
+        return int((lat - y0) // dy), int((lon - x0) // dx)
+
+    def _mask(self, geometry):
+        """Pixels whose centre falls inside the geometry"""
+        height, width = next(iter(self.scenes[0].bands.values())).shape
+        xs, ys = pixel_centres(self.scenes[0].transform, 0, 0, height, width)
+        mask = contains(geometry, xs, ys)
+        if geometry['type'] == 'Point':
+            row, col = self._pixel(*geometry['coordinates'][:2])
+            if 0 <= row < height and 0 <= col < width:
+                mask[row, col] = True
+        return mask
+
+    @classmethod
+    def _feature_image(cls, scenes, window=(slice(None), slice(None))):
+        """The 15 model features of extract_bands_and_indices, per pixel"""
+        image = {band: array / 10000 for band, array in
+                 cls._composite(scenes, SPECTRAL_BANDS, window).items()}
+        image['NDVI'] = _normalized_difference(image['B8'], image['B4'])
+        image['GNDVI'] = _normalized_difference(image['B8'], image['B3'])
+        image['NPCI'] = _normalized_difference(image['B4'], image['B2'])
+        image['DWSI'] = _normalized_difference(image['B8A'], image['B11'])
+        image['RVSI'] = _normalized_difference(image['B3'], image['B2'])
+        return image
+
+    def extract_bands_and_indices(self, geometry, start_date, end_date, cache_geometry=None):
+        # Nothing is cached locally, so cache_geometry has no entry to lend
+        self._round_trip()
+        return self._features(geometry, start_date, end_date)
+
+    def extract_feature_time_series(self, geometry, windows, use_cache=True):
+        self._round_trip()
+        return [self._features(geometry, start_date, end_date) for start_date, end_date in windows]
+
+    def _features(self, geometry, start_date, end_date):
+        scenes, threshold = self._select_threshold(start_date, end_date, FEATURE_THRESHOLDS)
+        values = {}
+        if scenes:
+            height, width = next(iter(scenes[0].bands.values())).shape
+            row, col = self._pixel(*centroid(geometry))
+            if 0 <= row < height and 0 <= col < width:
+                image = self._feature_image(scenes, (slice(row, row + 1), slice(col, col + 1)))
+                values = {band: _value(array[0, 0]) for band, array in image.items()}
+
+        return {'area_values': values, 'image_count': len(scenes), 'cloud_threshold': threshold}
+
+    def extract_fields(self, geometries, start_date, end_date, reducer='first', max_features=None,
+                       max_vertices=None):
+        """
+        GEEDataExtractor.extract_fields: one composite (and cloud threshold)
+        over the union bounds, one round trip per chunk of parcels; not cached
+        """
+        kind, percentile = field_reducer(reducer)
+        if not geometries:
+            return []
+        scenes, threshold = self._select_threshold(start_date, end_date, FEATURE_THRESHOLDS)
+        transform, height, width, row_offset, col_offset = self._grid_window(
+            box_polygon(union_bounds(geometries)))
+        image = None
+        if scenes and height and width:
+            image = self._feature_image(scenes, (slice(row_offset, row_offset + height),
+                                                 slice(col_offset, col_offset + width)))
+            xs, ys = pixel_centres(transform, 0, 0, height, width)
+
+        def reduce(array, inside):
+            pixels = array[inside]
+            pixels = pixels[np.isfinite(pixels)]
+            if not pixels.size:
+                return None
+            return _value(np.percentile(pixels, percentile) if kind == 'percentile' else pixels.mean())
+
+        results = []
+        for first, last in field_chunks(geometries, max_features, max_vertices):
+            self._round_trip()
+            for geometry in geometries[first:last]:
+                values = {}
+                if image is not None:
+                    lon, lat = centroid(geometry)
+                    row, col = int((lat - transform[2]) // transform[3]), int((lon - transform[0]) // transform[1])
+                    inside = np.zeros((height, width), dtype=bool) if kind == 'first' else contains(geometry, xs, ys)
+                    if not inside.any() and 0 <= row < height and 0 <= col < width:
+                        # 'first', and parcels smaller than a pixel, use the centroid's pixel
+                        inside[row, col] = True
+                    values = {band: reduce(array, inside) for band, array in image.items()}
+                results.append({'area_values': values, 'image_count': len(scenes), 'cloud_threshold': threshold})
+        return results
+
+    def _grid_window(self, geometry):
+        if not self.scenes:
+            # No grid to window: an empty one, which every caller reads as no data
+            return pixel_grid(geometry)[0], 0, 0, 0, 0
+        x0, dx, y0, dy = self.scenes[0].transform
+        full_height, full_width = next(iter(self.scenes[0].bands.values())).shape
+        west, south, east, north = bounds(geometry)
+        row_min, col_min = self._pixel(west, north)
+        row_max, col_max = self._pixel(east, south)
+        row_min, col_min = max(row_min, 0), max(col_min, 0)
+        row_max, col_max = min(row_max, full_height - 1), min(col_max, full_width - 1)
+        transform = (x0 + col_min * dx, dx, y0 + row_min * dy, dy)
+        return transform, max(row_max - row_min + 1, 0), max(col_max - col_min + 1, 0), row_min, col_min
+
+    def pixel_grid(self, geometry):
+        """Window of the scene grid covering the geometry: (transform, height, width)"""
+        return self._grid_window(geometry)[:3]
+
+    def pixel_tiles(self, geometry, start_date, end_date, tile_size=256):
+        """
+        Yield (row0, col0, features, mask) for tile_size square tiles of
+        pixel_grid(geometry); features is a (15, h, w) array in
+        FEATURE_ORDER and mask marks the pixels inside the geometry
+        """
+        scenes, _ = self._select_threshold(start_date, end_date, FEATURE_THRESHOLDS)
+        transform, height, width, row_offset, col_offset = self._grid_window(geometry)
+        if not scenes:
+            return
+        for row0 in range(0, height, tile_size):
+            for col0 in range(0, width, tile_size):
+                rows = slice(row_offset + row0, row_offset + min(row0 + tile_size, height))
+                cols = slice(col_offset + col0, col_offset + min(col0 + tile_size, width))
+                self._round_trip()
+                image = self._feature_image(scenes, (rows, cols))
+                features = np.stack([image[band] for band in FEATURE_ORDER])
+                xs, ys = pixel_centres(transform, row0, col0, *features.shape[1:])
+                yield row0, col0, features, contains(geometry, xs, ys)
+
+    def _indices(self, geometry, start_date, end_date):
+        """GEEDataExtractor._index_result: the indices, data_available, image_count and cloud_threshold"""
+        scenes, threshold = self._select_threshold(start_date, end_date, CLOUD_THRESHOLDS)
+        count_cloud_threshold(threshold if scenes else 'no_data')
+        result = {index: None for index in TIME_SERIES_INDICES}
+        result.update(data_available=bool(scenes), image_count=len(scenes), cloud_threshold=threshold)
+        if not scenes:
+            return result
+
+        image = self._composite(scenes, ['B2', 'B3', 'B4', 'B8', 'B11'])
+        region = self._mask(geometry)
+
+        def mean(array):
+            pixels = array[region]
+            pixels = pixels[np.isfinite(pixels)]
+            return _value(pixels.mean()) if pixels.size else None
+
+        result.update(
+            NDVI=mean(_normalized_difference(image['B8'], image['B4'])),
+            GNDVI=mean(_normalized_difference(image['B8'], image['B3'])),
+            DWSI=mean(_normalized_difference(image['B8'], image['B11'])),
+            RSV1=mean(_ratio(image['B4'], image['B2'])),
+        )
+        return result
+
+    def indices_with_fallback(self, geometry, start_date, end_date):
+        self._round_trip()
+        return self._indices(geometry, start_date, end_date)
+
+    def extract_index_time_series(self, geometry, windows, use_cache=True):
+        self._round_trip()
+        results = []
+        for start_date, end_date in windows:
+            result = self._indices(geometry, start_date, end_date)
+            result.update(self._fingerprint(start_date, end_date))
+            results.append(result)
+        return results
+
+    def _fingerprint(self, start_date, end_date):
+        scenes = self._select(start_date, end_date)
+        latest = max((scene.date for scene in scenes), default=None)
+        return {
+            'latest_image_time': int(datetime.strptime(latest, '%Y-%m-%d').replace(
+                tzinfo=timezone.utc).timestamp() * 1000) if latest else None,
+            'source_image_count': len(scenes),
+        }
+
+    def window_fingerprints(self, geometry, windows):
+        self._round_trip()
+        return [self._fingerprint(start_date, end_date) for start_date, end_date in windows]
+
+
+def write_synthetic_scenes(data_dir, geometry, start_date, days=180, revisit=5, size=64, seed=0):
+    """
+    Fill data_dir with random .npz scenes covering the geometry's bounding
+    box, one every `revisit` days, for benchmarking without real imagery
+    """
+    data_dir = Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    west, south, east, north = bounds(geometry)
+    west, south, east, north = west - 0.001, south - 0.001, east + 0.001, north + 0.001
+    transform = (west, (east - west) / size, north, -(north - south) / size)
+
+    rng = np.random.default_rng(seed)
+    start = datetime.strptime(str(start_date)[:10], '%Y-%m-%d')
+    for day in range(0, days, revisit):
+        date = (start + timedelta(days=day)).strftime('%Y-%m-%d')
+        bands = {band: rng.uniform(200, 4000, (size, size)) for band in SPECTRAL_BANDS}
+        bands['B8'] = rng.uniform(2000, 6000, (size, size))
+        bands['QA60'] = np.where(rng.random((size, size)) < 0.05, 1 << 10, 0).astype(np.float64)
+        # Mostly vegetation (4), some bare soil (5), cloud shadow (3) and cloud (8, 9)
+        bands['SCL'] = rng.choice([4, 5, 3, 8, 9], (size, size), p=[0.8, 0.1, 0.03, 0.04, 0.03]).astype(np.float64)
+        np.savez(data_dir / f'{date}.npz', date=date, transform=transform,
+                 cloudy_pixel_percentage=float(rng.uniform(0, 60)), **bands)
+    return data_dir
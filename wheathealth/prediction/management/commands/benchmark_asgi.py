@@ -0,0 +1,131 @@
+import asyncio
+import json
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from prediction import backends
+from prediction.local_backend import write_synthetic_scenes
+from prediction.views import FIELD_GEOMETRY
+
+ENDPOINTS = {
+    # name: (sync path, async path, method, payload)
+    'predict': ('/predict/', '/api/async/predict/', 'post', {
+        'geometry': FIELD_GEOMETRY, 'start_date': '2024-01-01', 'end_date': '2024-03-01'}),
+    'indices': ('/api/indices/', '/api/async/indices/', 'get', {
+        'lat': FIELD_GEOMETRY['coordinates'][0][0][1], 'lon': FIELD_GEOMETRY['coordinates'][0][0][0],
+        'start_date': '2024-01-01'}),
+}
+
+
+def _summary(latencies, errors, seconds, concurrency):
+    latencies = np.asarray(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(len(latencies) / seconds, 2),
+        'latency_ms': {
+            'p50': round(float(np.percentile(latencies, 50)), 1),
+            'p95': round(float(np.percentile(latencies, 95)), 1),
+            'max': round(float(latencies.max()), 1),
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = ("Compare WSGI (sync views, one request per thread) and ASGI (async views) "
+            "throughput against the local backend with simulated Earth Engine latency")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='predict')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=100,
+                            help="Requests the load generator keeps in flight")
+        parser.add_argument('--wsgi-threads', type=int, default=8,
+                            help="Request threads of the simulated WSGI worker (gunicorn --threads)")
+        parser.add_argument('--latency', type=float, default=0.5,
+                            help="Seconds per simulated Earth Engine round trip")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        sync_path, async_path, method, payload = ENDPOINTS[options['endpoint']]
+        data_dir = tempfile.mkdtemp(prefix='wheathealth-scenes-')
+        write_synthetic_scenes(data_dir, FIELD_GEOMETRY, '2024-01-01', days=200)
+
+        with override_settings(EXTRACTION_BACKEND='local', LOCAL_BACKEND_DATA_DIR=data_dir,
+                               LOCAL_BACKEND_LATENCY=options['latency']):
+            backends._backends.pop('local', None)
+            # Load the model and the scenes before timing anything
+            self._request(Client(), sync_path, method, payload)
+
+            results = {
+                'endpoint': options['endpoint'],
+                'latency_per_round_trip': options['latency'],
+                'wsgi': self._run_wsgi(sync_path, method, payload, options),
+                'asgi': self._run_asgi(async_path, method, payload, options),
+            }
+            backends._backends.pop('local', None)
+
+        self.stdout.write(json.dumps(results, indent=2))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+    @staticmethod
+    def _request(client, path, method, payload):
+        if method == 'post':
+            return client.post(path, json.dumps(payload), content_type='application/json')
+        return client.get(path, payload)
+
+    def _run_wsgi(self, path, method, payload, options):
+        local = threading.local()
+        # The load generator keeps `concurrency` requests open; the ones the
+        # worker threads cannot take yet wait in its queue, as in gunicorn
+        in_flight = threading.Semaphore(options['concurrency'])
+
+        def one(submitted):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            try:
+                response = self._request(local.client, path, method, payload)
+                return time.perf_counter() - submitted, response.status_code != 200
+            finally:
+                in_flight.release()
+
+        started = time.perf_counter()
+        futures = []
+        with ThreadPoolExecutor(max_workers=options['wsgi_threads']) as pool:
+            for _ in range(options['requests']):
+                in_flight.acquire()
+                futures.append(pool.submit(one, time.perf_counter()))
+        outcomes = [future.result() for future in futures]
+        return _summary([latency for latency, _ in outcomes], sum(failed for _, failed in outcomes),
+                        time.perf_counter() - started, options['concurrency'])
+
+    def _run_asgi(self, path, method, payload, options):
+        async def run():
+            client = AsyncClient()
+            in_flight = asyncio.Semaphore(options['concurrency'])
+
+            async def one():
+                async with in_flight:
+                    started = time.perf_counter()
+                    if method == 'post':
+                        response = await client.post(path, json.dumps(payload), content_type='application/json')
+                    else:
+                        response = await client.get(path, payload)
+                    return time.perf_counter() - started, response.status_code != 200
+
+            started = time.perf_counter()
+            outcomes = await asyncio.gather(*(one() for _ in range(options['requests'])))
+            return outcomes, time.perf_counter() - started
+
+        outcomes, seconds = asyncio.run(run())
+        return _summary([latency for latency, _ in outcomes], sum(failed for _, failed in outcomes),
+                        seconds, options['concurrency'])
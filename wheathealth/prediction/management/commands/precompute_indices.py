@@ -0,0 +1,38 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from prediction.field_service import precompute_fields
+from prediction.model_service import DEFAULT_MODEL, WheatHealthPredictor, model_registry
+from prediction.columnar_service import series_store
+from prediction.models import Field, FieldWindow
+
+
+class Command(BaseCommand):
+    help = "Extract and store the index time series and health predictions of registered fields"
+
+    def add_arguments(self, parser):
+        parser.add_argument('fields', nargs='*', help="Field names (default: every field)")
+        parser.add_argument('--model', default=DEFAULT_MODEL)
+        parser.add_argument('--refresh', action='store_true',
+                            help="Recompute windows that are already stored and final")
+
+    def handle(self, *args, **options):
+        if options['model'] not in model_registry.selectable():
+            raise CommandError(f"Unknown model '{options['model']}'")
+
+        fields = Field.objects.all()
+        if options['fields']:
+            fields = fields.filter(name__in=options['fields'])
+            missing = set(options['fields']) - set(fields.values_list('name', flat=True))
+            if missing:
+                raise CommandError(f"Unknown fields: {', '.join(sorted(missing))}")
+
+        started = time.perf_counter()
+        computed = precompute_fields(list(fields), predictor=WheatHealthPredictor(options['model']),
+                                     refresh=options['refresh'])
+        for field, count in computed.items():
+            self.stdout.write(f"{field.name}: {count} window(s) computed")
+
+        table = series_store.write(FieldWindow.objects.select_related('field'))
+        self.stdout.write(f"Wrote {len(table)} window(s) to {series_store.path}")
+        self.stdout.write(f"Precomputed {sum(computed.values())} window(s) of {len(computed)} field(s) "
+                          f"in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,52 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from prediction.benchmarks import BENCHMARKS, compare, run
+
+
+class Command(BaseCommand):
+    help = ("Benchmark /predict/, /api/indices/, model throughput, model load time and worker "
+            "memory against synthetic scenes, and write the results as JSON")
+
+    def add_arguments(self, parser):
+        parser.add_argument('benchmarks', nargs='*',
+                            help=f"Benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--baseline', help="Results of an earlier run to check for regressions")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="Slowdown, as a fraction, that counts as a regression")
+        parser.add_argument('--repeat', type=int, help="Requests per endpoint variant")
+        parser.add_argument('--batch-sizes', type=int, nargs='+', help="Rows per predict call")
+        parser.add_argument('--record-limit', type=int,
+                            help="Largest batch also run through predict_batch")
+        parser.add_argument('--engines', nargs='+', choices=['native', 'flat', 'auto'],
+                            help="Inference engines to compare (default: each model's configured engine)")
+        parser.add_argument('--latency', type=float,
+                            help="Seconds per simulated Earth Engine round trip")
+
+    def handle(self, *args, **options):
+        unknown = set(options['benchmarks']) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        results = run(options['benchmarks'], repeat=options['repeat'], batch_sizes=options['batch_sizes'],
+                      record_limit=options['record_limit'], engines=options['engines'],
+                      latency=options['latency'])
+
+        self.stdout.write(json.dumps(results, indent=2))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+        if baseline is not None:
+            regressions = compare(baseline, results, options['tolerance'])
+            for path, before, after in regressions:
+                self.stderr.write(f"{path}: {before:g} -> {after:g}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} metric(s) regressed by more than "
+                                   f"{options['tolerance']:.0%} against {options['baseline']}")
+            self.stdout.write(f"No regressions against {options['baseline']}")
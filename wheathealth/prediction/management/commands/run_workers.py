@@ -0,0 +1,71 @@
+import logging
+import os
+import socket
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from prediction import job_service
+
+# Seconds a worker thread waits at most after repeated errors
+MAX_BACKOFF = 60
+
+
+class Command(BaseCommand):
+    help = "Run queued analysis jobs (/api/jobs/) off the request path"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2,
+                            help="Jobs run concurrently by this process")
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help="Seconds to wait when the queue is empty (default: JOBS['POLL_INTERVAL'])")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty instead of polling")
+
+    def handle(self, *args, **options):
+        poll_interval = options['poll_interval']
+        if poll_interval is None:
+            poll_interval = job_service.job_settings()['POLL_INTERVAL']
+        stop = threading.Event()
+
+        def work(index):
+            worker = f'{socket.gethostname()}:{os.getpid()}:{index}'
+            failures = 0
+            while not stop.is_set():
+                try:
+                    close_old_connections()
+                    job = job_service.claim(worker)
+                    if job is None:
+                        if options['once']:
+                            break
+                        stop.wait(poll_interval)
+                        continue
+
+                    started = time.perf_counter()
+                    job_service.run(job)
+                    self.stdout.write(f"{worker} finished {job.kind} job {job.pk} "
+                                      f"in {time.perf_counter() - started:.1f}s")
+                    failures = 0
+                except Exception as e:
+                    # e.g. "database is locked" under SQLite: keep the thread alive.
+                    # A job left running is requeued once it goes stale.
+                    failures += 1
+                    delay = min(MAX_BACKOFF, (poll_interval or 1.0) * 2 ** failures)
+                    logging.error(f"Job worker {worker} failed, retrying in {delay:.1f}s: {str(e)}")
+                    stop.wait(delay)
+            close_old_connections()
+
+        threads = [threading.Thread(target=work, args=(index,), daemon=True)
+                   for index in range(max(1, options['workers']))]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Started {len(threads)} job worker(s)")
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            stop.set()
+            self.stdout.write("Stopping after the running jobs finish")
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,173 @@
+import bisect
+import contextvars
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Seconds
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Earth Engine calls made by one request
+CALL_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+METRICS = {
+    # name: (type, help)
+    'wheathealth_stage_seconds': ('histogram', "Time spent in each processing stage"),
+    'wheathealth_request_seconds': ('histogram', "Request duration by view"),
+    'wheathealth_requests_total': ('counter', "Requests by view and HTTP status"),
+    'wheathealth_view_errors_total': ('counter', "Requests answered with an error payload"),
+    'wheathealth_ee_calls_total': ('counter', "Earth Engine round trips by kind"),
+    'wheathealth_ee_calls_per_request': ('histogram', "Earth Engine round trips per request"),
+    'wheathealth_cloud_threshold_total': ('counter',
+                                          "Windows by the cloud threshold they fell back to"),
+    'wheathealth_admission_total': ('counter', "Requests admitted or rejected (429) by priority"),
+    'wheathealth_ee_tokens_total': ('counter', "Earth Engine request tokens granted or refused by priority"),
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """Process-wide counters and histograms, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in (labels or {}).items()))
+
+    def inc(self, name, labels=None, amount=1):
+        with self._lock:
+            self._counters[self._key(name, labels)] += amount
+
+    def observe(self, name, value, labels=None, buckets=DURATION_BUCKETS):
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            self._histograms[key].observe(value)
+
+    @staticmethod
+    def _labels(pairs, extra=()):
+        pairs = list(pairs) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(histogram.buckets), list(histogram.counts), histogram.sum)
+                          for key, histogram in self._histograms.items()}
+
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            series = ([(labels, value) for (metric, labels), value in counters.items() if metric == name]
+                      if kind == 'counter' else
+                      [(labels, value) for (metric, labels), value in histograms.items() if metric == name])
+            if not series:
+                continue
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+            for labels, value in sorted(series):
+                if kind == 'counter':
+                    lines.append(f'{name}{self._labels(labels)} {value:g}')
+                    continue
+                buckets, counts, total = value
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{self._labels(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_sum{self._labels(labels)} {total:g}')
+                lines.append(f'{name}_count{self._labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+
+class RequestTrace:
+    """Per-request stage timings and counts, for the Server-Timing header"""
+
+    def __init__(self):
+        self.stages = {}
+        self.ee_calls = 0
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            total, count = self.stages.get(stage, (0.0, 0))
+            self.stages[stage] = (total + seconds, count + 1)
+
+    def count_ee_call(self):
+        with self._lock:
+            self.ee_calls += 1
+
+    def server_timing(self, total_seconds=None):
+        with self._lock:
+            stages = dict(self.stages)
+        entries = [f'{stage};dur={seconds * 1000:.1f};desc="{count}x"'
+                   for stage, (seconds, count) in stages.items()]
+        if total_seconds is not None:
+            entries.append(f'total;dur={total_seconds * 1000:.1f}')
+        return ', '.join(entries)
+
+
+# Thread pools that run work for a request copy the context (see
+# WindowExecutor.submit and run_blocking) so spans reach its trace
+_current_trace = contextvars.ContextVar('request_trace', default=None)
+
+
+def start_trace():
+    """Begin a RequestTrace for the current request; returns (trace, token)"""
+    trace = RequestTrace()
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    _current_trace.reset(token)
+
+
+@contextmanager
+def span(stage):
+    """Time a stage into the stage histogram and the current request's trace"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe('wheathealth_stage_seconds', elapsed, {'stage': stage})
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(stage, elapsed)
+
+
+def ee_call(kind, func, *args, **kwargs):
+    """Make one Earth Engine round trip, counted and timed as stage `kind`"""
+    metrics.inc('wheathealth_ee_calls_total', {'kind': kind})
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count_ee_call()
+    with span(kind):
+        return func(*args, **kwargs)
+
+
+def count_cloud_threshold(threshold):
+    """Record which cloud threshold a window's composite used (None: no filter)"""
+    metrics.inc('wheathealth_cloud_threshold_total',
+                {'threshold': 'none' if threshold is None else threshold})
+
+
+def count_view_error(view):
+    metrics.inc('wheathealth_view_errors_total', {'view': view})
@@ -0,0 +1,172 @@
+import re
+import time
+import zlib
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+from .metrics_service import CALL_BUCKETS, end_trace, metrics, span, start_trace
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip always works
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/event-stream', 'application/x-npz')
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+class InstrumentationMiddleware:
+    """
+    Traces every request: the stage timings recorded by span() go into a
+    Server-Timing header, and the request duration, status and Earth Engine
+    call count into the /metrics histograms.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        trace, token = start_trace()
+        try:
+            response = self.get_response(request)
+        finally:
+            end_trace(token)
+        return self._finish(request, response, trace, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        trace, token = start_trace()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_trace(token)
+        return self._finish(request, response, trace, started)
+
+    @staticmethod
+    def _finish(request, response, trace, started):
+        elapsed = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match and match.url_name else 'unmatched'
+        if view == 'metrics':
+            return response
+
+        metrics.observe('wheathealth_request_seconds', elapsed, {'view': view})
+        metrics.inc('wheathealth_requests_total', {'view': view, 'status': response.status_code})
+        metrics.observe('wheathealth_ee_calls_per_request', trace.ee_calls, {'view': view},
+                        buckets=CALL_BUCKETS)
+        # Streamed bodies are produced after this point; their stages only
+        # reach the histograms
+        response['Server-Timing'] = trace.server_timing(elapsed)
+        return response
+
+
+def _compressor(encoding):
+    """(compress(chunk) -> bytes, finish() -> bytes) for 'br' or 'gzip'"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return (lambda chunk: compressor.process(chunk) + compressor.flush()), compressor.finish
+    # wbits 16 + MAX_WBITS writes a gzip header
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return (lambda chunk: compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)), compressor.flush
+
+
+def _compress_stream(chunks, encoding):
+    # Flushed after every chunk, so each streamed record still arrives at once
+    compress, finish = _compressor(encoding)
+    for chunk in chunks:
+        yield compress(chunk)
+    yield finish()
+
+
+async def _acompress_stream(chunks, encoding):
+    compress, finish = _compressor(encoding)
+    async for chunk in chunks:
+        yield compress(chunk)
+    yield finish()
+
+
+def accepted_encodings(header):
+    """{coding: q} from an Accept-Encoding header; unparsable weights count as 0"""
+    weights = {}
+    for entry in header.split(','):
+        coding, *params = [part.strip() for part in entry.split(';')]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding.lower()] = q
+    return weights
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compresses JSON, NDJSON, event-stream and .npz responses with the coding
+    the client weights highest: brotli when the brotli package is installed,
+    else gzip, ignoring codings sent with q=0. Bodies under
+    RESPONSE_COMPRESSION_MIN_BYTES are sent as they are.
+
+    Whole bodies are gzipped by Django's compress_string, padded with the
+    random bytes of GZipMiddleware. Django's compress_sequence holds streamed
+    chunks back until its buffer fills, so streams are flushed chunk by chunk
+    here instead.
+    """
+
+    @staticmethod
+    def _encoding(request):
+        weights = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        # br wins ties; '*' stands for any coding the header does not name
+        offered = (['br'] if brotli is not None else []) + ['gzip']
+        ranked = [(weights.get(coding, weights.get('*', 0)), coding) for coding in offered]
+        q, encoding = max(ranked, key=lambda pair: pair[0])
+        return encoding if q > 0 else None
+
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if response.has_header('Content-Encoding') or content_type not in COMPRESSIBLE_TYPES:
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self._encoding(request)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = _acompress_stream(response.streaming_content, encoding)
+            else:
+                response.streaming_content = _compress_stream(response.streaming_content, encoding)
+            del response.headers['Content-Length']
+        else:
+            if len(response.content) < getattr(settings, 'RESPONSE_COMPRESSION_MIN_BYTES', 1024):
+                return response
+            with span('compress'):
+                if encoding == 'gzip':
+                    compressed = compress_string(response.content, max_random_bytes=self.max_random_bytes)
+                else:
+                    compress, finish = _compressor(encoding)
+                    compressed = compress(response.content) + finish()
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # The body differs byte for byte from the uncompressed one
+        if response.has_header('ETag'):
+            response.headers['ETag'] = re.sub(r'^(W/)?', 'W/', response.headers['ETag'])
+        response.headers['Content-Encoding'] = encoding
+        return response
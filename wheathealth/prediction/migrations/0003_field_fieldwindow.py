@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0002_analysisjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Field',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('crop', models.CharField(default='wheat', max_length=50)),
+                ('geometry', models.JSONField()),
+                ('sowing_date', models.DateField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FieldWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('ndvi', models.FloatField(blank=True, null=True)),
+                ('gndvi', models.FloatField(blank=True, null=True)),
+                ('dwsi', models.FloatField(blank=True, null=True)),
+                ('rsv1', models.FloatField(blank=True, null=True)),
+                ('data_available', models.BooleanField(default=False)),
+                ('image_count', models.PositiveIntegerField(default=0)),
+                ('cloud_threshold', models.IntegerField(blank=True, null=True)),
+                ('model', models.CharField(blank=True, max_length=50)),
+                ('prediction', models.IntegerField(blank=True, null=True)),
+                ('confidence', models.FloatField(blank=True, null=True)),
+                ('healthy_probability', models.FloatField(blank=True, null=True)),
+                ('computed_at', models.DateTimeField()),
+                ('field', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='windows', to='prediction.field')),
+            ],
+            options={
+                'ordering': ['field', 'start_date'],
+                'constraints': [models.UniqueConstraint(fields=('field', 'start_date'), name='unique_field_window')],
+            },
+        ),
+    ]
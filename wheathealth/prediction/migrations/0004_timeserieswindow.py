@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0003_field_fieldwindow'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fieldwindow',
+            name='checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='fieldwindow',
+            name='latest_image_time',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='fieldwindow',
+            name='source_image_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='TimeSeriesWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('geometry_key', models.CharField(max_length=64)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('value', models.JSONField()),
+                ('latest_image_time', models.BigIntegerField(blank=True, null=True)),
+                ('source_image_count', models.PositiveIntegerField(blank=True, null=True)),
+                ('computed_at', models.DateTimeField()),
+                ('checked_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('geometry_key', 'start_date', 'end_date'), name='unique_time_series_window')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0004_timeserieswindow'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fieldwindow',
+            name='features',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -1,63 +1,503 @@
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import threading
+import time
 import joblib
 import numpy as np
 from pathlib import Path
+from django.conf import settings
+from .metrics_service import span
+
+MODELS_DIR = Path(__file__).parent.parent / 'models'
+
+DEFAULT_MODEL = 'random_forest'
+
+# Model name that averages the probabilities of ENSEMBLE_MODELS
+ENSEMBLE = 'ensemble'
+
+# Below this many rows the 'auto' engine uses the flattened trees
+AUTO_NATIVE_MIN_ROWS = 512
+MODEL_SUFFIX = '_cropland_model'
+
+# Column order of the feature matrix the models were trained on
+FEATURE_ORDER = [
+    'B2',     # Blue
+    'B3',     # Green
+    'B4',     # Red
+    'B5',     # Red Edge 1
+    'B6',     # Red Edge 2
+    'B7',     # Red Edge 3
+    'B8',     # NIR
+    'B8A',    # Red Edge 4
+    'B11',    # SWIR 1
+    'B12',    # SWIR 2
+    'NDVI',
+    'GNDVI',
+    'NPCI',
+    'DWSI',
+    'RVSI',
+]
+
+
+def _resident_bytes():
+    """Current resident set size of this process, or None if unavailable"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+try:
+    # XGBoost's sigmoid calls the C library's expf
+    _libm_expf = ctypes.CDLL(ctypes.util.find_library('m')).expf
+    _libm_expf.restype = ctypes.c_float
+    _libm_expf.argtypes = [ctypes.c_float]
+except (OSError, AttributeError, TypeError):  # no loadable libm, rounding alone is within one ulp
+    _libm_expf = None
+
+# Distance from a float32 rounding tie, in ulps, inside which libm may round
+# differently from the exactly rounded value (glibc's expf is within 0.502 ulp)
+EXPF_TIE_WINDOW = 0.01
+
+
+def _expf(x):
+    """
+    expf of a float32 array as libm computes it. The float64 exp rounded to
+    float32 agrees with libm except right next to a rounding tie; those few
+    elements are recomputed with libm's expf itself.
+    """
+    with np.errstate(over='ignore'):
+        wide = np.exp(x.astype(np.float64))
+        result = wide.astype(np.float32)
+    if _libm_expf is not None:
+        with np.errstate(invalid='ignore'):
+            offset = np.abs(wide - result) / np.spacing(result).astype(np.float64)
+        for position in np.flatnonzero(np.abs(offset - 0.5) < EXPF_TIE_WINDOW):
+            result[position] = _libm_expf(float(x[position]))
+    return result
+
+
+class FlatTreeEnsemble:
+    """
+    A fitted random forest or XGBoost binary classifier flattened into node
+    arrays (feature, threshold, children) and evaluated with vectorized
+    NumPy traversal. Inputs are cast to float32 and trees are summed in
+    order, as in the original libraries, and XGBoost's sigmoid uses libm's
+    expf (see _expf), so probabilities match the original model bit for
+    bit. It avoids the per-call overhead of predict_proba on small inputs.
+    """
+
+    # Rows traversed at once; bounds the (n_trees, rows) node index array
+    BLOCK_ROWS = 2048
+
+    def __init__(self, kind, feature, threshold, left, right, missing_left, leaf_values,
+                 roots, max_depth, classes, base_margin=0.0):
+        self.native = None
+        self.native_min_rows = None
+        self.kind = kind
+        self.feature = feature
+        self.threshold = threshold
+        self.children = np.stack([left, right], axis=1)
+        self.missing_left = missing_left
+        self.leaf_values = leaf_values
+        self.roots = roots
+        self.max_depth = max_depth
+        self.classes_ = classes
+        self.base_margin = base_margin
+
+    @classmethod
+    def compile(cls, model, native_min_rows=None):
+        """
+        Flatten a fitted model. With native_min_rows, inputs of at least
+        that many rows are handed back to the original model, whose
+        compiled traversal wins on large batches.
+        """
+        if hasattr(model, 'get_booster'):
+            compiled = cls.from_xgboost(model)
+        elif hasattr(model, 'estimators_'):
+            compiled = cls.from_sklearn_forest(model)
+        else:
+            raise TypeError(f"Cannot compile {type(model).__name__}")
+        if native_min_rows is not None:
+            compiled.native = model
+            compiled.native_min_rows = native_min_rows
+        return compiled
+
+    @classmethod
+    def from_sklearn_forest(cls, forest):
+        parts = {'feature': [], 'threshold': [], 'left': [], 'right': [], 'missing_left': [], 'leaf_values': []}
+        roots = []
+        offset = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            state = tree.__getstate__()
+            nodes = state['nodes']
+            count = tree.node_count
+            ids = np.arange(count)
+            is_leaf = nodes['left_child'] == -1
+
+            # Same normalisation as DecisionTreeClassifier.predict_proba
+            values = state['values'][:, 0, :len(forest.classes_)].astype(np.float64)
+            normalizer = values.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+
+            parts['feature'].append(np.where(is_leaf, 0, nodes['feature']))
+            parts['threshold'].append(nodes['threshold'])
+            # Leaves point at themselves so extra traversal steps are no-ops
+            parts['left'].append(np.where(is_leaf, ids, nodes['left_child']) + offset)
+            parts['right'].append(np.where(is_leaf, ids, nodes['right_child']) + offset)
+            parts['missing_left'].append(
+                nodes['missing_go_to_left'].astype(bool) if 'missing_go_to_left' in nodes.dtype.names
+                else np.zeros(count, dtype=bool))
+            parts['leaf_values'].append(values / normalizer)
+            roots.append(offset)
+            offset += count
+
+        return cls(
+            'forest',
+            np.concatenate(parts['feature']).astype(np.intp),
+            np.concatenate(parts['threshold']).astype(np.float64),
+            np.concatenate(parts['left']).astype(np.intp),
+            np.concatenate(parts['right']).astype(np.intp),
+            np.concatenate(parts['missing_left']),
+            np.concatenate(parts['leaf_values']),
+            np.asarray(roots, dtype=np.intp),
+            max(estimator.tree_.max_depth for estimator in forest.estimators_),
+            forest.classes_,
+        )
+
+    @classmethod
+    def from_xgboost(cls, model):
+        learner = json.loads(model.get_booster().save_raw('json'))['learner']
+        if learner['objective']['name'] != 'binary:logistic':
+            raise TypeError(f"Unsupported XGBoost objective {learner['objective']['name']}")
+        trees = learner['gradient_booster']['model']['trees']
+        base_score = np.float32(learner['learner_model_param']['base_score'].strip('[]'))
+
+        parts = {'feature': [], 'threshold': [], 'left': [], 'right': [], 'missing_left': [], 'leaf_values': []}
+        roots = []
+        offset = 0
+        max_depth = 0
+        for tree in trees:
+            left = np.asarray(tree['left_children'], dtype=np.intp)
+            right = np.asarray(tree['right_children'], dtype=np.intp)
+            count = len(left)
+            ids = np.arange(count)
+            is_leaf = left == -1
+            conditions = np.asarray(tree['split_conditions'], dtype=np.float32)
+
+            parts['feature'].append(np.where(is_leaf, 0, tree['split_indices']))
+            parts['threshold'].append(conditions)
+            parts['left'].append(np.where(is_leaf, ids, left) + offset)
+            parts['right'].append(np.where(is_leaf, ids, right) + offset)
+            parts['missing_left'].append(np.asarray(tree['default_left'], dtype=bool))
+            # Leaf weights are stored in split_conditions
+            parts['leaf_values'].append(np.where(is_leaf, conditions, np.float32(0)))
+            roots.append(offset)
+            offset += count
+
+            depth = np.zeros(count, dtype=np.intp)
+            for node in range(count):
+                if not is_leaf[node]:
+                    depth[left[node]] = depth[right[node]] = depth[node] + 1
+            max_depth = max(max_depth, int(depth.max()))
+
+        one = np.float32(1)
+        return cls(
+            'boosted',
+            np.concatenate(parts['feature']).astype(np.intp),
+            np.concatenate(parts['threshold']),
+            np.concatenate(parts['left']),
+            np.concatenate(parts['right']),
+            np.concatenate(parts['missing_left']),
+            np.concatenate(parts['leaf_values']).astype(np.float32),
+            np.asarray(roots, dtype=np.intp),
+            max_depth,
+            model.classes_,
+            base_margin=-np.log(one / base_score - one),
+        )
+
+    def apply(self, X):
+        """Leaf index reached by every row in every tree, shape (n_trees, n_rows)"""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        flat = X.ravel()
+        row_base = (np.arange(len(X)) * X.shape[1])[np.newaxis, :]
+        nodes = np.repeat(self.roots[:, np.newaxis], len(X), axis=1)
+        for _ in range(self.max_depth):
+            values = flat[row_base + self.feature[nodes]]
+            # scikit-learn sends x <= threshold left, XGBoost x < threshold
+            if self.kind == 'forest':
+                go_right = ~(values <= self.threshold[nodes])
+            else:
+                go_right = ~(values < self.threshold[nodes])
+            missing = np.isnan(values)
+            if missing.any():
+                go_right = np.where(missing, ~self.missing_left[nodes], go_right)
+            nodes = self.children[nodes, go_right.astype(np.intp)]
+        return nodes
+
+    def _predict_block(self, X):
+        leaves = self.apply(X)
+        if self.kind == 'forest':
+            proba = np.zeros((len(X), len(self.classes_)), dtype=np.float64)
+            for tree_leaves in leaves:
+                proba += self.leaf_values[tree_leaves]
+            proba /= len(self.roots)
+            return proba
+
+        margin = np.full(len(X), self.base_margin, dtype=np.float32)
+        for tree_leaves in leaves:
+            margin += self.leaf_values[tree_leaves]
+        # XGBoost's sigmoid, in float32: 1 / (1 + expf(-margin))
+        one = np.float32(1)
+        positive = one / (_expf(-margin) + one)
+        return np.vstack((one - positive, positive)).T
+
+    def predict_proba(self, X):
+        X = np.asarray(X)
+        if self.native is not None and len(X) >= self.native_min_rows:
+            return self.native.predict_proba(X)
+        if len(X) <= self.BLOCK_ROWS:
+            return self._predict_block(X)
+        return np.concatenate([self._predict_block(X[start:start + self.BLOCK_ROWS])
+                               for start in range(0, len(X), self.BLOCK_ROWS)])
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+class EnsembleModel:
+    """Averages the class probabilities of several models over the same features"""
+
+    def __init__(self, models):
+        self.models = models
+        self.classes_ = models[0].classes_
+        for model in models[1:]:
+            if not np.array_equal(model.classes_, self.classes_):
+                raise ValueError("Ensemble members must share the same classes")
+
+    def predict_proba(self, X):
+        probabilities = np.zeros((len(X), len(self.classes_)), dtype=np.float64)
+        for model in self.models:
+            probabilities += model.predict_proba(X)
+        probabilities /= len(self.models)
+        return probabilities
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+class ModelRegistry:
+    """
+    Loads each pickled model in MODELS_DIR once per process and hands out the
+    shared instance. A model is reloaded when its file changes on disk.
+    """
+
+    def __init__(self, models_dir=MODELS_DIR, mmap_mode=None, reload_on_change=True, engines=None):
+        self.models_dir = Path(models_dir)
+        self.mmap_mode = mmap_mode
+        self.reload_on_change = reload_on_change
+        self.engines = engines or {}
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def selectable(self):
+        """Model names a request may ask for, including the ensemble"""
+        return self.available() + [ENSEMBLE]
+
+    def available(self):
+        """Model names found in the models directory"""
+        return sorted(
+            path.stem[:-len(MODEL_SUFFIX)] if path.stem.endswith(MODEL_SUFFIX) else path.stem
+            for path in self.models_dir.glob('*.pkl')
+        )
+
+    def path_for(self, name):
+        path = self.models_dir / f'{name}{MODEL_SUFFIX}.pkl'
+        if not path.exists():
+            path = self.models_dir / f'{name}.pkl'
+        return path
+
+    def get(self, name=DEFAULT_MODEL, engine=None):
+        """
+        The shared model instance. engine is 'native' (the unpickled
+        estimator), 'flat' (FlatTreeEnsemble) or 'auto' (flat for small
+        inputs, native for large ones); it defaults to MODEL_ENGINES[name].
+        """
+        entry = self._entry(name)
+        engine = engine or self.engines.get(name, 'native')
+        if engine == 'native':
+            return entry['model']
+        if engine not in ('flat', 'auto'):
+            raise ValueError(f"Unknown inference engine '{engine}'")
+
+        compiled = entry['engines'].get(engine)
+        if compiled is None:
+            with self._lock:
+                compiled = entry['engines'].get(engine)
+                if compiled is None:
+                    started = time.perf_counter()
+                    compiled = FlatTreeEnsemble.compile(
+                        entry['model'], native_min_rows=AUTO_NATIVE_MIN_ROWS if engine == 'auto' else None)
+                    entry['compile_seconds'][engine] = time.perf_counter() - started
+                    entry['engines'][engine] = compiled
+        return compiled
+
+    def _entry(self, name):
+        path = self.path_for(name)
+        mtime = path.stat().st_mtime_ns
+        entry = self._entries.get(name)
+        if entry is not None and (not self.reload_on_change or entry['mtime'] == mtime):
+            return entry
+
+        with self._lock:
+            # Another thread may have loaded it while we waited
+            entry = self._entries.get(name)
+            if entry is None or (self.reload_on_change and entry['mtime'] != mtime):
+                entry = self._load(name, path, mtime)
+                self._entries[name] = entry
+            return entry
+
+    def _load(self, name, path, mtime):
+        rss_before = _resident_bytes()
+        started = time.perf_counter()
+        with span('model_load'):
+            model = joblib.load(path, mmap_mode=self.mmap_mode)
+        load_seconds = time.perf_counter() - started
+        rss_after = _resident_bytes()
+        previous = self._entries.get(name)
+        return {
+            'model': model,
+            'path': path,
+            'mtime': mtime,
+            'loaded_at': time.time(),
+            'load_seconds': load_seconds,
+            'resident_bytes': (rss_after - rss_before
+                               if rss_before is not None and rss_after is not None else None),
+            'file_bytes': path.stat().st_size,
+            'reloads': previous['reloads'] + 1 if previous else 0,
+            'engines': {},
+            'compile_seconds': {},
+        }
+
+    def reload(self, name=DEFAULT_MODEL):
+        """Force a reload from disk regardless of the file timestamp"""
+        with self._lock:
+            self._entries.pop(name, None)
+        return self.get(name, engine='native')
+
+    def stats(self):
+        """Load time and memory footprint for every model loaded so far"""
+        return {
+            name: {
+                'path': str(entry['path']),
+                'loaded_at': entry['loaded_at'],
+                'load_seconds': round(entry['load_seconds'], 4),
+                'resident_bytes': entry['resident_bytes'],
+                'file_bytes': entry['file_bytes'],
+                'reloads': entry['reloads'],
+                'mmap_mode': self.mmap_mode,
+                'engine': self.engines.get(name, 'native'),
+                'compile_seconds': {engine: round(seconds, 4)
+                                    for engine, seconds in entry['compile_seconds'].items()},
+            }
+            for name, entry in self._entries.items()
+        }
+
+
+model_registry = ModelRegistry(
+    mmap_mode=getattr(settings, 'MODEL_MMAP_MODE', None),
+    reload_on_change=getattr(settings, 'MODEL_RELOAD_ON_CHANGE', True),
+    engines=getattr(settings, 'MODEL_ENGINES', {}),
+)
 
-# Assuming you have a trained model saved
-MODEL_PATH = Path(__file__).parent.parent / 'models' / 'random_forest_cropland_model.pkl'
 
 class WheatHealthPredictor:
-    def __init__(self):
+    def __init__(self, model_name=DEFAULT_MODEL, engine=None):
+        self.model_name = model_name
+        self.engine = engine
         self.model = self._load_model()
+        self.last_inference_seconds = None
         
     def _load_model(self):
         try:
-            return joblib.load(MODEL_PATH)
+            if self.model_name == ENSEMBLE:
+                return EnsembleModel([
+                    model_registry.get(name, self.engine)
+                    for name in getattr(settings, 'ENSEMBLE_MODELS', None) or model_registry.available()
+                ])
+            return model_registry.get(self.model_name, self.engine)
         except Exception as e:
-            print(f"Error loading model: {e}")
+            logging.error(f"Error loading model {self.model_name}: {str(e)}")
             return None
     
     def preprocess_features(self, gee_data):
         """
         Convert GEE data to model input format using only the specified bands
         """
-        area_values = gee_data['area_values']
-        
-        # Create feature array in the exact order your model expects
-        features = np.array([
-            area_values.get('B2', 0),   # Blue
-            area_values.get('B3', 0),   # Green
-            area_values.get('B4', 0),   # Red
-            area_values.get('B5', 0),   # Red Edge 1
-            area_values.get('B6', 0),   # Red Edge 2
-            area_values.get('B7', 0),   # Red Edge 3
-            area_values.get('B8', 0),   # NIR
-            area_values.get('B8A', 0),  # Red Edge 4
-            area_values.get('B11', 0),  # SWIR 1
-            area_values.get('B12', 0), # SWIR 2
-            area_values.get('NDVI', 0),  # NDVI
-            area_values.get('GNDVI', 0),   # GNDVI
-            area_values.get('NPCI', 0),   #  NPCI
-            area_values.get('DWSI', 0),   # DWSI
-            area_values.get('RVSI', 0),   # RVSI
-            
-        ]).reshape(1, -1)
-        
+        return self.preprocess_batch([gee_data['area_values']])
+
+    def preprocess_batch(self, area_values_list):
+        """
+        Stack several area_values dicts into one (N, 15) feature matrix
+        in FEATURE_ORDER
+        """
+        with span('feature_assembly'):
+            features = np.empty((len(area_values_list), len(FEATURE_ORDER)), dtype=np.float64)
+            for row, area_values in enumerate(area_values_list):
+                features[row] = [area_values.get(band, 0) for band in FEATURE_ORDER]
         return features
-    
+
     def predict(self, gee_data):
         if not self.model:
             return {"error": "Model not loaded"}
-        
-        features = self.preprocess_features(gee_data)
-        prediction = self.model.predict(features)
-        probabilities = self.model.predict_proba(features)
-        
+
+        return self.predict_batch([gee_data['area_values']])[0]
+
+    def predict_matrix(self, features):
+        """Labels and class probabilities for an (N, 15) matrix from one predict_proba call"""
+        started = time.perf_counter()
+        with span('inference'):
+            probabilities = self.model.predict_proba(features)
+            labels = self.model.classes_[probabilities.argmax(axis=1)]
+        self.last_inference_seconds = time.perf_counter() - started
+        return labels, probabilities
+
+    def inference_info(self):
+        """Which model produced the last predictions and how long it took"""
         return {
-            "prediction": int(prediction[0]),
-            "confidence": float(probabilities[0][prediction[0]]),
-            "probabilities": {
-                "healthy": float(probabilities[0][1]),
-                "unhealthy": float(probabilities[0][0])
-            },
-            "band_values": gee_data['area_values']
-        }
\ No newline at end of file
+            "model": self.model_name,
+            "inference_ms": round(self.last_inference_seconds * 1000, 3)
+            if self.last_inference_seconds is not None else None,
+        }
+
+    def predict_batch(self, area_values_list):
+        """
+        Score many fields with a single predict_proba call; labels are taken
+        from the probabilities so the forest is only traversed once
+        """
+        if not self.model:
+            return [{"error": "Model not loaded"} for _ in area_values_list]
+        if not area_values_list:
+            return []
+
+        features = self.preprocess_batch(area_values_list)
+        labels, probabilities = self.predict_matrix(features)
+        best = probabilities.argmax(axis=1)
+
+        return [
+            {
+                "prediction": int(labels[row]),
+                "confidence": float(probabilities[row][best[row]]),
+                "probabilities": {
+                    "healthy": float(probabilities[row][1]),
+                    "unhealthy": float(probabilities[row][0])
+                },
+                "model": self.model_name
+            }
+            for row in range(len(area_values_list))
+        ]
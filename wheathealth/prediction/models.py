@@ -1,3 +1,140 @@
 from django.db import models
 
 # Create your models here.
+
+
+class ExtractionCacheEntry(models.Model):
+    """Earth Engine extraction result stored by the extraction cache"""
+    key = models.CharField(max_length=64, unique=True)
+    value = models.JSONField()
+    expires_at = models.DateTimeField(null=True, blank=True)
+    last_used_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.key
+
+
+class AnalysisJob(models.Model):
+    """A /predict/ or /api/indices/ request run by a job worker"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    ACTIVE = (PENDING, RUNNING)
+
+    kind = models.CharField(max_length=20)
+    params = models.JSONField()
+    # Hash of kind and params, shared by identical jobs
+    key = models.CharField(max_length=64, db_index=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    # A requeued throttled job is not claimed again before this time
+    not_before = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # At most one queued or running job per key
+            models.UniqueConstraint(fields=['key'], condition=models.Q(status__in=['pending', 'running']),
+                                    name='unique_active_analysis_job'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk} ({self.status})'
+
+
+class Field(models.Model):
+    """A registered field whose season profile is precomputed"""
+    name = models.CharField(max_length=100, unique=True)
+    crop = models.CharField(max_length=50, default='wheat')
+    # GeoJSON Polygon or MultiPolygon
+    geometry = models.JSONField()
+    sowing_date = models.DateField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class FieldWindow(models.Model):
+    """Stored indices and health prediction of one time-series window of a field"""
+    field = models.ForeignKey(Field, on_delete=models.CASCADE, related_name='windows')
+    start_date = models.DateField()
+    end_date = models.DateField()
+    ndvi = models.FloatField(null=True, blank=True)
+    gndvi = models.FloatField(null=True, blank=True)
+    dwsi = models.FloatField(null=True, blank=True)
+    rsv1 = models.FloatField(null=True, blank=True)
+    data_available = models.BooleanField(default=False)
+    image_count = models.PositiveIntegerField(default=0)
+    cloud_threshold = models.IntegerField(null=True, blank=True)
+    model = models.CharField(max_length=50, blank=True)
+    prediction = models.IntegerField(null=True, blank=True)
+    confidence = models.FloatField(null=True, blank=True)
+    healthy_probability = models.FloatField(null=True, blank=True)
+    # The 15 model features (area_values) the prediction was made from
+    features = models.JSONField(null=True, blank=True)
+    # Source collection when computed: newest system:time_start (ms) and size
+    latest_image_time = models.BigIntegerField(null=True, blank=True)
+    source_image_count = models.PositiveIntegerField(null=True, blank=True)
+    computed_at = models.DateTimeField()
+    # Last time the source collection was found unchanged
+    checked_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['field', 'start_date']
+        constraints = [
+            models.UniqueConstraint(fields=['field', 'start_date'], name='unique_field_window'),
+        ]
+
+    def __str__(self):
+        return f'{self.field} {self.start_date}'
+
+
+class TimeSeriesWindow(models.Model):
+    """Stored /api/indices/ result of one window of one geometry"""
+    # sha256 of the canonical geometry
+    geometry_key = models.CharField(max_length=64)
+    start_date = models.DateField()
+    end_date = models.DateField()
+    value = models.JSONField()
+    # Source collection when fetched: newest system:time_start (ms) and size
+    latest_image_time = models.BigIntegerField(null=True, blank=True)
+    source_image_count = models.PositiveIntegerField(null=True, blank=True)
+    computed_at = models.DateTimeField()
+    # Last time the source collection was found unchanged
+    checked_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['geometry_key', 'start_date', 'end_date'],
+                                    name='unique_time_series_window'),
+        ]
+
+    def __str__(self):
+        return f'{self.geometry_key[:8]} {self.start_date}'
+
+
+class QuotaBucket(models.Model):
+    """Token bucket of Earth Engine requests shared by every worker (see admission_service)"""
+    name = models.CharField(max_length=50, unique=True)
+    tokens = models.FloatField()
+    # Unix time the tokens were last refilled
+    updated_at = models.FloatField()
+    # Bumped by every write, so concurrent takes cannot both spend the same tokens
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name} ({self.tokens:.1f})'
@@ -0,0 +1,88 @@
+import base64
+import numpy as np
+from .backends import get_backend
+from .geometry import pixel_area_m2
+from .model_service import WheatHealthPredictor
+
+# Pixels per side of each extraction tile, and rows per model call
+DEFAULT_TILE_SIZE = 256
+DEFAULT_CHUNK_SIZE = 65536
+
+HEALTHY = 1
+
+
+def _pack(mask):
+    """Bit-pack a boolean raster (row-major) and base64 it"""
+    return base64.b64encode(np.packbits(mask, axis=None)).decode('ascii')
+
+
+def health_map(geometry, start_date, end_date, backend=None, predictor=None,
+               tile_size=DEFAULT_TILE_SIZE, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Classify every 10 m pixel of the geometry instead of only its centroid.
+    Band/index stacks are pulled one tile at a time and scored chunk_size
+    rows at a time. Each tile's healthy and valid masks are bit-packed as
+    soon as it is scored and only per-class counts are kept, so working
+    memory depends on tile_size and chunk_size, not on the field. Returns
+    the packed tiles, per-class area statistics and the total model time.
+    """
+    backend = backend or get_backend()
+    predictor = predictor or WheatHealthPredictor()
+    if not predictor.model:
+        return {"error": "Model not loaded"}
+
+    transform, height, width = backend.pixel_grid(geometry)
+    tiles = []
+    healthy_pixels = valid_pixels = 0
+    inference_seconds = 0.0
+
+    for row0, col0, features, mask in backend.pixel_tiles(geometry, start_date, end_date, tile_size):
+        # Masked or missing pixels come back as NaN locally and as zeros from computePixels
+        usable = mask & np.isfinite(features).all(axis=0) & (features[:10] != 0).any(axis=0)
+        pixels = features[:, usable].T
+
+        labels = np.empty(len(pixels), dtype=bool)
+        for start in range(0, len(pixels), chunk_size):
+            chunk_labels, _ = predictor.predict_matrix(pixels[start:start + chunk_size])
+            labels[start:start + chunk_size] = chunk_labels == HEALTHY
+            inference_seconds += predictor.last_inference_seconds or 0.0
+
+        healthy = np.zeros(mask.shape, dtype=bool)
+        healthy[usable] = labels
+        healthy_pixels += int(labels.sum())
+        valid_pixels += int(usable.sum())
+        tiles.append({
+            "row": row0,
+            "col": col0,
+            "height": mask.shape[0],
+            "width": mask.shape[1],
+            "healthy": _pack(healthy),
+            "valid": _pack(usable),
+        })
+
+    area = pixel_area_m2(transform)
+    unhealthy_pixels = valid_pixels - healthy_pixels
+
+    return {
+        "width": width,
+        "height": height,
+        "transform": list(transform),
+        "pixel_area_m2": round(area, 2),
+        # Each tile is a row-major height x width window at (row, col)
+        "encoding": "packbits-base64",
+        "tiles": tiles,
+        "inference_ms": round(inference_seconds * 1000, 3),
+        "stats": {
+            "valid_pixels": valid_pixels,
+            "healthy": {
+                "pixels": healthy_pixels,
+                "area_ha": round(healthy_pixels * area / 10000, 4),
+                "fraction": round(healthy_pixels / valid_pixels, 4) if valid_pixels else None,
+            },
+            "unhealthy": {
+                "pixels": unhealthy_pixels,
+                "area_ha": round(unhealthy_pixels * area / 10000, 4),
+                "fraction": round(unhealthy_pixels / valid_pixels, 4) if valid_pixels else None,
+            },
+        },
+    }
@@ -0,0 +1,74 @@
+import hashlib
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from .gee_service import BAND_INFO
+from .metrics_service import span
+from .model_service import FEATURE_ORDER
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the json module always works
+    orjson = None
+
+# Static band metadata, served once by /api/bands/ instead of with every result
+BANDS_PAYLOAD = {'bands': BAND_INFO, 'feature_order': FEATURE_ORDER}
+BANDS_ETAG = '"' + hashlib.sha256(
+    json.dumps(BANDS_PAYLOAD, sort_keys=True).encode()).hexdigest()[:32] + '"'
+
+
+def _default(value):
+    return DjangoJSONEncoder().default(value)
+
+
+def dumps(data):
+    """
+    JSON bytes of data, with orjson when it is installed. NumPy scalars and
+    arrays are accepted; orjson writes NaN as null where json writes NaN.
+    """
+    with span('serialize'):
+        if orjson is not None:
+            return orjson.dumps(data, default=_default,
+                                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+        return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+
+class FastJsonResponse(HttpResponse):
+    """JsonResponse serialized with dumps()"""
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError("In order to allow non-dict objects to be serialized set the safe parameter to False.")
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data), **kwargs)
+
+
+def parse_fields(value):
+    """Field paths from a list or a comma-separated string; None selects everything"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    return [field.strip() for field in value if field.strip()] or None
+
+
+def select_fields(data, fields, keep=('status',)):
+    """
+    The parts of a dict named by dotted paths, e.g. ['prediction.confidence',
+    'geometry']; the keep keys are always included. Unknown paths are skipped.
+    """
+    if fields is None:
+        return data
+    selected = {key: data[key] for key in keep if key in data}
+    for path in fields:
+        *parents, leaf = path.split('.')
+        source = data
+        for key in parents:
+            source = source.get(key) if isinstance(source, dict) else None
+        if not isinstance(source, dict) or leaf not in source:
+            continue
+        target = selected
+        for key in parents:
+            target = target.setdefault(key, {})
+        target[leaf] = source[leaf]
+    return selected
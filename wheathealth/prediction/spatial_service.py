@@ -0,0 +1,79 @@
+import logging
+import threading
+from django.conf import settings
+from django.db.models import Count, Max
+from .cache_service import canonical_geometry
+from .geometry import SpatialIndex, geometry_hash
+
+
+class GeometryResolver:
+    """
+    Matches request geometries against known ones: the registered fields
+    and the geometries analysed before by this worker. A polygon
+    overlapping a known one by at least GEOMETRY_MIN_OVERLAP (intersection
+    over union) shares that geometry's extraction cache entries, but is
+    always analysed itself. Fields are reloaded when fields are added or
+    removed.
+    """
+
+    def __init__(self, min_overlap=None, max_entries=10000):
+        self._min_overlap = min_overlap
+        self.index = SpatialIndex(max_entries=max_entries)
+        # (count, highest pk) of the Field table when it was last loaded
+        self._fields_version = None
+        self._field_keys = set()
+        self._lock = threading.Lock()
+
+    @property
+    def min_overlap(self):
+        if self._min_overlap is not None:
+            return self._min_overlap
+        return getattr(settings, 'GEOMETRY_MIN_OVERLAP', 0.95)
+
+    def _load_fields(self):
+        from .models import Field
+
+        version = Field.objects.aggregate(count=Count('pk'), latest=Max('pk'))
+        version = (version['count'], version['latest'])
+        with self._lock:
+            if version == self._fields_version:
+                return
+            for key in self._field_keys:
+                self.index.remove(key)
+            self._field_keys = {self.add(geometry, field=name)
+                                for name, geometry in Field.objects.values_list('name', 'geometry')}
+            self._fields_version = version
+
+    def add(self, geometry, field=None):
+        canonical = canonical_geometry(geometry)
+        key = geometry_hash(canonical)
+        self.index.insert(key, canonical, field, pinned=field is not None)
+        return key
+
+    def resolve(self, geometry):
+        """
+        (geometry, cache_geometry, info) for a request geometry: its
+        canonical form, which is what gets analysed; the geometry whose
+        extraction cache entries it may use; and info naming its hash and
+        the known geometry or field it was matched to
+        """
+        canonical = canonical_geometry(geometry)
+        key = geometry_hash(canonical)
+        if canonical.get('type') not in ('Polygon', 'MultiPolygon'):
+            return canonical, canonical, {"hash": key, "matched": None}
+
+        try:
+            self._load_fields()
+        except Exception as e:
+            # Without the field table, resolve against past requests only
+            logging.error(f"Loading registered fields failed: {str(e)}")
+        match = self.index.best_match(canonical, self.min_overlap)
+        if match is None:
+            self.index.insert(key, canonical)
+            return canonical, canonical, {"hash": key, "matched": None}
+
+        known_key, known, field, ratio = match
+        return canonical, known, {"hash": key, "matched": field or known_key, "overlap": round(ratio, 4)}
+
+
+geometry_resolver = GeometryResolver()
@@ -1,3 +1,705 @@
-from django.test import TestCase
+import base64
+import gzip
+import io
+import json
+import os
+from datetime import date, timedelta
+import shutil
+import tempfile
+import warnings
+import zlib
+from unittest import mock
+import numpy as np
+from django.core.management import call_command
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from . import backends, job_service
+from .async_service import run_blocking
+from .admission_service import QuotaExceeded, _current_priority, admission, admission_control
+from .benchmarks import compare
+from .columnar_service import SeriesStore, SeriesTable
+from .cache_service import INGESTION_LAG_DAYS, canonical_geometry, DatabaseStore, DjangoCacheStore, ExtractionCache
+from .field_service import time_series_windows
+from .gee_service import GEEDataExtractor, WindowExecutor
+from .geometry import SpatialIndex, bounds, box_polygon, chunk_geometries, geometry_hash
+from .local_backend import LocalRasterBackend, Scene, _median, write_synthetic_scenes
+from .middleware import CompressionMiddleware, accepted_encodings
+from .model_service import ENSEMBLE, EnsembleModel, FlatTreeEnsemble, ModelRegistry, WheatHealthPredictor, model_registry
+from .models import AnalysisJob, Field, FieldWindow
+from .raster_service import health_map
+from .timeseries_service import incremental_time_series
+from .response_service import parse_fields, select_fields
+from .spatial_service import GeometryResolver
+from .views import FIELD_GEOMETRY
 
 # Create your tests here.
+
+
+class FlatTreeEnsembleParityTests(SimpleTestCase):
+    """The flat inference engine must reproduce the shipped pickles"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        registry = ModelRegistry()
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            cls.models = {name: registry.get(name, 'native') for name in registry.available()}
+
+        rng = np.random.default_rng(0)
+        cls.features = rng.normal(0.3, 0.4, (3000, 15))
+        cls.features[rng.random(cls.features.shape) < 0.01] = np.nan
+
+    def test_random_forest_probabilities_identical(self):
+        model = self.models['random_forest']
+        compiled = FlatTreeEnsemble.compile(model)
+        for rows in (1, 7, len(self.features)):
+            np.testing.assert_array_equal(
+                compiled.predict_proba(self.features[:rows]), model.predict_proba(self.features[:rows]))
+        np.testing.assert_array_equal(compiled.predict(self.features), model.predict(self.features))
+
+    def test_xgboost_margins_identical(self):
+        model = self.models['xgboost']
+        compiled = FlatTreeEnsemble.compile(model)
+        margin = np.full(len(self.features), compiled.base_margin, dtype=np.float32)
+        for tree_leaves in compiled.apply(self.features):
+            margin += compiled.leaf_values[tree_leaves]
+        np.testing.assert_array_equal(margin, model.predict(self.features, output_margin=True))
+
+    def test_xgboost_probabilities_identical(self):
+        model = self.models['xgboost']
+        compiled = FlatTreeEnsemble.compile(model)
+        for rows in (1, 7, len(self.features)):
+            np.testing.assert_array_equal(
+                compiled.predict_proba(self.features[:rows]), model.predict_proba(self.features[:rows]))
+        np.testing.assert_array_equal(compiled.predict(self.features), model.predict(self.features))
+
+    def test_auto_engine_defers_large_batches_to_native_model(self):
+        model = self.models['xgboost']
+        compiled = FlatTreeEnsemble.compile(model, native_min_rows=100)
+        np.testing.assert_array_equal(
+            compiled.predict_proba(self.features[:500]), model.predict_proba(self.features[:500]))
+
+
+class WindowExecutorTests(SimpleTestCase):
+    def test_pools_shared_per_size(self):
+        self.assertIs(WindowExecutor(max_workers=3).shared_pool(3), WindowExecutor(max_workers=3).shared_pool(3))
+        # A size asked for after another pool exists is not ignored
+        self.assertEqual(WindowExecutor.shared_pool(5)._max_workers, 5)
+        small = WindowExecutor(max_workers=2)
+        self.assertEqual(small.shared_pool(small.max_workers)._max_workers, 2)
+        results, timings = small.map(lambda begin, end: (begin, end), [('a', 'b'), ('c', 'd')])
+        self.assertEqual(results, [('a', 'b'), ('c', 'd')])
+        self.assertEqual([timing['date'] for timing in timings], ['a', 'c'])
+
+
+class SeriesStoreTests(SimpleTestCase):
+    @staticmethod
+    def rows(field_id, count):
+        rng = np.random.default_rng(field_id)
+        return [(field_id, date(2024, 1, 1) + timedelta(days=7 * week), week % 3 != 0,
+                 {'NDVI': float(rng.random()), 'GNDVI': None, 'DWSI': float(rng.random()),
+                  'RSV1': float(rng.random()), 'feature.B2': float(rng.random())})
+                for week in range(count)]
+
+    def test_round_trip_through_mapped_columns(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = SeriesStore(os.path.join(directory, 'series_store'))
+            self.assertIsNone(store.table())
+            written = SeriesTable.from_rows(self.rows(1, 10), {1: 'north'})
+            written.save(store.path)
+
+            table = store.table()
+            # Views of the mapped .npy files, not copies
+            self.assertIsInstance(table.columns['NDVI'].base, np.memmap)
+            self.assertEqual(set(table.columns), set(written.columns))
+            for name, values in written.columns.items():
+                self.assertEqual(table.columns[name].dtype, np.float32)
+                np.testing.assert_array_equal(table.columns[name], values)
+            np.testing.assert_array_equal(table.valid, written.valid)
+            self.assertEqual(table.dates(), written.dates())
+            self.assertIs(store.table(), table)
+
+            # Rewriting with another field swaps the whole store
+            SeriesTable.from_rows(self.rows(1, 10) + self.rows(2, 4), {1: 'north', 2: 'south'}).save(store.path)
+            table = store.table()
+            self.assertEqual(table.field_names, {1: 'north', 2: 'south'})
+            south = table.select([2])
+            self.assertEqual(len(south), 4)
+            np.testing.assert_array_equal(south.columns['NDVI'],
+                                          SeriesTable.from_rows(self.rows(2, 4)).columns['NDVI'])
+            self.assertEqual(os.listdir(directory), ['series_store'])
+
+
+class ExtractionCacheTests(TestCase):
+    def test_only_settled_windows_with_data_kept_forever(self):
+        cache = ExtractionCache(store=DatabaseStore(), recent_ttl=60)
+        settled = date.today() - timedelta(days=INGESTION_LAG_DAYS + 1)
+        ingesting = date.today() - timedelta(days=1)
+        indices = {'NDVI': 0.5, 'data_available': True}
+        self.assertIsNone(cache.timeout_for(settled.isoformat(), indices))
+        self.assertEqual(cache.timeout_for(ingesting.isoformat(), indices), 60)
+        self.assertEqual(cache.timeout_for(None, indices), 60)
+        # No images yet, or a failed call, may change on the next request
+        self.assertEqual(cache.timeout_for(settled, {'NDVI': None, 'data_available': False}), 60)
+        self.assertEqual(cache.timeout_for(settled, {'area_values': {}, 'image_count': 0}), 60)
+        self.assertEqual(cache.timeout_for(settled, {'error': 'timeout', 'data_available': False}), 60)
+
+    def check_store(self, store):
+        store.set('a', {'value': 1}, None)
+        store.set('b', {'value': 2}, None)
+        # Reading a makes b the least recently used
+        self.assertEqual(store.get('a'), {'value': 1})
+        store.set('c', {'value': 3}, None)
+        self.assertIsNone(store.get('b'))
+        self.assertEqual(store.get('a'), {'value': 1})
+        self.assertEqual(store.get('c'), {'value': 3})
+
+        store.set('expired', {'value': 4}, 0)
+        self.assertIsNone(store.get('expired'))
+
+    def test_database_store_evicts_least_recently_used(self):
+        self.check_store(DatabaseStore(max_entries=2))
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'OPTIONS': {'MAX_ENTRIES': 2, 'CULL_FREQUENCY': 2}}})
+    def test_django_cache_store_evicts_least_recently_used(self):
+        self.check_store(DjangoCacheStore('default'))
+
+
+class AnalysisJobQueueTests(TestCase):
+    """Identical submissions share one job; a job is claimed only once"""
+    params = {'lat': 34.07, 'lon': -4.75, 'start_date': '2024-01-01'}
+
+    def test_identical_jobs_deduplicated(self):
+        job, created = job_service.submit('indices', self.params)
+        again, created_again = job_service.submit('indices', dict(self.params, mode='composite'))
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(job.pk, again.pk)
+
+    def test_claim_once(self):
+        job, _ = job_service.submit('indices', self.params)
+        claimed = job_service.claim('worker-a')
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.attempts, 1)
+        self.assertIsNone(job_service.claim('worker-b'))
+
+    @override_settings(JOBS={'MAX_ATTEMPTS': 1})
+    def test_rate_limited_windows_fail_the_job(self):
+        job, _ = job_service.submit('indices', self.params)
+        throttled = [{'date': '2024-01-01', 'error': '429 Too Many Requests', 'data_available': False}]
+        with mock.patch('prediction.views.index_time_series', return_value=throttled):
+            job_service.run(job_service.claim('worker-a'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, AnalysisJob.FAILED)
+        again, created = job_service.submit('indices', self.params)
+        self.assertTrue(created)
+
+    def test_exhausted_budget_requeues_after_retry_after(self):
+        job, _ = job_service.submit('indices', self.params)
+        with mock.patch('prediction.views.index_time_series', side_effect=QuotaExceeded('bulk', 30)):
+            job_service.run(job_service.claim('worker-a'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, AnalysisJob.PENDING)
+        self.assertAlmostEqual((job.not_before - timezone.now()).total_seconds(), 30, delta=5)
+        self.assertIsNone(job_service.claim('worker-b'))
+
+        AnalysisJob.objects.filter(pk=job.pk).update(not_before=timezone.now())
+        with override_settings(JOBS={'MAX_ATTEMPTS': 2}), \
+                mock.patch('prediction.views.index_time_series', side_effect=QuotaExceeded('bulk', 30)):
+            job_service.run(job_service.claim('worker-b'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, AnalysisJob.FAILED)
+        self.assertIn('budget exhausted', job.error)
+
+    def run_indices(self, records):
+        job, _ = job_service.submit('indices', self.params)
+        with mock.patch('prediction.views.index_time_series', return_value=records):
+            job_service.run(job_service.claim('worker-a'))
+        job.refresh_from_db()
+        return job
+
+    def test_failed_windows_fail_the_job(self):
+        failed = [{'date': '2024-01-01', 'error': 'Earth Engine client library not initialized',
+                   'data_available': False},
+                  {'date': '2024-01-08', 'NDVI': None, 'data_available': False},
+                  {'_meta': {'total_points': 2}}]
+        job = self.run_indices(failed)
+        self.assertEqual(job.status, AnalysisJob.FAILED)
+        self.assertIn('1 of 2 windows failed', job.error)
+        self.assertTrue(job_service.submit('indices', self.params)[1])
+
+    def test_windows_without_images_are_a_result(self):
+        cloudy = [{'date': '2024-01-01', 'NDVI': None, 'data_available': False},
+                  {'_meta': {'total_points': 1}}]
+        job = self.run_indices(cloudy)
+        self.assertEqual(job.status, AnalysisJob.DONE)
+        self.assertEqual(job.result, cloudy)
+
+
+class GeometryCanonicalizationTests(SimpleTestCase):
+    """Copies of a field differing only in representation hash the same"""
+    ring = [[-4.7566, 34.0745], [-4.7571, 34.0729], [-4.7544, 34.0726], [-4.7518, 34.0723],
+            [-4.7517, 34.0727], [-4.7536, 34.0735], [-4.7566, 34.0745]]
+
+    def polygon(self, ring):
+        return {'type': 'Polygon', 'coordinates': [ring]}
+
+    def test_representation_invariant(self):
+        key = geometry_hash(self.polygon(self.ring))
+        reversed_ring = self.ring[::-1]
+        rotated = self.ring[2:-1] + self.ring[:3]
+        jittered = [[x + 3e-8, y - 2e-8] for x, y in self.ring]
+        for ring in (reversed_ring, rotated, jittered):
+            self.assertEqual(geometry_hash(self.polygon(ring)), key)
+
+    def test_best_match(self):
+        index = SpatialIndex()
+        index.insert('field', self.polygon(self.ring), 'home')
+        shifted = [[x + 0.001, y] for x, y in self.ring]
+        self.assertEqual(index.best_match(self.polygon(self.ring))[2], 'home')
+        self.assertIsNone(index.best_match(self.polygon(shifted), 0.9))
+
+
+class BenchmarkComparisonTests(SimpleTestCase):
+    def test_only_worse_metrics_beyond_tolerance_reported(self):
+        baseline = {'benchmarks': {'predict_latency': {'xgboost': {'p50_ms': 10.0, 'p95_ms': 12.0}},
+                                   'throughput': {'xgboost': {'native': {'1': {'rows_per_second': 1000.0}}}}}}
+        current = {'benchmarks': {'predict_latency': {'xgboost': {'p50_ms': 14.0, 'p95_ms': 40.0}},
+                                  'throughput': {'xgboost': {'native': {'1': {'rows_per_second': 900.0}}}}}}
+        self.assertEqual(compare(baseline, current, tolerance=0.25),
+                         [('predict_latency.xgboost.p50_ms', 10.0, 14.0)])
+        self.assertEqual(compare(baseline, current, tolerance=0.5), [])
+
+
+class SceneMaskingTests(SimpleTestCase):
+    """Scenes are masked before compositing, as in compositing.Composite"""
+
+    def test_median_matches_nanmedian(self):
+        rng = np.random.default_rng(0)
+        stack = rng.random((7, 20, 20))
+        stack[rng.random(stack.shape) < 0.4] = np.nan
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            np.testing.assert_allclose(_median(stack), np.nanmedian(stack, axis=0))
+
+    def test_cloudy_pixels_left_out(self):
+        def scene(value, qa60=0, scl=4):
+            return Scene({'B4': np.full((1, 2), value, dtype=float), 'QA60': np.array([[qa60, 0]], dtype=float),
+                          'SCL': np.array([[scl, 4]], dtype=float)}, '2024-01-01', 0, (0, 1, 0, -1))
+
+        composite = LocalRasterBackend._composite(
+            [scene(100.0), scene(900.0, qa60=1 << 10), scene(800.0, scl=9)], ['B4'])['B4']
+        np.testing.assert_array_equal(composite, [[100.0, 800.0]])
+
+
+class LocalBackendShapeTests(SimpleTestCase):
+    def test_empty_data_dir_gives_earth_engine_no_data_records(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            backend = LocalRasterBackend(data_dir)
+            indices = backend.indices_with_fallback(FIELD_GEOMETRY, '2024-01-01', '2024-01-08')
+            self.assertEqual(indices, GEEDataExtractor._index_result({}))
+            self.assertEqual(list(indices), list(GEEDataExtractor._index_result({})))
+            self.assertEqual(backend.extract_fields([FIELD_GEOMETRY], '2024-01-01', '2024-01-08'),
+                             [{'area_values': {}, 'image_count': 0, 'cloud_threshold': None}])
+            self.assertEqual(list(backend.pixel_tiles(FIELD_GEOMETRY, '2024-01-01', '2024-01-08')), [])
+
+
+class GeometryChunkingTests(SimpleTestCase):
+    def test_chunks_respect_feature_and_vertex_limits(self):
+        # Boxes have 5 vertices
+        boxes = [box_polygon((i, 0, i + 1, 1)) for i in range(7)]
+        self.assertEqual(chunk_geometries(boxes, 3, 1000), [(0, 3), (3, 6), (6, 7)])
+        self.assertEqual(chunk_geometries(boxes, 100, 12), [(0, 2), (2, 4), (4, 6), (6, 7)])
+        # A parcel above the vertex limit still gets a chunk of its own
+        self.assertEqual(chunk_geometries(boxes[:2], 100, 3), [(0, 1), (1, 2)])
+        self.assertEqual(chunk_geometries([], 3, 10), [])
+
+
+class ResponseFieldSelectionTests(SimpleTestCase):
+    def test_dotted_paths_select_nested_fields(self):
+        data = {'status': 'success', 'prediction': {'prediction': 1, 'confidence': 0.9},
+                'band_data': {'area_values': {'B2': 0.1}}}
+        fields = parse_fields('prediction.confidence, band_data,missing.path')
+        self.assertEqual(select_fields(data, fields), {
+            'status': 'success', 'prediction': {'confidence': 0.9}, 'band_data': {'area_values': {'B2': 0.1}}})
+        self.assertIs(select_fields(data, parse_fields('')), data)
+        self.assertEqual(select_fields(data, ['prediction.prediction.x'], keep=()), {})
+
+
+@override_settings(EE_ADMISSION={'RATE': 0.001, 'BURST': 10.0, 'RESERVES': {'interactive': 0.0, 'bulk': 0.5}})
+class AdmissionControlTests(TestCase):
+    def take(self, priority, count):
+        token = _current_priority.set(priority)
+        try:
+            for taken in range(count):
+                try:
+                    admission.acquire()
+                except QuotaExceeded:
+                    return taken
+            return count
+        finally:
+            _current_priority.reset(token)
+
+    def test_bulk_leaves_the_reserve_to_interactive(self):
+        self.assertEqual(self.take('bulk', 10), 5)
+        self.assertEqual(self.take('interactive', 10), 5)
+        self.assertLess(admission.status()['tokens'], 1)
+
+    def test_exhausted_budget_answers_429(self):
+        view = admission_control('bulk')(lambda request: self.fail("admitted past the reserve"))
+        self.take('interactive', 6)
+        response = view(None)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+
+class CompressionTests(SimpleTestCase):
+    body = {'values': [{'week': week, 'NDVI': week / 100} for week in range(200)]}
+
+    def respond(self, accept_encoding, response):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def encoding(self, accept_encoding):
+        return self.respond(accept_encoding, JsonResponse(self.body)).get('Content-Encoding')
+
+    def test_q_values_weigh_the_codings(self):
+        self.assertEqual(accepted_encodings('gzip;q=0.5, br ; Q=0,identity;q=x'),
+                         {'gzip': 0.5, 'br': 0.0, 'identity': 0.0})
+        self.assertEqual(self.encoding('gzip, deflate'), 'gzip')
+        self.assertEqual(self.encoding('br;q=0, gzip;q=0.3'), 'gzip')
+        self.assertEqual(self.encoding('*;q=0.1'), 'gzip')
+        self.assertIsNone(self.encoding('gzip;q=0'))
+        self.assertIsNone(self.encoding('gzip;q=0, *'))
+        self.assertIsNone(self.encoding('deflate'))
+        with mock.patch('prediction.middleware.brotli', None):
+            self.assertIsNone(self.encoding('br, gzip;q=0'))
+
+    def test_bodies_gzipped_by_django(self):
+        response = self.respond('gzip', JsonResponse(self.body))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content)), self.body)
+        # GZipMiddleware's random file name in the header
+        self.assertTrue(response.content[3] & gzip.FNAME)
+
+        small = self.respond('gzip', JsonResponse({'NDVI': 0.5}))
+        self.assertFalse(small.has_header('Content-Encoding'))
+        page = self.respond('gzip', HttpResponse('<p>' * 2000))
+        self.assertFalse(page.has_header('Content-Encoding'))
+
+    def test_streamed_records_flushed_one_by_one(self):
+        lines = [json.dumps(record).encode() + b'\n' for record in self.body['values'][:3]]
+        response = self.respond('gzip', StreamingHttpResponse(iter(lines), content_type='application/x-ndjson'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = iter(response.streaming_content)
+        for line in lines:
+            self.assertEqual(decompressor.decompress(next(chunks)), line)
+
+
+class LocalBackendTestCase(TestCase):
+    """Runs against synthetic scenes of FIELD_GEOMETRY through the local extraction backend"""
+    # A full set of model features, as a client with its own band values sends them
+    band_values = {'B2': 0.05, 'B3': 0.08, 'B4': 0.06, 'B5': 0.12, 'B6': 0.3, 'B7': 0.35, 'B8': 0.4,
+                   'B8A': 0.42, 'B11': 0.2, 'B12': 0.1, 'NDVI': 0.74, 'GNDVI': 0.67, 'NPCI': 0.09,
+                   'DWSI': 0.35, 'RVSI': 0.23}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.data_dir = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.data_dir)
+        write_synthetic_scenes(cls.data_dir, FIELD_GEOMETRY, '2024-01-01', days=100, size=32)
+        overridden = override_settings(EXTRACTION_BACKEND='local', LOCAL_BACKEND_DATA_DIR=cls.data_dir)
+        overridden.enable()
+        cls.addClassCleanup(overridden.disable)
+        # The backend instance is cached per name, with the data dir it was made with
+        backends._backends.pop('local', None)
+        cls.addClassCleanup(backends._backends.pop, 'local', None)
+
+    @staticmethod
+    def parcels(count):
+        """count side-by-side strips of FIELD_GEOMETRY's bounding box"""
+        west, south, east, north = bounds(FIELD_GEOMETRY)
+        step = (east - west) / count
+        return [box_polygon((west + i * step, south, west + (i + 1) * step, north)) for i in range(count)]
+
+
+class BatchPredictionTests(LocalBackendTestCase):
+    def post(self, features, **extra):
+        return self.client.post('/api/predict/batch/', json.dumps({
+            'type': 'FeatureCollection', 'start_date': '2024-01-01', 'end_date': '2024-03-01',
+            'features': features, **extra}), content_type='application/json').json()
+
+    def test_results_keyed_by_feature_id_with_per_feature_errors(self):
+        features = [{'type': 'Feature', 'id': f'parcel-{i}', 'geometry': geometry, 'properties': {}}
+                    for i, geometry in enumerate(self.parcels(4))]
+        features.append({'type': 'Feature', 'id': 'no-geometry', 'properties': {}})
+        response = self.post(features)
+        self.assertEqual(response['status'], 'success')
+        self.assertEqual(list(response['results']), [feature['id'] for feature in features])
+        self.assertIn('error', response['results']['no-geometry'])
+
+        # One batched call scores each parcel as a call of its own would
+        predictor = WheatHealthPredictor()
+        for feature in features[:-1]:
+            result = response['results'][feature['id']]
+            self.assertIsNotNone(result['band_values']['NDVI'])
+            expected = predictor.predict({'area_values': result['band_values']})
+            self.assertEqual({key: result[key] for key in expected}, expected)
+
+    def test_invalid_band_values_fail_only_their_feature(self):
+        values = self.band_values
+        response = self.post([
+            {'type': 'Feature', 'id': 'good', 'properties': values},
+            {'type': 'Feature', 'id': 'bad', 'properties': dict(values, NDVI='high')},
+        ], fields=['prediction'])
+        expected = WheatHealthPredictor().predict({'area_values': values})
+        self.assertEqual(response['results']['good'], {'prediction': expected['prediction']})
+        self.assertIn('error', response['results']['bad'])
+
+
+class HealthMapTests(LocalBackendTestCase):
+    window = ('2024-01-01', '2024-03-01')
+
+    @staticmethod
+    def unpack(tiles, height, width, key):
+        raster = np.zeros((height, width), dtype=bool)
+        for tile in tiles:
+            bits = np.frombuffer(base64.b64decode(tile[key]), dtype=np.uint8)
+            raster[tile['row']:tile['row'] + tile['height'], tile['col']:tile['col'] + tile['width']] = \
+                np.unpackbits(bits, count=tile['height'] * tile['width']).reshape(tile['height'], tile['width'])
+        return raster
+
+    def test_stats_independent_of_tile_and_chunk_size(self):
+        whole = health_map(FIELD_GEOMETRY, *self.window)
+        tiled = health_map(FIELD_GEOMETRY, *self.window, tile_size=7, chunk_size=10)
+        self.assertEqual(len(whole['tiles']), 1)
+        self.assertGreater(len(tiled['tiles']), 1)
+        self.assertGreater(whole['stats']['valid_pixels'], 0)
+        self.assertEqual(tiled['stats'], whole['stats'])
+        for key in ('healthy', 'valid'):
+            np.testing.assert_array_equal(self.unpack(tiled['tiles'], tiled['height'], tiled['width'], key),
+                                          self.unpack(whole['tiles'], whole['height'], whole['width'], key))
+
+    def test_raster_predictions_report_inference(self):
+        response = self.client.post('/predict/', json.dumps({
+            'geometry': FIELD_GEOMETRY, 'start_date': self.window[0], 'end_date': self.window[1],
+            'mode': 'raster', 'tile_size': 16}), content_type='application/json').json()
+        self.assertEqual(response['status'], 'success')
+        self.assertEqual(response['inference']['model'], 'random_forest')
+        self.assertGreater(response['inference']['inference_ms'], 0)
+        self.assertNotIn('inference_ms', response['health_map'])
+
+
+class ModelSelectionTests(LocalBackendTestCase):
+    def test_ensemble_averages_member_probabilities(self):
+        members = [model_registry.get(name) for name in ('random_forest', 'xgboost')]
+        features = np.random.default_rng(0).normal(0.3, 0.2, (50, 15))
+        expected = (members[0].predict_proba(features) + members[1].predict_proba(features)) / 2
+        np.testing.assert_allclose(EnsembleModel(members).predict_proba(features), expected)
+
+        class Relabelled:
+            classes_ = np.array([0, 2])
+        with self.assertRaises(ValueError):
+            EnsembleModel([members[0], Relabelled()])
+
+    @override_settings(ENSEMBLE_MODELS=['xgboost'])
+    def test_ensemble_members_from_settings(self):
+        ensemble = WheatHealthPredictor(ENSEMBLE).predict({'area_values': self.band_values})
+        single = WheatHealthPredictor('xgboost').predict({'area_values': self.band_values})
+        self.assertEqual(ensemble['probabilities'], single['probabilities'])
+        self.assertEqual(ensemble['model'], ENSEMBLE)
+
+    def test_request_picks_the_model(self):
+        def predict(model):
+            return self.client.post('/predict/', json.dumps({
+                'geometry': FIELD_GEOMETRY, 'start_date': '2024-01-01', 'end_date': '2024-03-01',
+                'model': model}), content_type='application/json')
+
+        for model in ('xgboost', ENSEMBLE):
+            response = predict(model).json()
+            self.assertEqual(response['prediction']['model'], model)
+            self.assertEqual(response['inference']['model'], model)
+        self.assertEqual(predict('no-such-model').status_code, 400)
+
+
+class IndexStreamTests(LocalBackendTestCase):
+    url = '/api/indices/?lat=34.07&lon=-4.75&start_date=2024-01-01'
+
+    def stream(self, query):
+        response = self.client.get(self.url + query)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def check_records(self, records, mode):
+        *windows, meta = records
+        self.assertEqual(meta['_meta']['mode'], mode)
+        self.assertEqual(meta['_meta']['total_points'], len(windows))
+        dates = sorted(record['date'] for record in windows)
+        self.assertEqual(meta['_meta']['date_range'], {'start': dates[0], 'end': dates[-1]})
+        for record in windows:
+            self.assertIn('NDVI', record)
+            self.assertIn(record['source'], ('fresh', 'stored'))
+
+    def test_ndjson_lines(self):
+        for mode in ('per_window', 'composite'):
+            lines = self.stream(f'&format=ndjson&mode={mode}').splitlines()
+            self.check_records([json.loads(line) for line in lines], mode)
+
+    def test_sse_events(self):
+        for mode in ('per_window', 'composite'):
+            events = self.stream(f'&format=sse&mode={mode}').strip().split('\n\n')
+            records = []
+            for event in events:
+                fields = dict(line.split(': ', 1) for line in event.split('\n'))
+                self.assertEqual(fields.get('event'), 'meta' if event is events[-1] else None)
+                records.append(json.loads(fields['data']))
+            self.check_records(records, mode)
+
+    def test_streams_match_the_json_response(self):
+        expected = self.client.get(self.url + '&mode=composite').json()
+        lines = self.stream('&format=ndjson&mode=composite').splitlines()
+        self.assertEqual([json.loads(line) for line in lines][:-1],
+                         [dict(record, source='stored') for record in expected[:-1]])
+
+
+class InstrumentationTests(LocalBackendTestCase):
+    def test_responses_carry_server_timing_and_feed_metrics(self):
+        response = self.client.post('/predict/', json.dumps({
+            'geometry': FIELD_GEOMETRY, 'start_date': '2024-01-01', 'end_date': '2024-03-01'}),
+            content_type='application/json')
+        self.assertEqual(response.json()['status'], 'success')
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+        response = self.client.get('/metrics/')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertNotIn('Server-Timing', response)
+        body = response.content.decode()
+        self.assertIn('# TYPE wheathealth_request_seconds histogram', body)
+        self.assertRegex(body, r'wheathealth_requests_total\{[^}]*view="predict_wheat_health"[^}]*\} \d+')
+
+
+class AsyncViewTests(LocalBackendTestCase):
+    body = {'geometry': FIELD_GEOMETRY, 'start_date': '2024-01-01', 'end_date': '2024-03-01',
+            'fields': 'band_data,prediction'}
+
+    async def test_async_predict_matches_sync(self):
+        expected = (await run_blocking(self.client.post, '/predict/', json.dumps(self.body),
+                                       content_type='application/json')).json()
+        response = await self.async_client.post('/api/async/predict/', json.dumps(self.body),
+                                                content_type='application/json')
+        self.assertEqual(response.json(), expected)
+        self.assertIsNotNone(expected['prediction']['prediction'])
+
+    async def test_async_indices_match_sync(self):
+        query = '?lat=34.07&lon=-4.75&start_date=2024-01-01&mode=per_window'
+        expected = (await run_blocking(self.client.get, '/api/indices/' + query)).json()
+        response = (await self.async_client.get('/api/async/indices/' + query)).json()
+        # Everything but the per-window timings in _meta
+        self.assertEqual(response[:-1], expected[:-1])
+        self.assertEqual(len(response), 23)
+
+
+class FieldProfileTests(LocalBackendTestCase):
+    def setUp(self):
+        overridden = override_settings(SERIES_STORE_PATH=os.path.join(self.data_dir, 'series_store'))
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        self.field = Field.objects.create(name='home', geometry=FIELD_GEOMETRY, sowing_date=date(2024, 1, 1))
+
+    def test_precomputed_profile_served_from_storage(self):
+        call_command('precompute_indices', stdout=io.StringIO())
+        windows = list(FieldWindow.objects.filter(field=self.field))
+        self.assertEqual(len(windows), 22)
+        scored = [window for window in windows if window.prediction is not None]
+        self.assertTrue(scored)
+        self.assertTrue(all(window.data_available for window in scored))
+
+        records = self.client.get('/api/indices/?field=home').json()
+        *records, meta = records
+        self.assertEqual(meta['_meta']['stored_points'], 22)
+        self.assertEqual([record['prediction'] for record in records], [window.prediction for window in windows])
+        self.assertEqual([record['NDVI'] for record in records], [window.ndvi for window in windows])
+
+        series = self.client.get('/api/fields/series/?fields=home&format=columns').json()
+        self.assertEqual(series['rows'], 22)
+        self.assertEqual(series['fields'], {str(self.field.pk): 'home'})
+        np.testing.assert_allclose(np.array(series['columns']['NDVI'], dtype=float),
+                                   [np.nan if window.ndvi is None else window.ndvi for window in windows],
+                                   atol=1e-6)
+
+    def test_unknown_field(self):
+        self.assertEqual(self.client.get('/api/indices/?field=elsewhere').status_code, 404)
+        self.assertEqual(self.client.get('/api/fields/series/?fields=home,elsewhere').status_code, 404)
+
+
+class IncrementalTimeSeriesTests(TestCase):
+    """Stored windows are reused until their source collection changes"""
+
+    def test_only_changed_unsettled_windows_extracted_again(self):
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir)
+        start = date.today() - timedelta(days=40)
+        write_synthetic_scenes(data_dir, FIELD_GEOMETRY, start, days=60)
+        backend = LocalRasterBackend(data_dir)
+        # Windows 0-4 ended INGESTION_LAG_DAYS or more ago; window 5 has not
+        windows = time_series_windows(start)[:6]
+        self.assertLessEqual(date.fromisoformat(windows[4][1]), date.today() - timedelta(days=INGESTION_LAG_DAYS))
+        self.assertGreater(date.fromisoformat(windows[5][1]), date.today() - timedelta(days=INGESTION_LAG_DAYS))
+
+        results, sources = incremental_time_series(FIELD_GEOMETRY, windows, backend)
+        self.assertEqual(sources, ['fresh'] * 6)
+        again, sources = incremental_time_series(FIELD_GEOMETRY, windows, backend)
+        self.assertEqual(sources, ['stored'] * 6)
+        self.assertEqual(again, results)
+
+        # A late scene in a settled window is not looked for; one in window 5 is
+        for day in (1, 36):
+            write_synthetic_scenes(data_dir, FIELD_GEOMETRY, start + timedelta(days=day), days=1, seed=day)
+        backend._scenes = None
+        updated, sources = incremental_time_series(FIELD_GEOMETRY, windows, backend)
+        self.assertEqual(sources, ['stored'] * 5 + ['fresh'])
+        self.assertEqual(updated[5]['source_image_count'], results[5]['source_image_count'] + 1)
+
+
+class GeometryResolverTests(LocalBackendTestCase):
+    def shifted(self, fraction):
+        """FIELD_GEOMETRY moved east by a fraction of its width"""
+        west, south, east, north = bounds(FIELD_GEOMETRY)
+        return {'type': 'Polygon', 'coordinates': [[[x + (east - west) * fraction, y]
+                                                    for x, y in FIELD_GEOMETRY['coordinates'][0]]]}
+
+    def test_match_lends_its_cache_entry_only(self):
+        resolver = GeometryResolver(min_overlap=0.9)
+        first, cache_geometry, info = resolver.resolve(FIELD_GEOMETRY)
+        self.assertIs(cache_geometry, first)
+        self.assertIsNone(info['matched'])
+
+        geometry, cache_geometry, copy_info = resolver.resolve(self.shifted(0.01))
+        self.assertEqual(geometry, canonical_geometry(self.shifted(0.01)))
+        self.assertEqual(cache_geometry, first)
+        self.assertEqual(copy_info['matched'], info['hash'])
+        self.assertNotEqual(copy_info['hash'], info['hash'])
+
+    def test_fields_registered_later_are_matched(self):
+        resolver = GeometryResolver(min_overlap=0.9)
+        resolver.resolve(box_polygon((0, 0, 0.01, 0.01)))
+        Field.objects.create(name='home', geometry=FIELD_GEOMETRY, sowing_date=date(2024, 1, 1))
+        self.assertEqual(resolver.resolve(self.shifted(0.01))[2]['matched'], 'home')
+        Field.objects.all().delete()
+        self.assertNotEqual(resolver.resolve(self.shifted(0.02))[2]['matched'], 'home')
+
+    def test_raster_analyses_the_requested_polygon(self):
+        self.client.post('/predict/', json.dumps({'geometry': FIELD_GEOMETRY, 'start_date': '2024-01-01',
+                                                  'end_date': '2024-03-01'}), content_type='application/json')
+        with mock.patch('prediction.views.health_map', return_value={}) as health_map_call:
+            response = self.client.post('/predict/', json.dumps({
+                'geometry': self.shifted(0.01), 'start_date': '2024-01-01', 'end_date': '2024-03-01',
+                'mode': 'raster'}), content_type='application/json').json()
+        self.assertEqual(health_map_call.call_args[0][0], canonical_geometry(self.shifted(0.01)))
+        self.assertIsNotNone(response['geometry']['matched'])
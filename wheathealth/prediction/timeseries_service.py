@@ -0,0 +1,78 @@
+import logging
+from datetime import date, timedelta
+from django.db import transaction
+from django.utils import timezone
+from .backends import get_backend
+from .cache_service import INGESTION_LAG_DAYS, geometry_key
+from .models import TimeSeriesWindow
+
+
+def fingerprint(row):
+    """The source-collection fingerprint a stored window was computed from"""
+    return {'latest_image_time': row.latest_image_time, 'source_image_count': row.source_image_count}
+
+
+def is_settled(row):
+    """Windows found unchanged INGESTION_LAG_DAYS after they ended are not checked again"""
+    last_seen = row.checked_at or row.computed_at
+    return last_seen.date() >= row.end_date + timedelta(days=INGESTION_LAG_DAYS)
+
+
+def changed_windows(backend, geometry, windows, stored):
+    """
+    Split windows into those to extract again and the stored ones whose
+    source collection is unchanged: (stale, unchanged). stored maps
+    (start_date, end_date) to a row with a fingerprint. All unsettled
+    stored windows are checked with one window_fingerprints call.
+    """
+    to_check = [window for window in windows if window in stored and not is_settled(stored[window])]
+    fingerprints = backend.window_fingerprints(geometry, to_check) if to_check else []
+    unchanged = [window for window, current in zip(to_check, fingerprints)
+                 if current == fingerprint(stored[window])]
+    keep = set(unchanged) | {window for window in windows
+                             if window in stored and is_settled(stored[window])}
+    return [window for window in windows if window not in keep], unchanged
+
+
+def incremental_time_series(geometry, windows, backend=None):
+    """
+    extract_index_time_series backed by the TimeSeriesWindow table: stored
+    windows are served while their source collection is unchanged and
+    only the others are extracted, in one call. Returns (results,
+    sources), source being 'stored' or 'fresh' for each window.
+    """
+    backend = backend or get_backend()
+    key = geometry_key(geometry)
+    windows = [tuple(window) for window in windows]
+    stored = {(row.start_date.isoformat(), row.end_date.isoformat()): row
+              for row in TimeSeriesWindow.objects.filter(geometry_key=key)}
+
+    stale, unchanged = changed_windows(backend, geometry, windows, stored)
+    fresh = {}
+    if stale:
+        fresh = dict(zip(stale, backend.extract_index_time_series(geometry, stale, use_cache=False)))
+
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            TimeSeriesWindow.objects.bulk_create([
+                TimeSeriesWindow(
+                    geometry_key=key,
+                    start_date=date.fromisoformat(start_date),
+                    end_date=date.fromisoformat(end_date),
+                    value=result,
+                    latest_image_time=result.get('latest_image_time'),
+                    source_image_count=result.get('source_image_count'),
+                    computed_at=now,
+                    checked_at=now,
+                ) for (start_date, end_date), result in fresh.items()
+            ], update_conflicts=True, unique_fields=['geometry_key', 'start_date', 'end_date'],
+                update_fields=['value', 'latest_image_time', 'source_image_count', 'computed_at', 'checked_at'])
+            TimeSeriesWindow.objects.filter(pk__in=[stored[window].pk for window in unchanged]).update(
+                checked_at=now)
+    except Exception as e:
+        # The results are still good; they are just fetched again next time
+        logging.error(f"Storing time-series windows failed: {str(e)}")
+
+    results = [fresh[window] if window in fresh else stored[window].value for window in windows]
+    return results, ['fresh' if window in fresh else 'stored' for window in windows]
@@ -1,237 +1,629 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import etag, require_GET
+import asyncio
 import json
-from .gee_service import GEEDataExtractor
-from .model_service import WheatHealthPredictor
+import logging
+from collections import defaultdict
+from datetime import datetime
+from django.db.models import Max
+from .admission_service import QuotaExceeded, admission, admission_control
+from .async_service import run_blocking
+from .gee_service import WindowExecutor, ee_session, field_reducer
+from .backends import get_backend
+from .cache_service import extraction_cache
+from .model_service import WheatHealthPredictor, model_registry, FEATURE_ORDER, DEFAULT_MODEL
+from .raster_service import health_map, DEFAULT_TILE_SIZE, DEFAULT_CHUNK_SIZE
+from .models import AnalysisJob, Field, FieldWindow
+from .columnar_service import SeriesTable, series_store
+from . import job_service
+from .field_service import INDEX_COLUMNS, field_series, time_series_windows
+from .timeseries_service import incremental_time_series
+from .spatial_service import geometry_resolver
+from .metrics_service import count_view_error, metrics
+from .response_service import BANDS_ETAG, BANDS_PAYLOAD, FastJsonResponse, dumps, parse_fields, select_fields
+
+def prediction_payload(data):
+    """
+    The /predict/ success response for a request body, also run by job
+    workers. "fields" (list or comma-separated dotted paths) keeps only
+    those parts, e.g. "prediction" or "prediction.confidence,geometry".
+    """
+    model_name = data.get('model', DEFAULT_MODEL)
+    # The request's own geometry is analysed; a near-identical known field
+    # only shares its extraction cache entry, reported under "geometry"
+    geometry, cache_geometry, geometry_info = geometry_resolver.resolve(data.get('geometry'))
+    start_date = data.get('start_date')
+    end_date = data.get('end_date')
+
+    if data.get('mode') == 'raster':
+        # Score every pixel of the field instead of its centroid
+        predictor = WheatHealthPredictor(model_name)
+        raster = health_map(
+            geometry, start_date, end_date,
+            predictor=predictor,
+            tile_size=int(data.get('tile_size', DEFAULT_TILE_SIZE)),
+            chunk_size=int(data.get('chunk_size', DEFAULT_CHUNK_SIZE)))
+        return select_fields({
+            "health_map": raster,
+            # Model time summed over every chunk, not just the last one
+            "inference": {**predictor.inference_info(), "inference_ms": raster.pop('inference_ms', None)},
+            "geometry": geometry_info,
+            "status": "success"
+        }, parse_fields(data.get('fields')))
+
+    # Get only band data (no indices)
+    gee_data = get_backend().extract_bands_and_indices(
+        geometry, start_date, end_date, cache_geometry=cache_geometry)
+
+    # Make prediction
+    predictor = WheatHealthPredictor(model_name)
+    prediction = predictor.predict(gee_data)
+
+    # The band metadata is served by /api/bands/ (extraction cache entries
+    # may still carry it)
+    return select_fields({
+        "band_data": {key: value for key, value in gee_data.items() if key != 'band_info'},
+        "prediction": prediction,
+        "inference": predictor.inference_info(),
+        "geometry": geometry_info,
+        "status": "success"
+    }, parse_fields(data.get('fields')))
 
 def wheat_health_map(request):
     """GET method to display the map interface"""
     return render(request, 'prediction/dashboard.html')
 
 @csrf_exempt
+@admission_control('interactive')
 def predict_wheat_health(request):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
-            geometry = data.get('geometry')
-            start_date = data.get('start_date')
-            end_date = data.get('end_date')
-            
-            # Get only band data (no indices)
-            gee_data = GEEDataExtractor.extract_bands_and_indices(
-                geometry, start_date, end_date)
-            
-            # Make prediction
-            predictor = WheatHealthPredictor()
-            prediction = predictor.predict(gee_data)
-            
-            response = {
-                "band_data": gee_data,
-                "prediction": prediction,
-                "status": "success"
-            }
-            return JsonResponse(response)
-            
+            model_name = data.get('model', DEFAULT_MODEL)
+            if model_name not in model_registry.selectable():
+                return JsonResponse({"status": "error", "message": f"Unknown model '{model_name}'"}, status=400)
+
+            return FastJsonResponse(prediction_payload(data))
+
+        except QuotaExceeded:
+            # Answered with 429 by admission_control
+            raise
         except Exception as e:
+            logging.error(f"Error in predict_wheat_health: {str(e)}")
+            count_view_error('predict')
             return JsonResponse({"status": "error", "message": str(e)})
     
     return JsonResponse({"status": "error", "message": "Only POST requests allowed"})
-import json
-from datetime import datetime, timedelta
 
-from django.shortcuts import render
-from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
-import json
-import ee
-from datetime import datetime, timedelta
+@csrf_exempt
+@admission_control('interactive')
+async def predict_wheat_health_async(request):
+    """
+    predict_wheat_health for ASGI deployments: the extraction and the model
+    call run on the bounded blocking pool instead of the event loop
+    """
+    if request.method != 'POST':
+        return JsonResponse({"status": "error", "message": "Only POST requests allowed"})
 
-def point_analysis_page(request):
-    """GET endpoint to display the analysis page"""
-    return render(request, 'prediction/point_analysis.html')
+    try:
+        data = json.loads(request.body)
+        model_name = data.get('model', DEFAULT_MODEL)
+        if model_name not in model_registry.selectable():
+            return JsonResponse({"status": "error", "message": f"Unknown model '{model_name}'"}, status=400)
 
-import ee
-import logging
-from datetime import datetime, timedelta
-from django.http import JsonResponse
-from django.views.decorators.http import require_GET
+        return FastJsonResponse(await run_blocking(prediction_payload, data))
 
-# Initialize Earth Engine
-try:
-    ee.Initialize()
-except ee.EEException as e:
-    logging.error(f"Failed to initialize Earth Engine: {str(e)}")
+    except QuotaExceeded:
+        raise
+    except Exception as e:
+        logging.error(f"Error in predict_wheat_health_async: {str(e)}")
+        count_view_error('async_predict')
+        return JsonResponse({"status": "error", "message": str(e)})
 
-def get_indices_with_fallback(lat, lon, start_date, end_date):
+@csrf_exempt
+@admission_control('bulk')
+def predict_batch_view(request):
     """
-    Safely gets vegetation indices with proper serialization
-    """
-    point = ee.Geometry.Polygon([[
-        [-4.756572600555413, 34.07453831656702],
-        [-4.756926653333988, 34.074120635290505],
-        [-4.757060763342107, 34.073920681323614],
-        [-4.757044669342034, 34.073685179882744],
-        [-4.757087584686272, 34.073187512848925],
-        [-4.757087584686272, 34.07292090430669],
-        [-4.756443854522698, 34.07284980855373],
-        [-4.754115688976768, 34.07253656361696],
-        [-4.751787539672844, 34.07225882279766],
-        [-4.7517231665838855, 34.07273427588901],
-        [-4.7518089973449635, 34.07340524253599],
-        [-4.753579255294793, 34.07354743304995],
-        [-4.754222985458367, 34.07372517085677],
-        [-4.756572600555413, 34.07453831656702]
-    ]])
+    Score every feature of a GeoJSON FeatureCollection with one model call.
+    Features whose properties already carry all 15 band/index values are
+    scored as-is, the others are extracted first: one extract_fields call
+    per date range, reducing each parcel with `reducer` (default 'first').
+    Extracted features are not cached and come from one composite per date
+    range, so they can differ from /predict/ on the same parcel. A feature
+    with neither a geometry nor valid band values gets an error of its own.
+    """
+    if request.method != 'POST':
+        return JsonResponse({"status": "error", "message": "Only POST requests allowed"})
 
     try:
-        # First try with cloud filter
-        collection = (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
-            .filterBounds(point)
-            .filterDate(start_date, end_date)
-            .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 10))
-        )
-
-        # Check if collection is empty
-        if collection.size().getInfo() == 0:
-            # Fallback to collection with higher cloud cover
-            collection = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED').filterBounds(point).filterDate(start_date, end_date).filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 30))  # Increased cloud threshold
-
-            if collection.size().getInfo() == 0:
-                # Final fallback - no cloud filter
-                collection = (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
-                    .filterBounds(point)
-                    .filterDate(start_date, end_date)
-                )
-
-                if collection.size().getInfo() == 0:
-                    return {
-                        'NDVI': None,
-                        'GNDVI': None,
-                        'DWSI': None,
-                        'RSV1': None,
-                        'data_available': False
-                    }
-
-        # Calculate median image
-        median_img = collection.median()
-
-        # Cloud masking using the QA60 band (bit 10)
-        qa60 = median_img.select(['QA60']).toInt()
-        cloud_mask = qa60.bitwiseAnd(1 << 10).eq(0)  # Mask out clouds (if QA60 bit is 0)
-
-        # Apply cloud mask to the median image
-        cloud_free_img = median_img.updateMask(cloud_mask)
-
-        # --- helper function ---
-        def calculate_index(img, method, *args):
+        data = json.loads(request.body)
+        if data.get('type') != 'FeatureCollection':
+            return JsonResponse({"status": "error", "message": "Expected a GeoJSON FeatureCollection"}, status=400)
+        model_name = data.get('model', DEFAULT_MODEL)
+        if model_name not in model_registry.selectable():
+            return JsonResponse({"status": "error", "message": f"Unknown model '{model_name}'"}, status=400)
+        reducer = data.get('reducer', 'first')
+        try:
+            field_reducer(reducer)
+        except ValueError as e:
+            return JsonResponse({"status": "error", "message": str(e)}, status=400)
+
+        feature_ids = []
+        rows = []
+        # row -> why that feature cannot be scored
+        errors = {}
+        # (start_date, end_date) -> [(row, geometry)] of the features to extract
+        to_extract = defaultdict(list)
+        for index, feature in enumerate(data.get('features') or []):
+            properties = feature.get('properties') or {}
+            feature_ids.append(str(feature.get('id', properties.get('id', index))))
+
             try:
-                if method == 'nd':
-                    result = img.normalizedDifference(args).rename('nd').reduceRegion(
-                        reducer=ee.Reducer.mean(),
-                        geometry=point,
-                        scale=10,
-                        bestEffort=True
-                    ).getInfo()
-                    return result.get('nd', None)
-                elif method == 'ratio':
-                    result = img.select(args[0]).divide(img.select(args[1])).rename('ratio').reduceRegion(
-                        reducer=ee.Reducer.mean(),
-                        geometry=point,
-                        scale=10,
-                        bestEffort=True
-                    ).getInfo()
-                    return result.get('ratio', None)
-            except Exception as e:
-                print(f"Error calculating index: {e}")
-                return None
-
-        # --- Final return with calculated indices ---
-        return {
-            'NDVI': calculate_index(cloud_free_img, 'nd', 'B8', 'B4'),
-            'GNDVI': calculate_index(cloud_free_img, 'nd', 'B8', 'B3'),
-            'DWSI': calculate_index(cloud_free_img, 'nd', 'B8', 'B11'),
-            'RSV1': calculate_index(cloud_free_img, 'ratio', 'B4', 'B2'),
-            'data_available': True
-        }
+                if all(band in properties for band in FEATURE_ORDER):
+                    rows.append({band: None if properties[band] is None else float(properties[band])
+                                 for band in FEATURE_ORDER})
+                    continue
+                if not feature.get('geometry'):
+                    raise ValueError("feature has neither a geometry nor all band values")
+                dates = (properties.get('start_date', data.get('start_date')),
+                         properties.get('end_date', data.get('end_date')))
+                to_extract[dates].append((len(rows), geometry_resolver.resolve(feature['geometry'])[0]))
+            except (TypeError, ValueError, KeyError) as e:
+                errors[len(rows)] = f"Invalid feature: {str(e)}"
+            rows.append(None)
+
+        for (start_date, end_date), parcels in to_extract.items():
+            extracted = get_backend().extract_fields(
+                [geometry for _, geometry in parcels], start_date, end_date, reducer)
+            for (row, _), gee_data in zip(parcels, extracted):
+                rows[row] = gee_data['area_values']
+
+        predictor = WheatHealthPredictor(model_name)
+        scored = [row for row in range(len(rows)) if row not in errors]
+        predictions = dict(zip(scored, predictor.predict_batch([rows[row] for row in scored])))
+        predictions = [predictions.get(row) or {"error": errors[row]} for row in range(len(rows))]
+        # Supplied band values are not echoed back, extracted ones are new to the caller
+        for parcels in to_extract.values():
+            for row, _ in parcels:
+                predictions[row]['band_values'] = rows[row]
+        # "fields" applies to each result, e.g. ["prediction", "confidence"]
+        fields = parse_fields(data.get('fields'))
+        if fields is not None:
+            predictions = [select_fields(prediction, fields, keep=('error',)) for prediction in predictions]
 
+        return FastJsonResponse({
+            "status": "success",
+            "count": len(feature_ids),
+            "inference": predictor.inference_info(),
+            "results": dict(zip(feature_ids, predictions))
+        })
+
+    except QuotaExceeded:
+        raise
     except Exception as e:
-        logging.error(f"Error in get_indices_with_fallback: {str(e)}")
+        logging.error(f"Error in predict_batch_view: {str(e)}")
+        count_view_error('predict_batch')
+        return JsonResponse({"status": "error", "message": str(e)})
+
+@csrf_exempt
+def job_submit_view(request):
+    """
+    Queue {"kind": "predict" | "indices", "params": {...}} for the job
+    workers (manage.py run_workers). params are the /predict/ body or the
+    /api/indices/ query. An identical queued, running or recently finished
+    job is returned instead of a new one.
+    """
+    if request.method != 'POST':
+        return JsonResponse({"status": "error", "message": "Only POST requests allowed"})
+
+    try:
+        data = json.loads(request.body)
+        job, created = job_service.submit(data.get('kind'), data.get('params'))
+    except (ValueError, TypeError) as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=400)
+
+    return JsonResponse({
+        "status": "success",
+        "created": created,
+        "job": job_service.job_info(job),
+    }, status=200 if job.status == AnalysisJob.DONE else 202)
+
+def job_status_view(request, job_id):
+    """Progress of a queued job"""
+    job = AnalysisJob.objects.filter(pk=job_id).first()
+    if job is None:
+        return JsonResponse({"status": "error", "message": f"Unknown job {job_id}"}, status=404)
+    return JsonResponse({"status": "success", "job": job_service.job_info(job)})
+
+def job_result_view(request, job_id):
+    """
+    The stored response of a finished job; 202 while it is still queued or
+    running. A failed job is answered with 200 and an error payload: the
+    lookup itself succeeded.
+    """
+    job = AnalysisJob.objects.filter(pk=job_id).first()
+    if job is None:
+        return JsonResponse({"status": "error", "message": f"Unknown job {job_id}"}, status=404)
+    if job.status == AnalysisJob.FAILED:
+        return JsonResponse({"status": "error", "message": job.error, "job": job_service.job_info(job)})
+    if job.status != AnalysisJob.DONE:
+        return JsonResponse({"status": job.status, "job": job_service.job_info(job)}, status=202)
+    return FastJsonResponse(job.result, safe=False)
+
+def ee_ready_view(request):
+    """Readiness check: 200 once Earth Engine is initialized in this worker"""
+    ready = ee_session.is_ready()
+    return JsonResponse(ee_session.status(), status=200 if ready else 503)
+
+def cache_status_view(request):
+    """Hit and miss counters of the Earth Engine extraction cache"""
+    return JsonResponse(extraction_cache.stats())
+
+def quota_status_view(request):
+    """Tokens left in the shared Earth Engine request budget"""
+    return JsonResponse(admission.status())
+
+@require_GET
+@etag(lambda request: BANDS_ETAG)
+@cache_control(public=True, max_age=86400)
+def band_info_view(request):
+    """Names, wavelengths and types of the bands and indices the models use"""
+    return FastJsonResponse(BANDS_PAYLOAD)
+
+def metrics_view(request):
+    """Counters and histograms of this worker in the Prometheus text format"""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def model_status_view(request):
+    """Load time and memory footprint of the models loaded in this worker"""
+    return JsonResponse({
+        "available": model_registry.selectable(),
+        "loaded": model_registry.stats(),
+    })
+
+def point_analysis_page(request):
+    """GET endpoint to display the analysis page"""
+    return render(request, 'prediction/point_analysis.html')
+
+# Field analysed by the point-analysis page
+FIELD_POLYGON = [
+    [-4.756572600555413, 34.07453831656702],
+    [-4.756926653333988, 34.074120635290505],
+    [-4.757060763342107, 34.073920681323614],
+    [-4.757044669342034, 34.073685179882744],
+    [-4.757087584686272, 34.073187512848925],
+    [-4.757087584686272, 34.07292090430669],
+    [-4.756443854522698, 34.07284980855373],
+    [-4.754115688976768, 34.07253656361696],
+    [-4.751787539672844, 34.07225882279766],
+    [-4.7517231665838855, 34.07273427588901],
+    [-4.7518089973449635, 34.07340524253599],
+    [-4.753579255294793, 34.07354743304995],
+    [-4.754222985458367, 34.07372517085677],
+    [-4.756572600555413, 34.07453831656702]
+]
+FIELD_GEOMETRY = {'type': 'Polygon', 'coordinates': [FIELD_POLYGON]}
+
+def get_indices_with_fallback(lat, lon, start_date, end_date):
+    """
+    Safely gets vegetation indices with proper serialization from the
+    configured extraction backend
+    """
+    return get_backend().indices_with_fallback(FIELD_GEOMETRY, start_date, end_date)
+
+def _window_record(begin, indices):
+    """One point of the time series; a failed window becomes an error record"""
+    if isinstance(indices, Exception):
         return {
-            'NDVI': None,
-            'GNDVI': None,
-            'DWSI': None,
-            'RSV1': None,
+            'date': begin,
+            'error': str(indices),
             'data_available': False
         }
 
+    record = {
+        'date': begin,
+        'NDVI': indices.get('NDVI'),
+        'GNDVI': indices.get('GNDVI'),
+        'DWSI': indices.get('DWSI'),
+        'RSV1': indices.get('RSV1'),
+        'data_available': indices.get('data_available', False)
+    }
+    # indices_with_fallback reports a failed extraction in the record itself
+    if indices.get('error'):
+        record['error'] = indices['error']
+    return record
+
+def _extracted_record(begin, indices):
+    """_window_record of a window this request extracted rather than read from storage"""
+    record = _window_record(begin, indices)
+    record['source'] = None if 'error' in record else 'fresh'
+    return record
+
+def _time_series_meta(response_data, mode, window_timings):
+    """The closing _meta record for a list of window records"""
+    missing_data_count = sum(1 for record in response_data if not record['data_available'])
+
+    # Calculate success rate
+    success_rate = round(
+        (len(response_data) - missing_data_count) / len(response_data) * 100, 1
+    ) if len(response_data) > 0 else 0.0
+
+    meta = {
+        '_meta': {
+            'total_points': len(response_data),
+            'successful_points': len(response_data) - missing_data_count,
+            'missing_points': missing_data_count,
+            'success_rate': f"{success_rate}%",
+            'mode': mode,
+            'window_timings': window_timings,
+            'date_range': {
+                'start': response_data[0]['date'],
+                'end': response_data[-1]['date']
+            }
+        }
+    }
+
+    # Which windows were served from storage and which were extracted now
+    sources = [record.get('source') for record in response_data]
+    if any(sources):
+        meta['_meta']['stored_points'] = sources.count('stored')
+        meta['_meta']['fresh_points'] = sources.count('fresh')
+    return meta
+
+STREAM_FORMATS = ('ndjson', 'sse')
+COLUMN_FORMATS = ('columns', 'npz')
+
+def _encode_record(record, stream_format, event=None):
+    if stream_format == 'sse':
+        prefix = f"event: {event}\n" if event else ''
+        return f"{prefix}data: {dumps(record).decode()}\n\n"
+    return dumps(record).decode() + '\n'
+
+def _stream_time_series(lat, lon, date_ranges, stream_format):
+    """
+    Yield each window as soon as it is extracted, then the _meta record.
+    Windows arrive in completion order; every record carries its date.
+    """
+    response_data = []
+    window_timings = []
+    windows = WindowExecutor().iter_completed(
+        lambda begin, end: get_indices_with_fallback(lat, lon, begin, end), date_ranges)
+    for position, indices, timing in windows:
+        record = _extracted_record(date_ranges[position][0], indices)
+        response_data.append(record)
+        window_timings.append(timing)
+        yield _encode_record(record, stream_format)
+
+    response_data.sort(key=lambda record: record['date'])
+    window_timings.sort(key=lambda timing: timing['date'])
+    if response_data:
+        yield _encode_record(_time_series_meta(response_data, 'per_window', window_timings),
+                             stream_format, event='meta')
+
+def _encode_time_series(response_data, stream_format):
+    """index_time_series records as a stream, the _meta record last as in the per-window streams"""
+    for record in response_data:
+        yield _encode_record(record, stream_format, event='meta' if '_meta' in record else None)
+
+def index_time_series(lat, lon, date_ranges, mode='composite'):
+    """The /api/indices/ records plus _meta, also run by job workers"""
+    window_timings = None
+    if mode == 'composite':
+        # Every window in one server-side computation and one getInfo()
+        try:
+            # Stored windows are reused while no new images arrived
+            (window_results, window_sources), _ = WindowExecutor().call_with_backoff(
+                incremental_time_series, FIELD_GEOMETRY, date_ranges)
+        except QuotaExceeded:
+            raise
+        except Exception as e:
+            logging.error(f"Error in extract_index_time_series: {str(e)}")
+            window_results = [e] * len(date_ranges)
+            window_sources = [None] * len(date_ranges)
+    else:
+        window_results, window_timings = WindowExecutor().map(
+            lambda begin, end: get_indices_with_fallback(lat, lon, begin, end),
+            date_ranges)
+        for result in window_results:
+            if isinstance(result, QuotaExceeded):
+                raise result
+
+    if mode == 'composite':
+        response_data = [_window_record(begin, indices)
+                         for (begin, end), indices in zip(date_ranges, window_results)]
+        for record, source in zip(response_data, window_sources):
+            record['source'] = source
+    else:
+        response_data = [_extracted_record(begin, indices)
+                         for (begin, end), indices in zip(date_ranges, window_results)]
+
+    # Add metadata
+    if response_data:
+        response_data.append(_time_series_meta(response_data, mode, window_timings))
+
+    return response_data
+
+def _indices_query(request):
+    """(lat, lon, date_ranges, mode, format) of an /api/indices/ query"""
+    # Input validation
+    lat = float(request.GET.get('lat'))
+    lon = float(request.GET.get('lon'))
+    start_str = request.GET.get('start_date')
+    stream_format = request.GET.get('format', 'json')
+    if stream_format not in ('json',) + STREAM_FORMATS + COLUMN_FORMATS:
+        raise ValueError(f"unknown format '{stream_format}'")
+    # Streams send each window as it is ready unless a composite is asked for
+    mode = request.GET.get('mode', 'per_window' if stream_format in STREAM_FORMATS else 'composite')
+    if mode not in ('composite', 'per_window'):
+        raise ValueError(f"unknown mode '{mode}'")
+
+    start_date = datetime.strptime(start_str, '%Y-%m-%d')
+    return lat, lon, time_series_windows(start_date), mode, stream_format
+
+def _series_response(table, series_format):
+    """A SeriesTable as column-oriented JSON or as a binary .npz"""
+    if series_format == 'npz':
+        return HttpResponse(table.to_npz_bytes(), content_type='application/x-npz')
+    return FastJsonResponse(table.to_json())
+
+def _streaming_response(records, stream_format):
+    response = StreamingHttpResponse(
+        records, content_type='text/event-stream' if stream_format == 'sse' else 'application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def _field_indices_response(field_name, series_format):
+    """The season profile of a registered field, served from storage"""
+    if series_format not in ('json',) + COLUMN_FORMATS:
+        return JsonResponse({'error': f"unknown format '{series_format}'"}, status=400)
+    field = Field.objects.filter(name=field_name).first()
+    if field is None:
+        return JsonResponse({'error': f"Unknown field '{field_name}'"}, status=404)
+
+    try:
+        series = field_series(field)
+    except QuotaExceeded:
+        raise
+    except Exception as e:
+        logging.error(f"Error in field_series: {str(e)}")
+        count_view_error('field_indices')
+        return JsonResponse({'error': str(e)}, status=500)
+    if series_format in COLUMN_FORMATS:
+        return _series_response(SeriesTable.from_field_windows(window for window, _ in series), series_format)
+
+    response_data = []
+    for window, fetched in series:
+        record = _window_record(window.start_date.isoformat(), {
+            index: getattr(window, column) for index, column in INDEX_COLUMNS.items()})
+        record['data_available'] = window.data_available
+        record['prediction'] = window.prediction
+        record['confidence'] = window.confidence
+        record['source'] = 'fresh' if fetched else 'stored'
+        response_data.append(record)
+
+    if response_data:
+        response_data.append(_time_series_meta(response_data, 'precomputed', None))
+
+    return FastJsonResponse(response_data, safe=False)
+
 @require_GET
+@admission_control('bulk')
 def extract_indices_view(request):
-    """Main endpoint with proper JSON serialization"""
+    """
+    Main endpoint with proper JSON serialization. format=ndjson or
+    format=sse streams each window as soon as it is ready instead, or
+    the records of the one composite call with mode=composite.
+    field=<name> serves the stored profile of a registered field.
+    """
+    if request.GET.get('field'):
+        return _field_indices_response(request.GET['field'], request.GET.get('format', 'json'))
+
     try:
-        # Input validation
-        lat = float(request.GET.get('lat'))
-        lon = float(request.GET.get('lon'))
-        start_str = request.GET.get('start_date')
-        
-            
-        start_date = datetime.strptime(start_str, '%Y-%m-%d')
+        lat, lon, date_ranges, mode, stream_format = _indices_query(request)
     except Exception as e:
         return JsonResponse({'error': f'Invalid parameters: {str(e)}'}, status=400)
 
-    response_data = []
-    missing_data_count = 0
+    if stream_format in STREAM_FORMATS and mode == 'per_window':
+        return _streaming_response(_stream_time_series(lat, lon, date_ranges, stream_format),
+                                   stream_format)
 
-    # Time windows - biweekly then weekly
-    time_windows = (
-        [(start_date + timedelta(days=i), 7) for i in range(0, 126, 7)] + 
-        [(start_date + timedelta(days=i), 14) for i in range(127, 178, 14)]
-    )
+    response_data = index_time_series(lat, lon, date_ranges, mode)
+    if stream_format in STREAM_FORMATS:
+        return _streaming_response(_encode_time_series(response_data, stream_format), stream_format)
+    if stream_format in COLUMN_FORMATS:
+        return _series_response(SeriesTable.from_records(response_data), stream_format)
+    logging.debug(f"extract_indices_view: {len(response_data)} records")
 
-    for begin, days in time_windows:
-        end = begin + timedelta(days=days)
-        try:
-            indices = get_indices_with_fallback(lat, lon, begin.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
-            
-            response_data.append({
-                'date': begin.strftime('%Y-%m-%d'),
-                'NDVI': indices.get('NDVI'),
-                'GNDVI': indices.get('GNDVI'),
-                'DWSI': indices.get('DWSI'),
-                'RSV1': indices.get('RSV1'),
-                'data_available': indices.get('data_available', False)
-            })
-            
-            if not indices['data_available']:
-                missing_data_count += 1
-                
-        except Exception as e:
-            missing_data_count += 1
-            response_data.append({
-                'date': begin.strftime('%Y-%m-%d'),
-                'error': str(e),
-                'data_available': False
-            })
+    return FastJsonResponse(response_data, safe=False)
 
-    # Calculate success rate
-    success_rate = round(
-        (len(response_data) - missing_data_count) / len(response_data) * 100, 1
-    ) if len(response_data) > 0 else 0.0
+async def _astream_time_series(lat, lon, date_ranges, stream_format):
+    """_stream_time_series for ASGI: waits on the windows without blocking the loop"""
+    executor = WindowExecutor()
+    futures = {
+        asyncio.wrap_future(executor.submit(
+            lambda begin, end: get_indices_with_fallback(lat, lon, begin, end), begin, end)): position
+        for position, (begin, end) in enumerate(date_ranges)
+    }
 
-    # Add metadata
+    response_data = []
+    window_timings = []
+    pending = set(futures)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            indices, timing = future.result()
+            record = _extracted_record(date_ranges[futures[future]][0], indices)
+            response_data.append(record)
+            window_timings.append(timing)
+            yield _encode_record(record, stream_format)
+
+    response_data.sort(key=lambda record: record['date'])
+    window_timings.sort(key=lambda timing: timing['date'])
     if response_data:
-        response_data.append({
-            '_meta': {
-                'total_points': len(response_data),
-                'successful_points': len(response_data) - missing_data_count,
-                'missing_points': missing_data_count,
-                'success_rate': f"{success_rate}%",
-                'date_range': {
-                    'start': response_data[0]['date'],
-                    'end': response_data[-1]['date']
-                }
-            }
-        })
-        print(response_data)
+        yield _encode_record(_time_series_meta(response_data, 'per_window', window_timings),
+                             stream_format, event='meta')
+
+async def _aencode_time_series(response_data, stream_format):
+    """_encode_time_series as the async iterator ASGI streaming responses expect"""
+    for chunk in _encode_time_series(response_data, stream_format):
+        yield chunk
+
+@require_GET
+@admission_control('bulk')
+async def extract_indices_async_view(request):
+    """
+    extract_indices_view for ASGI deployments. Extractions run on the
+    bounded blocking pool, so one worker keeps many requests in flight.
+    """
+    try:
+        lat, lon, date_ranges, mode, stream_format = _indices_query(request)
+    except Exception as e:
+        return JsonResponse({'error': f'Invalid parameters: {str(e)}'}, status=400)
+
+    if stream_format in STREAM_FORMATS and mode == 'per_window':
+        return _streaming_response(_astream_time_series(lat, lon, date_ranges, stream_format),
+                                   stream_format)
+
+    response_data = await run_blocking(index_time_series, lat, lon, date_ranges, mode)
+    if stream_format in STREAM_FORMATS:
+        return _streaming_response(_aencode_time_series(response_data, stream_format), stream_format)
+    if stream_format in COLUMN_FORMATS:
+        return _series_response(SeriesTable.from_records(response_data), stream_format)
+    return FastJsonResponse(response_data, safe=False)
+
+@require_GET
+def field_series_view(request):
+    """
+    Precomputed series of many registered fields at once (fields=a,b or
+    all), as column-oriented JSON (format=columns) or .npz (format=npz).
+    Served from the memory-mapped series store when it covers them.
+    """
+    series_format = request.GET.get('format', 'columns')
+    if series_format not in COLUMN_FORMATS:
+        return JsonResponse({'error': f"unknown format '{series_format}'"}, status=400)
+
+    fields = Field.objects.all()
+    names = [name for name in request.GET.get('fields', '').split(',') if name]
+    if names:
+        fields = fields.filter(name__in=names)
+    field_ids = list(fields.values_list('pk', flat=True))
+    if len(field_ids) < len(set(names)):
+        return JsonResponse({'error': 'Unknown fields in the request'}, status=404)
 
-    return JsonResponse(response_data, safe=False)
\ No newline at end of file
+    table = series_store.table()
+    latest = FieldWindow.objects.filter(field_id__in=field_ids).aggregate(latest=Max('computed_at'))['latest']
+    written_at = series_store.written_at()
+    if (table is None or not set(field_ids) <= set(table.field_names)
+            or (latest is not None and written_at is not None and latest > written_at)):
+        # Fields precomputed, or windows refreshed by /api/indices/?field=,
+        # after the store was last written
+        table = SeriesTable.from_field_windows(
+            FieldWindow.objects.filter(field_id__in=field_ids).select_related('field'))
+    else:
+        table = table.select(field_ids)
+    return _series_response(table, series_format)
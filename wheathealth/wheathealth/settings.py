@@ -41,6 +41,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'prediction.middleware.InstrumentationMiddleware',
+    'prediction.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -118,6 +121,139 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Prediction models
+# Each pickle in models/ is loaded once per process by the model registry.
+# Set MODEL_MMAP_MODE = 'r' to memory-map the model arrays so that forked
+# workers share them instead of each holding a private copy.
+
+MODEL_MMAP_MODE = None
+
+MODEL_RELOAD_ON_CHANGE = True
+
+# Inference engine per model name: 'native' (the unpickled estimator),
+# 'flat' (NumPy tree traversal, lower per-call overhead) or 'auto' (flat
+# for small inputs, native for large batches).
+
+MODEL_ENGINES = {
+    'random_forest': 'auto',
+}
+
+# Models averaged when a request asks for model 'ensemble' (None: all)
+
+ENSEMBLE_MODELS = None
+
+# Earth Engine
+# The session is initialized lazily, once per worker. Set EE_SERVICE_ACCOUNT
+# and EE_PRIVATE_KEY_FILE to use a service account; otherwise the
+# credentials saved by `earthengine authenticate` are used.
+
+EE_PROJECT = 'certain-catcher-430110-v2'
+
+EE_SERVICE_ACCOUNT = None
+
+EE_PRIVATE_KEY_FILE = None
+
+# Where extractions run: 'earthengine', or 'local' to read Sentinel-2 scenes
+# (.npz, or GeoTIFF when rasterio is installed) from LOCAL_BACKEND_DATA_DIR
+# for offline benchmarks and tests.
+
+EXTRACTION_BACKEND = 'earthengine'
+
+LOCAL_BACKEND_DATA_DIR = BASE_DIR / 'local_scenes'
+
+# Seconds the local backend sleeps per simulated Earth Engine round trip
+
+LOCAL_BACKEND_LATENCY = 0.0
+
+# Per-worker cap on concurrent Earth Engine calls, and the retry policy for
+# requests rejected with HTTP 429 (delay doubles on every attempt).
+
+EE_MAX_CONCURRENCY = 8
+
+EE_MAX_RETRIES = 4
+
+EE_RETRY_BASE_DELAY = 1.0
+
+# Multi-parcel extractions (extract_fields) send at most this many parcels,
+# and this many polygon vertices, per reduceRegions request; larger sets are
+# split into chunks that run concurrently.
+
+EE_REDUCE_REGIONS_MAX_FEATURES = 1000
+
+EE_REDUCE_REGIONS_MAX_VERTICES = 100000
+
+# JSON, NDJSON, SSE and .npz responses of at least this many bytes are
+# compressed (brotli if the brotli package is installed, else gzip) for
+# clients that accept it; streamed responses always are.
+
+RESPONSE_COMPRESSION_MIN_BYTES = 1024
+
+# Threads the async views (/api/async/...) hand blocking Earth Engine and
+# model calls to; bounds the extractions one ASGI worker has in flight.
+
+ASYNC_BLOCKING_WORKERS = 64
+
+# Admission control of Earth Engine requests
+# Every round trip takes a token from one bucket shared by all workers:
+# STORE 'database' (QuotaBucket table) or 'django' (the Django cache named
+# by ALIAS, which must then be shared, e.g. Redis). The bucket holds BURST
+# tokens and refills at RATE per second; size both against the project's
+# Earth Engine quota. A priority may only draw it down to RESERVES[priority]
+# x BURST, so bulk time series leave room for /predict/; requests past that
+# get 429 with Retry-After. Calls made outside a request (job workers,
+# streamed responses) wait up to MAX_WAIT seconds instead.
+
+EE_ADMISSION = {
+    'ENABLED': True,
+    'STORE': 'database',
+    'ALIAS': 'default',
+    'RATE': 10.0,
+    'BURST': 100.0,
+    'RESERVES': {'interactive': 0.0, 'bulk': 0.25, 'background': 0.5},
+    'MAX_WAIT': 30.0,
+}
+
+# Earth Engine extraction cache
+# STORE is 'database' (ExtractionCacheEntry table, LRU-evicted past
+# MAX_ENTRIES) or 'django' (the Django cache named by ALIAS). Windows that
+# include today expire after RECENT_TTL seconds, older ones never do.
+
+EE_CACHE = {
+    'ENABLED': True,
+    'STORE': 'database',
+    'ALIAS': 'default',
+    'MAX_ENTRIES': 5000,
+    'RECENT_TTL': 3600,
+}
+
+# Request geometries are canonicalized (oriented, simplified within
+# GEOMETRY_TOLERANCE_M metres, rounded) before hashing, and a polygon that
+# overlaps a registered or earlier field by GEOMETRY_MIN_OVERLAP
+# (intersection over union) shares that field's extraction cache entries.
+# The requested polygon itself is always the one analysed.
+
+GEOMETRY_TOLERANCE_M = 10
+
+GEOMETRY_MIN_OVERLAP = 0.95
+
+# Column store of every field's precomputed series, rewritten by
+# `manage.py precompute_indices` and memory-mapped by the workers: a
+# directory of .npy files, or .parquet when pyarrow is installed.
+
+SERIES_STORE_PATH = BASE_DIR / 'series_store'
+
+# Analysis jobs (/api/jobs/, run by `manage.py run_workers`)
+# Finished results are reused by identical submissions for RESULT_TTL seconds
+# (None: forever). Jobs running longer than STALE_AFTER seconds are assumed
+# lost with their worker and requeued, up to MAX_ATTEMPTS runs in total.
+
+JOBS = {
+    'RESULT_TTL': 86400,
+    'STALE_AFTER': 900,
+    'MAX_ATTEMPTS': 3,
+    'POLL_INTERVAL': 1.0,
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
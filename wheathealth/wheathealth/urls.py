@@ -1,6 +1,9 @@
 from django.contrib import admin
 from django.urls import path, include
-from prediction.views import wheat_health_map, predict_wheat_health
+from prediction.views import wheat_health_map, predict_wheat_health, model_status_view
+from prediction.views import predict_batch_view, cache_status_view, ee_ready_view, metrics_view, band_info_view
+from prediction.views import job_submit_view, job_status_view, job_result_view, quota_status_view
+from prediction.views import predict_wheat_health_async, extract_indices_async_view, field_series_view
 # from prediction.views import get_point_indices #growth_stage_data
 from prediction.views import  point_analysis_page, extract_indices_view
 
@@ -13,6 +16,21 @@ urlpatterns = [
     # path('get-point-indices/', get_point_indices, name='get_point_indices'),
     # path('extract_indices_view', extract_indices_view, name='extract_indices_view'),
     path('point-analysis-page/', point_analysis_page, name='point_analysis_page'),
+    # Prometheus scrape target; the counters are per worker process
+    path('metrics/', metrics_view, name='metrics'),
     path('api/', include([
-        path('indices/', extract_indices_view, name='get_indices'),])),
+        path('indices/', extract_indices_view, name='get_indices'),
+        # Async variants for ASGI deployments (wheathealth/asgi.py)
+        path('async/predict/', predict_wheat_health_async, name='predict_wheat_health_async'),
+        path('async/indices/', extract_indices_async_view, name='get_indices_async'),
+        path('fields/series/', field_series_view, name='field_series'),
+        path('predict/batch/', predict_batch_view, name='predict_batch'),
+        path('models/', model_status_view, name='model_status'),
+        path('bands/', band_info_view, name='band_info'),
+        path('cache/', cache_status_view, name='cache_status'),
+        path('ee/ready/', ee_ready_view, name='ee_ready'),
+        path('ee/quota/', quota_status_view, name='ee_quota'),
+        path('jobs/', job_submit_view, name='job_submit'),
+        path('jobs/<int:job_id>/', job_status_view, name='job_status'),
+        path('jobs/<int:job_id>/result/', job_result_view, name='job_result'),])),
 ]
\ No newline at end of file